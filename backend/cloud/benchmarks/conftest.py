@@ -0,0 +1,38 @@
+"""
+Замеры основных точек API с pytest-benchmark.
+Запуск из каталога backend/cloud:
+
+    pip install -r benchmarks/requirements.txt
+    pytest benchmarks --benchmark-json=benchmark.json
+
+Результаты разных коммитов сравниваются командой pytest-benchmark compare.
+Замеры одновременной нагрузки выполняет команда manage.py benchmark
+"""
+import pytest
+from django.test import Client
+
+from cloud_api.benchmarks import seed, remove_content, without_download_limits
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup('cloud', 'Данные для замеров')
+    group.addoption('--bench-users', type=int, default=2, help='Количество синтетических пользователей')
+    group.addoption('--bench-files', type=int, default=50, help='Количество файлов у каждого пользователя')
+    group.addoption('--bench-file-size', type=int, default=64 * 1024, help='Размер файла в байтах')
+
+
+@pytest.fixture
+def bench_data(request, transactional_db):
+    # Данные фиксируются в базе, поэтому удаление содержимого с диска при очистке видит все созданные файлы
+    data = seed(request.config.getoption('bench_users'), request.config.getoption('bench_files'),
+                request.config.getoption('bench_file_size'))
+    with without_download_limits():
+        yield data
+    remove_content()
+
+
+@pytest.fixture
+def bench_client(bench_data):
+    client = Client()
+    client.force_login(bench_data.users[0])
+    return client
@@ -0,0 +1,36 @@
+import itertools
+
+import pytest
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+
+from cloud_api.benchmarks import SCENARIOS, consume, get_peak_rss
+
+
+@pytest.mark.parametrize('name, expected_status', [
+    ('login', 200),
+    ('upload', 201),
+    ('download', 200),
+    ('range', 206),
+    ('list', 200),
+    ('external', 200),
+])
+def test_endpoint(benchmark, bench_data, bench_client, name, expected_status):
+    function, authenticated = SCENARIOS[name]
+    client = bench_client if authenticated else Client()
+    user = bench_data.users[0]
+    counter = itertools.count()
+
+    def request():
+        return consume(function(client, bench_data, user, next(counter)))
+
+    # Количество запросов к базе считается по отдельному прогону, чтобы не влиять на замер времени
+    with CaptureQueriesContext(connection) as queries:
+        response = request()
+    assert response.status_code == expected_status
+
+    response = benchmark(request)
+    assert response.status_code == expected_status
+    benchmark.extra_info['db_queries'] = len(queries)
+    benchmark.extra_info['peak_rss_bytes'] = get_peak_rss()
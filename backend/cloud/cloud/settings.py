@@ -46,6 +46,8 @@ INSTALLED_APPS = [
 
 #    (middleware)
 MIDDLEWARE = [
+    'cloud_api.middleware.MetricsMiddleware',
+    'cloud_api.middleware.RequestIdMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -142,6 +144,147 @@ STATIC_ROOT = 'staticfiles'
 MEDIA_URL = f'/{os.getenv("CLOUD_DIR")}/'
 MEDIA_ROOT = os.path.join(BASE_DIR, os.getenv('CLOUD_DIR'))
 
+#        (0   )
+STORAGE_DEFAULT_QUOTA = int(os.getenv('STORAGE_DEFAULT_QUOTA', 0))
+
+#   MEDIA_ROOT   ,   SHA-256
+BLOB_DIR = os.getenv('BLOB_DIR', '.blobs')
+
+#   : ''  , 'gzip'  'zstd' (  zstandard,   gzip)
+STORAGE_COMPRESSION = os.getenv('STORAGE_COMPRESSION', '')
+#        (),
+#           
+STORAGE_COMPRESSION_MIN_SIZE = int(os.getenv('STORAGE_COMPRESSION_MIN_SIZE', 4096))
+STORAGE_COMPRESSION_MAX_RATIO = float(os.getenv('STORAGE_COMPRESSION_MAX_RATIO', 0.9))
+
+#   :  (,   ),      ,
+#     ,    
+COLD_STORAGE_ROOT = os.path.join(BASE_DIR, os.getenv('COLD_STORAGE_DIR', 'cold_storage'))
+COLD_STORAGE_IDLE_DAYS = int(os.getenv('COLD_STORAGE_IDLE_DAYS', 30))
+
+#   : 'local'   MEDIA_ROOT  COLD_STORAGE_ROOT,
+# 's3'  S3-   (  boto3). MEDIA_ROOT    
+#      
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'local')
+#   ( MinIO    ;   AWS),    
+# (      boto3:  , , )
+S3_ENDPOINT_URL = os.getenv('S3_ENDPOINT_URL') or None
+S3_REGION = os.getenv('S3_REGION') or None
+S3_ACCESS_KEY_ID = os.getenv('S3_ACCESS_KEY_ID') or None
+S3_SECRET_ACCESS_KEY = os.getenv('S3_SECRET_ACCESS_KEY') or None
+#      ;  (   ),      
+S3_BUCKET = os.getenv('S3_BUCKET', '')
+S3_PREFIX = os.getenv('S3_PREFIX', 'hot/')
+S3_COLD_BUCKET = os.getenv('S3_COLD_BUCKET') or S3_BUCKET
+S3_COLD_PREFIX = os.getenv('S3_COLD_PREFIX', 'cold/')
+S3_COLD_STORAGE_CLASS = os.getenv('S3_COLD_STORAGE_CLASS', '')
+#      ()   (multipart upload)  
+#    
+S3_MULTIPART_THRESHOLD = int(os.getenv('S3_MULTIPART_THRESHOLD', 64 * 1024 * 1024))
+S3_MULTIPART_CHUNK_SIZE = int(os.getenv('S3_MULTIPART_CHUNK_SIZE', 16 * 1024 * 1024))
+S3_MAX_CONCURRENCY = int(os.getenv('S3_MAX_CONCURRENCY', 4))
+#    ,         (.)
+S3_PRESIGNED_URL_TTL = int(os.getenv('S3_PRESIGNED_URL_TTL', 5 * 60))
+
+#     ( scrub_storage):     
+#   (.),          
+SCRUB_CHECKPOINT_PATH = os.path.join(BASE_DIR, os.getenv('SCRUB_CHECKPOINT_FILE', 'scrub_checkpoint.json'))
+SCRUB_GRACE_PERIOD = int(os.getenv('SCRUB_GRACE_PERIOD', 60 * 60))
+
+# :       (),   (.),
+#  ,  ,     ()
+#       (.),      
+PREVIEW_CACHE_ROOT = os.path.join(BASE_DIR, os.getenv('PREVIEW_CACHE_DIR', 'previews'))
+PREVIEW_CACHE_MAX_SIZE = int(os.getenv('PREVIEW_CACHE_MAX_SIZE', 512 * 1024 * 1024))
+PREVIEW_SIZE = int(os.getenv('PREVIEW_SIZE', 256))
+PREVIEW_WORKERS = int(os.getenv('PREVIEW_WORKERS', 2))
+PREVIEW_MAX_SOURCE_SIZE = int(os.getenv('PREVIEW_MAX_SOURCE_SIZE', 50 * 1024 * 1024))
+PREVIEW_TIMEOUT = float(os.getenv('PREVIEW_TIMEOUT', 10))
+
+#  ,  SHA-256     
+FILE_UPLOAD_HANDLERS = [
+    'cloud_api.uploadhandlers.HashingMemoryFileUploadHandler',
+    'cloud_api.uploadhandlers.HashingTemporaryFileUploadHandler',
+]
+
+#  
+#    ,     (.)     ()
+UPLOAD_SESSION_ROOT = os.path.join(BASE_DIR, os.getenv('UPLOAD_SESSION_DIR', 'upload_sessions'))
+UPLOAD_SESSION_TTL = int(os.getenv('UPLOAD_SESSION_TTL', 24 * 60 * 60))
+UPLOAD_CHUNK_SIZE = int(os.getenv('UPLOAD_CHUNK_SIZE', 64 * 1024))
+
+#  
+#    -: ''    Django, 'nginx'  X-Accel-Redirect, 'sendfile'  X-Sendfile
+DOWNLOAD_OFFLOAD = os.getenv('DOWNLOAD_OFFLOAD', '')
+#  location nginx,   MEDIA_ROOT
+DOWNLOAD_OFFLOAD_PREFIX = os.getenv('DOWNLOAD_OFFLOAD_PREFIX', '/protected/')
+DOWNLOAD_CHUNK_SIZE = int(os.getenv('DOWNLOAD_CHUNK_SIZE', 64 * 1024))
+#        (   ASGI)
+ASYNC_DOWNLOADS = os.getenv('ASYNC_DOWNLOADS') == 'True'
+#             (.)
+#  ,     
+DOWNLOAD_STATS_FLUSH_INTERVAL = float(os.getenv('DOWNLOAD_STATS_FLUSH_INTERVAL', 5))
+DOWNLOAD_STATS_MAX_PENDING = int(os.getenv('DOWNLOAD_STATS_MAX_PENDING', 10000))
+#    ,      (0   ):
+#   ,     ( )   
+#    (/),     ,   .
+#    ,       
+DOWNLOAD_USER_CONCURRENCY = int(os.getenv('DOWNLOAD_USER_CONCURRENCY', 0))
+DOWNLOAD_USER_RATE = float(os.getenv('DOWNLOAD_USER_RATE', 0))
+DOWNLOAD_USER_BURST = int(os.getenv('DOWNLOAD_USER_BURST', 30))
+DOWNLOAD_USER_BANDWIDTH = int(os.getenv('DOWNLOAD_USER_BANDWIDTH', 0))
+DOWNLOAD_LINK_CONCURRENCY = int(os.getenv('DOWNLOAD_LINK_CONCURRENCY', 0))
+DOWNLOAD_LINK_RATE = float(os.getenv('DOWNLOAD_LINK_RATE', 0))
+DOWNLOAD_LINK_BURST = int(os.getenv('DOWNLOAD_LINK_BURST', 10))
+DOWNLOAD_LINK_BANDWIDTH = int(os.getenv('DOWNLOAD_LINK_BANDWIDTH', 0))
+DOWNLOAD_IP_CONCURRENCY = int(os.getenv('DOWNLOAD_IP_CONCURRENCY', 0))
+DOWNLOAD_IP_RATE = float(os.getenv('DOWNLOAD_IP_RATE', 0))
+DOWNLOAD_IP_BURST = int(os.getenv('DOWNLOAD_IP_BURST', 30))
+DOWNLOAD_IP_BANDWIDTH = int(os.getenv('DOWNLOAD_IP_BANDWIDTH', 0))
+#    ,       :
+# ,   ,   
+DOWNLOAD_SLOT_TTL = int(os.getenv('DOWNLOAD_SLOT_TTL', 60 * 60))
+
+#      :       (.)
+EXTERNAL_LINK_CACHE_SIZE = int(os.getenv('EXTERNAL_LINK_CACHE_SIZE', 10000))
+EXTERNAL_LINK_CACHE_TTL = float(os.getenv('EXTERNAL_LINK_CACHE_TTL', 60))
+
+# API-
+#  HMAC,    (       )
+API_TOKEN_HASH_KEY = os.getenv('API_TOKEN_HASH_KEY') or SECRET_KEY
+#      :       (.).
+#              
+API_TOKEN_CACHE_SIZE = int(os.getenv('API_TOKEN_CACHE_SIZE', 10000))
+API_TOKEN_CACHE_TTL = float(os.getenv('API_TOKEN_CACHE_TTL', 30))
+
+#      
+#     ,     (.)
+#  ,      ,     (.)
+CHANGES_PAGE_SIZE = int(os.getenv('CHANGES_PAGE_SIZE', 500))
+CHANGES_MAX_WAIT = float(os.getenv('CHANGES_MAX_WAIT', 30))
+CHANGES_POLL_INTERVAL = float(os.getenv('CHANGES_POLL_INTERVAL', 1))
+#        (.):  WSGI    ,
+#      ,       (ASYNC_DOWNLOADS)
+CHANGES_SYNC_MAX_WAIT = float(os.getenv('CHANGES_SYNC_MAX_WAIT', 0))
+# ,      (.),      
+#      
+SYNC_CLIENT_TTL = int(os.getenv('SYNC_CLIENT_TTL', 30 * 24 * 60 * 60))
+#      (.)    ,      :
+# ,     ,     
+CHANGES_RETENTION = int(os.getenv('CHANGES_RETENTION', 7 * 24 * 60 * 60))
+
+#  
+#       : 'thread'  , 'process'  
+JOBS_WORKERS = int(os.getenv('JOBS_WORKERS', 4))
+JOBS_POOL = os.getenv('JOBS_POOL', 'thread')
+#    (.)      
+JOBS_POLL_INTERVAL = float(os.getenv('JOBS_POLL_INTERVAL', 1))
+JOBS_DELETE_BATCH_SIZE = int(os.getenv('JOBS_DELETE_BATCH_SIZE', 1000))
+#           
+JOBS_STALE_TIMEOUT = int(os.getenv('JOBS_STALE_TIMEOUT', 6 * 60 * 60))
+#     (.)
+JOBS_RESULT_TTL = int(os.getenv('JOBS_RESULT_TTL', 7 * 24 * 60 * 60))
+
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
@@ -153,6 +296,39 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 #    
 AUTH_USER_MODEL = 'cloud_api.CloudUser'
 
+#     .    ,    
+AUTHENTICATION_BACKENDS = [
+    'cloud_api.authentication.CachedModelBackend',
+    'django.contrib.auth.backends.ModelBackend',
+]
+
+# 
+#        (, 'django.core.cache.backends.redis.RedisCache'
+#     CACHE_LOCATION).           
+CACHE_BACKEND = os.getenv('CACHE_BACKEND', '')
+CACHE_LOCATION = os.getenv('CACHE_LOCATION', '')
+CACHES = {
+    'local': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'cloud-local',
+        'OPTIONS': {'MAX_ENTRIES': int(os.getenv('LOCAL_CACHE_MAX_ENTRIES', 10000))},
+    },
+}
+CACHES['default'] = {'BACKEND': CACHE_BACKEND, 'LOCATION': CACHE_LOCATION} if CACHE_BACKEND else CACHES['local']
+#   ,    :   (, Redis,  
+#    )    .     incr
+THROTTLE_CACHE_BACKEND = os.getenv('THROTTLE_CACHE_BACKEND', '')
+THROTTLE_CACHE_LOCATION = os.getenv('THROTTLE_CACHE_LOCATION', '')
+CACHES['throttle'] = ({'BACKEND': THROTTLE_CACHE_BACKEND, 'LOCATION': THROTTLE_CACHE_LOCATION}
+                      if THROTTLE_CACHE_BACKEND else CACHES['default'])
+
+#    ,    
+SESSION_ENGINE = 'cloud_api.sessions'
+#             (.).
+# ,    ,      AUTH_CACHE_LOCAL_TTL
+AUTH_CACHE_TTL = int(os.getenv('AUTH_CACHE_TTL', 300))
+AUTH_CACHE_LOCAL_TTL = int(os.getenv('AUTH_CACHE_LOCAL_TTL', 15))
+
 
 # DRF settings
 #  DRF (Django REST Framework)
@@ -160,8 +336,12 @@ AUTH_USER_MODEL = 'cloud_api.CloudUser'
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'rest_framework.authentication.BasicAuthentication',
+        'cloud_api.authentication.ApiTokenAuthentication',
         'rest_framework.authentication.SessionAuthentication',
-    ]
+    ],
+    #    :        X-Forwarded-For
+    # (    )
+    'NUM_PROXIES': int(os.getenv('NUM_PROXIES')) if os.getenv('NUM_PROXIES') else None,
 }
 
 #    CSRF  
@@ -192,6 +372,14 @@ SESSION_COOKIE_SECURE = os.getenv('SESSION_COOKIE_SECURE')
 # LOGGING
 
 #  
+#    :       .
+# LOG_FORMAT  'json' (  JSON  )  'text'.
+# LOG_QUEUE_SIZE    ;       .
+# LOG_SAMPLE_RATES     ,  'download:0.1,upload:0.5'
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json')
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', 10000))
+LOG_SAMPLE_RATES = os.getenv('LOG_SAMPLE_RATES', '')
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
@@ -201,12 +389,17 @@ LOGGING = {
             'format': '{asctime} : {levelname} : {module} : {filename} : {message}',
             'style': '{',
         },
+        'json': {
+            '()': 'cloud_api.logs.JsonFormatter',
+        },
     },
 
     'handlers': {
         'console': {
-            'class': 'logging.StreamHandler',
-            'formatter': 'console_format',
+            'class': 'cloud_api.logs.BackgroundHandler',
+            'formatter': 'json' if LOG_FORMAT == 'json' else 'console_format',
+            'maxsize': LOG_QUEUE_SIZE,
+            'sample_rates': LOG_SAMPLE_RATES,
         },
     },
 
@@ -2,7 +2,7 @@ from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
 
 from .forms import CloudUserCreationForm, CloudUserChangeForm
-from .models import CloudUser, File
+from .models import ApiToken, CloudUser, File, Job
 
 class CloudUserAdmin(UserAdmin):
     add_form = CloudUserCreationForm
@@ -13,3 +13,5 @@ class CloudUserAdmin(UserAdmin):
 
 admin.site.register(CloudUser, CloudUserAdmin)
 admin.site.register(File)
+admin.site.register(Job)
+admin.site.register(ApiToken)
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class CloudApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'cloud_api'
+
+    def ready(self):
+        # Регистрация обработчиков сигналов моделей
+        from . import signals  # noqa: F401
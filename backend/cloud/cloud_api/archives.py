@@ -0,0 +1,100 @@
+import os
+import re
+import zipfile
+
+from cloud.settings import DOWNLOAD_CHUNK_SIZE
+from .compression import open_content
+
+# Расширения уже сжатых форматов: такие файлы кладутся в архив без повторного сжатия
+COMPRESSED_EXTENSIONS = {
+    '7z', 'apk', 'avi', 'bz2', 'docx', 'flac', 'gif', 'gz', 'heic', 'jar', 'jpeg', 'jpg', 'm4a', 'm4v', 'mkv',
+    'mov', 'mp3', 'mp4', 'odp', 'ods', 'odt', 'ogg', 'png', 'pptx', 'rar', 'tgz', 'webm', 'webp', 'xlsx', 'xz',
+    'zip', 'zst',
+}
+
+
+class ZipStreamBuffer:
+    """
+    Буфер, в который zipfile пишет архив. Метода seek нет, поэтому zipfile
+    пишет архив последовательно (с дескрипторами данных), а генератор забирает накопленные байты
+    """
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b''.join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def get_path_parts(name):
+    # Части пути без пустых частей и ссылок на текущий и родительский каталоги; разделители — «/» и «\\»
+    return [part for part in re.split(r'[\\/]+', name) if part not in ('', '.', '..')]
+
+
+def safe_basename(filename):
+    """
+    Оставляет от имени файла последнюю часть пути, чтобы при распаковке архива файл не попал в другой каталог
+    """
+    parts = get_path_parts(filename)
+    return parts[-1] if parts else 'file'
+
+
+def unique_name(name, taken):
+    """
+    Возвращает имя, которого ещё нет в архиве, добавляя к повторяющемуся имени номер: «отчёт (2).pdf»
+    """
+    stem, extension = os.path.splitext(name)
+    candidate, number = name, 1
+    while candidate in taken:
+        number += 1
+        candidate = f'{stem} ({number}){extension}'
+    taken.add(candidate)
+    return candidate
+
+
+def get_compress_type(filename):
+    """
+    Выбирает метод сжатия по расширению файла
+    """
+    extension = os.path.splitext(filename)[1].lower().lstrip('.')
+    return zipfile.ZIP_STORED if extension in COMPRESSED_EXTENSIONS else zipfile.ZIP_DEFLATED
+
+
+def stream_zip(entries):
+    """
+    Генератор ZIP-архива (с поддержкой ZIP64) из последовательности (имя в архиве, хранилище, путь к содержимому
+    в хранилище, дата, размер, метод сжатия на диске). Сжатое содержимое распаковывается на лету.
+    Из имён в архиве убираются абсолютные пути и ссылки на родительский каталог, повторяющиеся имена нумеруются.
+    Архив формируется на лету: без временных файлов и без накопления в памяти больше одного блока
+    """
+    buffer = ZipStreamBuffer()
+    taken = set()
+    with zipfile.ZipFile(buffer, 'w', allowZip64=True) as archive:
+        for arcname, storage, name, date, size, encoding in entries:
+            arcname = unique_name('/'.join(get_path_parts(arcname)) or 'file', taken)
+            info = zipfile.ZipInfo(arcname, date_time=max(date.timetuple()[:6], (1980, 1, 1, 0, 0, 0)))
+            info.compress_type = get_compress_type(arcname)
+            info.external_attr = 0o644 << 16
+            # Размер нужен заранее, чтобы zipfile сразу записал заголовок ZIP64 для больших файлов
+            info.file_size = size
+            with open_content(storage.open(name), encoding) as source, archive.open(info, 'w') as target:
+                for chunk in iter(lambda: source.read(DOWNLOAD_CHUNK_SIZE), b''):
+                    target.write(chunk)
+                    data = buffer.pop()
+                    if data:
+                        yield data
+            yield buffer.pop()
+    yield buffer.pop()
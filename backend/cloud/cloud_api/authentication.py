@@ -0,0 +1,122 @@
+import copy
+import hmac
+import hashlib
+import secrets
+import logging
+
+from django.contrib.auth.backends import ModelBackend
+from django.utils import timezone
+from rest_framework.authentication import BaseAuthentication, get_authorization_header
+from rest_framework.exceptions import AuthenticationFailed, PermissionDenied
+from rest_framework.permissions import SAFE_METHODS
+
+from cloud.settings import API_TOKEN_HASH_KEY, API_TOKEN_CACHE_SIZE, API_TOKEN_CACHE_TTL
+from .caches import TTLCache, auth_cache
+from .models import ApiToken
+
+logger = logging.getLogger('main')
+
+# Префикс выпускаемых токенов: по нему токен легко найти в коде и логах при утечке
+TOKEN_PREFIX = 'cld_'
+# Количество случайных символов токена, которые сохраняются открыто для отображения в списке
+VISIBLE_LENGTH = 8
+# Схемы заголовка Authorization, в которых передаётся токен
+KEYWORDS = (b'token', b'bearer')
+
+# Проверенные токены по их хешу. Сам токен в памяти не хранится
+verified_token_cache = TTLCache(API_TOKEN_CACHE_SIZE, API_TOKEN_CACHE_TTL)
+
+
+def hash_token(key):
+    """
+    Хеширует токен HMAC-SHA256. В отличие от паролей, токен случаен и длинен,
+    поэтому медленный хеш не нужен: проверка стоит одного вычисления HMAC
+    """
+    return hmac.new(API_TOKEN_HASH_KEY.encode(), key.encode(), hashlib.sha256).hexdigest()
+
+
+def generate_api_token():
+    """
+    Генерирует токен и возвращает (токен, его видимое начало, хеш)
+    """
+    key = TOKEN_PREFIX + secrets.token_urlsafe(32)
+    return key, key[:len(TOKEN_PREFIX) + VISIBLE_LENGTH], hash_token(key)
+
+
+def get_user_cache_key(user_id):
+    return f'cloud_api.user.{user_id}'
+
+
+def forget_user(user_id):
+    """
+    Удаляет пользователя из кеша сессий и из кеша проверенных токенов, например при его изменении или удалении
+    """
+    auth_cache.delete(get_user_cache_key(user_id))
+    discard_user_tokens(user_id)
+
+
+def discard_user_tokens(user_id):
+    """
+    Удаляет из кеша проверенные токены пользователя, например при его изменении или удалении
+    """
+    verified_token_cache.discard(*ApiToken.objects.filter(cloud_user_id=user_id).values_list('key_hash', flat=True))
+
+
+class CachedModelBackend(ModelBackend):
+    """
+    Стандартный бэкенд аутентификации, который ищет пользователя сессии сначала в кеше
+    """
+    def get_user(self, user_id):
+        key = get_user_cache_key(user_id)
+        user = auth_cache.get(key)
+        if user is None:
+            user = super().get_user(user_id)
+            if user is None:
+                return None
+            auth_cache.set(key, user)
+        return user if self.user_can_authenticate(user) else None
+
+
+class ApiTokenAuthentication(BaseAuthentication):
+    """
+    Аутентификация по API-токену из заголовка «Authorization: Token <токен>» или «Authorization: Bearer <токен>».
+    Токен ищется по уникальному индексу его HMAC, проверенные токены кешируются в памяти процесса.
+    Токен с областью read допускает только безопасные методы, для изменений нужна область write
+    """
+    def authenticate(self, request):
+        auth = get_authorization_header(request).split()
+        if not auth or auth[0].lower() not in KEYWORDS:
+            return None
+        if len(auth) != 2:
+            raise AuthenticationFailed('Неверный заголовок авторизации.')
+        try:
+            key = auth[1].decode('ascii')
+        except UnicodeError:
+            raise AuthenticationFailed('Неверный заголовок авторизации.')
+
+        token = self.get_token(key)
+        if token is None or token.is_expired():
+            raise AuthenticationFailed('Токен недействителен или истёк.')
+        if not token.cloud_user.is_active:
+            raise AuthenticationFailed('Пользователь неактивен или удалён.')
+        scope = ApiToken.READ if request.method in SAFE_METHODS else ApiToken.WRITE
+        if scope not in token.scopes:
+            raise PermissionDenied(f'Токен не даёт доступа к области {scope}.')
+        # Каждый запрос получает свою копию пользователя, чтобы изменения в представлении не попадали в кеш
+        return copy.copy(token.cloud_user), token
+
+    @staticmethod
+    def get_token(key):
+        key_hash = hash_token(key)
+        token = verified_token_cache.get(key_hash)
+        if token is None:
+            token = ApiToken.objects.select_related('cloud_user').filter(key_hash=key_hash).first()
+            if token is None or not hmac.compare_digest(token.key_hash, key_hash):
+                return None
+            # Дата использования обновляется при загрузке в кеш, а не при каждом запросе
+            ApiToken.objects.filter(pk=token.pk).update(last_used=timezone.now())
+            verified_token_cache.set(key_hash, token)
+        return token
+
+    def authenticate_header(self, request):
+        return 'Token'
@@ -0,0 +1,256 @@
+import os
+import sys
+import math
+import time
+import uuid
+import hashlib
+import platform
+import resource
+import threading
+import subprocess
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+
+import django
+from django.contrib.auth.hashers import make_password
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import Client
+
+from cloud.settings import UPLOAD_SESSION_ROOT
+from .metrics import QueryTimer
+from .models import CloudUser, Blob, File
+from .search import index_files
+from .stats import download_stats
+from .storage import cold_storage, hot_storage
+from .throttling import download_throttle
+from .utils import generate_external_link_key
+
+# Пароль синтетических пользователей (хешируется один раз для всех)
+BENCHMARK_PASSWORD = 'Bench1!password'
+# Размер диапазона, запрашиваемого при частичном скачивании
+RANGE_SIZE = 64 * 1024
+
+
+class BenchmarkData:
+    """
+    Синтетические пользователи и файлы, по которым выполняются запросы
+    """
+    def __init__(self, users, files, file_size):
+        self.users = users
+        self.files = files
+        self.file_size = file_size
+        self.files_by_user = {}
+        for file in files:
+            self.files_by_user.setdefault(file.cloud_user_id, []).append(file)
+        self.link_keys = [file.external_link_key for file in files]
+
+
+def seed(users=10, files_per_user=100, file_size=64 * 1024):
+    """
+    Создаёт пользователей и файлы со случайным содержимым в хранилище содержимого
+    """
+    password = make_password(BENCHMARK_PASSWORD)
+    prefix = uuid.uuid4().hex[:6]
+    # Нулевая квота — объём не ограничен
+    CloudUser.objects.bulk_create([
+        CloudUser(username=f'bench{prefix}{index}', email=f'bench{prefix}{index}@example.com', password=password,
+                  storage_directory=f'bench{prefix}{index}', storage_quota=0, is_staff=True)
+        for index in range(users)
+    ])
+    cloud_users = list(CloudUser.objects.filter(username__startswith=f'bench{prefix}').order_by('pk'))
+
+    files = []
+    os.makedirs(UPLOAD_SESSION_ROOT, exist_ok=True)
+    for cloud_user in cloud_users:
+        user_files = []
+        for index in range(files_per_user):
+            data = os.urandom(file_size)
+            source_path = os.path.join(UPLOAD_SESSION_ROOT, f'bench-{uuid.uuid4().hex}')
+            with open(source_path, 'wb') as source:
+                source.write(data)
+            blob = Blob.store(source_path, hashlib.sha256(data).hexdigest(), file_size)
+            user_files.append(File(cloud_user=cloud_user, filename=f'file{index:06d}.bin', size=file_size,
+                                   content=blob.name, blob=blob))
+        File.objects.bulk_create(user_files)
+        CloudUser.change_usage(cloud_user.pk, file_size * files_per_user, files_per_user)
+        files.extend(user_files)
+
+    files = list(File.objects.filter(cloud_user__in=cloud_users).order_by('pk'))
+    for file in files:
+        file.external_link_key = generate_external_link_key(file.pk)
+    File.objects.bulk_update(files, ['external_link_key'], batch_size=1000)
+    index_files(files)
+    return BenchmarkData(cloud_users, files, file_size)
+
+
+def remove_content():
+    """
+    Удаляет с диска содержимое, созданное во время замеров (сами записи удаляются вместе с тестовой базой).
+    Накопленная статистика скачиваний записывается сразу, пока временная база ещё существует
+    """
+    download_stats.flush()
+    names = [blob.name for blob in Blob.objects.iterator()]
+    hot_storage.delete(names)
+    cold_storage.delete(names)
+
+
+def consume(response):
+    # Потоковый ответ считается выполненным, когда прочитано всё тело
+    if response.streaming:
+        for _ in response.streaming_content:
+            pass
+    if hasattr(response, 'close'):
+        response.close()
+    return response
+
+
+@contextmanager
+def without_download_limits():
+    """
+    Снимает ограничения скачивания на время замеров: все запросы замеров идут с одного адреса
+    от нескольких пользователей и иначе упирались бы в ограничения, а не в обработку запросов
+    """
+    limits = download_throttle.limits
+    download_throttle.configure({})
+    try:
+        yield
+    finally:
+        download_throttle.configure(limits)
+
+
+def user_file(data, user, index):
+    files = data.files_by_user[user.pk]
+    return files[index % len(files)]
+
+
+def login(client, data, user, index):
+    # Каждый вход выполняется с чистого клиента, иначе сессия предыдущего входа уже действует
+    client.cookies.clear()
+    return client.post('/api/login/', {'username': user.username, 'password': BENCHMARK_PASSWORD},
+                       content_type='application/json')
+
+
+def upload(client, data, user, index):
+    content = SimpleUploadedFile(f'upload-{uuid.uuid4().hex}.bin', os.urandom(data.file_size))
+    return client.post('/api/files/upload/', {'cloud_user': user.pk, 'content': content})
+
+
+def download(client, data, user, index):
+    return client.get(f'/api/files/{user_file(data, user, index).pk}/download/')
+
+
+def ranged_download(client, data, user, index):
+    file = user_file(data, user, index)
+    start = (index * RANGE_SIZE) % max(file.size - RANGE_SIZE, 1)
+    end = min(start + RANGE_SIZE, file.size) - 1
+    return client.get(f'/api/files/{file.pk}/download/', HTTP_RANGE=f'bytes={start}-{end}')
+
+
+def listing(client, data, user, index):
+    return client.get('/api/files/')
+
+
+def external_link(client, data, user, index):
+    return client.get(f'/f/{data.link_keys[index % len(data.link_keys)]}')
+
+
+# Сценарии: функция запроса и признак того, что клиент должен войти в систему заранее
+SCENARIOS = {
+    'login': (login, False),
+    'upload': (upload, True),
+    'download': (download, True),
+    'range': (ranged_download, True),
+    'list': (listing, True),
+    'external': (external_link, False),
+}
+
+
+def get_peak_rss():
+    # ru_maxrss в Linux измеряется в килобайтах, в macOS — в байтах
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def percentile(values, fraction):
+    # Метод ближайшего ранга по отсортированным значениям
+    return values[max(math.ceil(fraction * len(values)) - 1, 0)]
+
+
+def run_scenario(name, data, requests, concurrency):
+    """
+    Выполняет requests запросов сценария в concurrency потоках, у каждого потока свой клиент.
+    Возвращает пропускную способность, процентили задержки, среднее число запросов к базе и пик памяти
+    """
+    function, authenticated = SCENARIOS[name]
+    latencies = []
+    queries = []
+    statuses = {}
+    lock = threading.Lock()
+
+    def worker(number):
+        user = data.users[number % len(data.users)]
+        client = Client()
+        if authenticated:
+            client.force_login(user)
+        try:
+            for index in range(number, requests, concurrency):
+                counter = QueryTimer()
+                with connection.execute_wrapper(counter):
+                    started = time.perf_counter()
+                    response = consume(function(client, data, user, index))
+                    elapsed = time.perf_counter() - started
+                with lock:
+                    latencies.append(elapsed)
+                    queries.append(counter.count)
+                    statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+        finally:
+            # Соединения потоков закрываются, чтобы тестовую базу можно было удалить
+            connection.close()
+
+    started = time.perf_counter()
+    with without_download_limits(), ThreadPoolExecutor(concurrency, thread_name_prefix='benchmark') as executor:
+        for future in [executor.submit(worker, number) for number in range(concurrency)]:
+            future.result()
+    duration = time.perf_counter() - started
+
+    latencies.sort()
+    errors = sum(count for code, count in statuses.items() if code >= 400)
+    return {
+        'requests': len(latencies),
+        'concurrency': concurrency,
+        'errors': errors,
+        'statuses': {str(code): count for code, count in sorted(statuses.items())},
+        'duration_s': round(duration, 4),
+        'throughput_rps': round(len(latencies) / duration, 2) if duration else None,
+        'latency_ms': {
+            'mean': round(sum(latencies) / len(latencies) * 1000, 3),
+            'p50': round(percentile(latencies, 0.50) * 1000, 3),
+            'p95': round(percentile(latencies, 0.95) * 1000, 3),
+            'p99': round(percentile(latencies, 0.99) * 1000, 3),
+            'max': round(latencies[-1] * 1000, 3),
+        } if latencies else None,
+        'db_queries_per_request': round(sum(queries) / len(queries), 2) if queries else None,
+        'peak_rss_bytes': get_peak_rss(),
+    }
+
+
+def get_environment():
+    """
+    Сведения об окружении, по которым результаты разных запусков можно сопоставить
+    """
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(__file__), timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        'commit': commit,
+        'date': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'database': connection.vendor,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
@@ -0,0 +1,154 @@
+import time
+import threading
+from collections import OrderedDict, namedtuple
+
+from django.core.cache import caches
+
+from cloud.settings import EXTERNAL_LINK_CACHE_SIZE, EXTERNAL_LINK_CACHE_TTL, CACHE_BACKEND, AUTH_CACHE_TTL, \
+    AUTH_CACHE_LOCAL_TTL
+from .models import File
+from .storage import get_storage
+from .tiers import promote
+
+# Данные файла, достаточные для отдачи по внешней ссылке без обращения к базе
+ExternalLink = namedtuple('ExternalLink', ['file_id', 'content', 'filename', 'etag', 'size', 'encoding', 'tier'])
+
+
+class TTLCache:
+    """
+    Потокобезопасный LRU-кеш в памяти процесса с ограниченным временем жизни записей
+    """
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.data = OrderedDict()
+
+    def get(self, key, default=None):
+        with self.lock:
+            item = self.data.get(key)
+            if item is None:
+                return default
+            value, expires = item
+            if expires < time.monotonic():
+                del self.data[key]
+                return default
+            self.data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.data[key] = (value, time.monotonic() + self.ttl)
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+    def discard(self, *keys):
+        with self.lock:
+            for key in keys:
+                self.data.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+
+external_link_cache = TTLCache(EXTERNAL_LINK_CACHE_SIZE, EXTERNAL_LINK_CACHE_TTL)
+
+
+class TwoLevelCache:
+    """
+    Кеш из двух уровней: память процесса с коротким временем жизни записей и общий кеш (если он настроен).
+    Удаление записи действует сразу в текущем процессе и в общем кеше,
+    а в остальных процессах — после истечения записи в их памяти
+    """
+    def __init__(self, ttl, local_ttl, shared=True):
+        self.ttl = ttl
+        self.local_ttl = local_ttl
+        self.local = caches['local']
+        self.shared = caches['default'] if shared else None
+
+    def get(self, key, default=None):
+        value = self.local.get(key) if self.local_ttl else None
+        if value is None and self.shared is not None:
+            value = self.shared.get(key)
+            if value is not None and self.local_ttl:
+                self.local.set(key, value, self.local_ttl)
+        return default if value is None else value
+
+    def set(self, key, value, timeout=None):
+        timeout = self.ttl if timeout is None else min(timeout, self.ttl)
+        if self.local_ttl:
+            self.local.set(key, value, min(timeout, self.local_ttl))
+        if self.shared is not None:
+            self.shared.set(key, value, timeout)
+
+    def delete(self, key):
+        self.local.delete(key)
+        if self.shared is not None:
+            self.shared.delete(key)
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+
+# Без общего бэкенда записи живут только в памяти процесса
+auth_cache = TwoLevelCache(AUTH_CACHE_TTL, AUTH_CACHE_LOCAL_TTL, shared=bool(CACHE_BACKEND))
+
+
+def get_external_link_queryset(link_key):
+    return File.objects.filter(external_link_key=link_key).only('id', 'content', 'filename', 'blob', 'size', 'tier')
+
+
+def to_external_link(file):
+    return ExternalLink(file.pk, file.content.name, file.filename, file.etag, file.size, file.content_encoding,
+                        file.tier)
+
+
+def resolve_external_link(link_key):
+    """
+    Находит файл по ключу внешней ссылки, сначала в кеше, затем по индексу в базе
+    """
+    link = external_link_cache.get(link_key)
+    if link is None:
+        file = get_external_link_queryset(link_key).first()
+        if file is None:
+            return None
+        link = to_external_link(file)
+        external_link_cache.set(link_key, link)
+    return link
+
+
+async def aresolve_external_link(link_key):
+    """
+    Асинхронный вариант resolve_external_link
+    """
+    link = external_link_cache.get(link_key)
+    if link is None:
+        file = await get_external_link_queryset(link_key).afirst()
+        if file is None:
+            return None
+        link = to_external_link(file)
+        external_link_cache.set(link_key, link)
+    return link
+
+
+def get_external_link_storage(link_key, link):
+    """
+    Возвращает данные ссылки и хранилище, из которого отдаётся файл (None, если файла в нём нет).
+    Файл с холодного уровня хранения сначала возвращается на основной
+    """
+    for refresh in (False, True):
+        if refresh:
+            # Запись в кеше могла устареть, если файл перенесли в другом процессе
+            external_link_cache.discard(link_key)
+            link = resolve_external_link(link_key)
+            if link is None:
+                return None, None
+        if link.tier == File.COLD and promote(File.objects.only('id', 'content', 'blob', 'tier').get(pk=link.file_id)):
+            external_link_cache.discard(link_key)
+            link = link._replace(tier=File.HOT)
+        storage = get_storage(cold=link.tier == File.COLD)
+        if storage.exists(link.content):
+            return link, storage
+    return link, None
@@ -0,0 +1,179 @@
+import time
+import asyncio
+import logging
+import threading
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import F, Min, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from cloud.settings import CHANGES_POLL_INTERVAL, CHANGES_RETENTION, SYNC_CLIENT_TTL
+from .caches import TTLCache
+from .models import CloudUser, FileChange, SyncClient
+
+logger = logging.getLogger('main')
+
+# Последний сохранённый курсор клиента: пока клиент присылает тот же курсор, запись в базу не нужна
+sync_client_cache = TTLCache(10000, 60 * 60)
+
+
+class ChangesCompacted(Exception):
+    """
+    Изменения после курсора клиента уже удалены из журнала: клиенту нужна полная синхронизация
+    """
+
+
+def record_changes(changes):
+    """
+    Добавляет в журналы владельцев изменения — пары (действие, файл) — с очередными номерами.
+    Вызывается в транзакции, изменяющей файлы: номер выделяется под блокировкой строки пользователя,
+    поэтому изменения фиксируются строго в порядке номеров и клиент не может пропустить изменение,
+    зафиксированное позже изменения с большим номером
+    """
+    by_user = defaultdict(list)
+    for action, file in changes:
+        by_user[file.cloud_user_id].append((action, file))
+    with transaction.atomic(savepoint=False):
+        # Строки пользователей блокируются в одном порядке, чтобы параллельные транзакции не ждали друг друга по кругу
+        for user_id in sorted(by_user):
+            user_changes = by_user[user_id]
+            CloudUser.objects.filter(pk=user_id).update(change_sequence=F('change_sequence') + len(user_changes))
+            last = get_sequence(user_id)
+            FileChange.objects.bulk_create([
+                FileChange(cloud_user_id=user_id, sequence=sequence, action=action, file_id=file.pk,
+                           filename=file.filename)
+                for sequence, (action, file) in enumerate(user_changes, last - len(user_changes) + 1)
+            ])
+        user_ids = list(by_user)
+        transaction.on_commit(lambda: change_notifier.notify(*user_ids))
+
+
+class ChangeNotifier:
+    """
+    Будит запросы длинного опроса, ожидающие изменений пользователя, сразу после фиксации изменений
+    в этом процессе. Изменения из других процессов ожидающие запросы замечают при периодической проверке базы
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.waiters = defaultdict(set)
+
+    def subscribe(self, user_id, callback):
+        with self.lock:
+            self.waiters[user_id].add(callback)
+
+    def unsubscribe(self, user_id, callback):
+        with self.lock:
+            callbacks = self.waiters.get(user_id)
+            if callbacks is not None:
+                callbacks.discard(callback)
+                if not callbacks:
+                    del self.waiters[user_id]
+
+    def notify(self, *user_ids):
+        with self.lock:
+            callbacks = [callback for user_id in user_ids for callback in self.waiters.get(user_id, ())]
+        for callback in callbacks:
+            callback()
+
+
+change_notifier = ChangeNotifier()
+
+
+def get_sequence(user_id):
+    return CloudUser.objects.filter(pk=user_id).values_list('change_sequence', flat=True).first()
+
+
+def wait_for_changes(user_id, cursor, timeout):
+    """
+    Ждёт не дольше timeout секунд, пока в журнале пользователя не появится изменение после курсора.
+    Возвращает номер последнего изменения
+    """
+    deadline = time.monotonic() + timeout
+    event = threading.Event()
+    change_notifier.subscribe(user_id, event.set)
+    try:
+        while True:
+            sequence = get_sequence(user_id)
+            remaining = deadline - time.monotonic()
+            if sequence is None or sequence > cursor or remaining <= 0:
+                return sequence
+            event.wait(min(remaining, CHANGES_POLL_INTERVAL))
+            event.clear()
+    finally:
+        change_notifier.unsubscribe(user_id, event.set)
+
+
+async def await_changes(user_id, cursor, timeout):
+    """
+    Асинхронный вариант wait_for_changes: ожидание не занимает поток
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    event = asyncio.Event()
+
+    def wake():
+        loop.call_soon_threadsafe(event.set)
+
+    change_notifier.subscribe(user_id, wake)
+    try:
+        while True:
+            sequence = await CloudUser.objects.filter(pk=user_id).values_list('change_sequence', flat=True).afirst()
+            remaining = deadline - loop.time()
+            if sequence is None or sequence > cursor or remaining <= 0:
+                return sequence
+            try:
+                await asyncio.wait_for(event.wait(), min(remaining, CHANGES_POLL_INTERVAL))
+            except asyncio.TimeoutError:
+                pass
+            event.clear()
+    finally:
+        change_notifier.unsubscribe(user_id, wake)
+
+
+def get_changes(user_id, cursor, sequence, limit):
+    """
+    Возвращает не более limit изменений после курсора и признак того, что изменений больше.
+    Номера изменений идут без пропусков, поэтому пропуск в начале выборки означает, что записи
+    уже удалены при сжатии журнала
+    """
+    if cursor >= sequence:
+        return [], False
+    changes = list(FileChange.objects.filter(cloud_user_id=user_id, sequence__gt=cursor)
+                   .order_by('sequence')[:limit + 1])
+    if not changes or changes[0].sequence != cursor + 1:
+        raise ChangesCompacted()
+    return changes[:limit], len(changes) > limit
+
+
+def remember_client(user_id, client_id, cursor):
+    """
+    Сохраняет курсор клиента синхронизации: записи журнала до наименьшего курсора активных клиентов
+    больше никому не нужны и удаляются при сжатии
+    """
+    key = (user_id, client_id)
+    if sync_client_cache.get(key) == cursor:
+        return
+    SyncClient.objects.update_or_create(cloud_user_id=user_id, client_id=client_id,
+                                        defaults={'cursor': cursor, 'last_seen': timezone.now()})
+    sync_client_cache.set(key, cursor)
+
+
+def compact_changes():
+    """
+    Удаляет записи журналов старше CHANGES_RETENTION, которые получили все активные клиенты синхронизации
+    пользователя. Если активных клиентов нет, удаляются все записи старше CHANGES_RETENTION.
+    Клиенты, давно не обращавшиеся к серверу, забываются и при возвращении выполняют полную синхронизацию.
+    Возвращает количество удалённых записей
+    """
+    now = timezone.now()
+    SyncClient.objects.filter(last_seen__lt=now - timedelta(seconds=SYNC_CLIENT_TTL)).delete()
+    active = SyncClient.objects.filter(cloud_user=OuterRef('cloud_user')).order_by().values('cloud_user') \
+        .annotate(cursor=Min('cursor')).values('cursor')
+    current = CloudUser.objects.filter(pk=OuterRef('cloud_user')).values('change_sequence')
+    deleted, _ = FileChange.objects.filter(sequence__lte=Coalesce(Subquery(active), Subquery(current)),
+                                           date_created__lt=now - timedelta(seconds=CHANGES_RETENTION)).delete()
+    logger.info(f'Из журнала изменений удалено записей: {deleted}')
+    return deleted
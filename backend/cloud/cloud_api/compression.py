@@ -0,0 +1,109 @@
+import os
+import gzip
+import zlib
+import logging
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from cloud.settings import STORAGE_COMPRESSION, STORAGE_COMPRESSION_MIN_SIZE, STORAGE_COMPRESSION_MAX_RATIO
+
+logger = logging.getLogger('main')
+
+# Суффиксы, которые добавляются к пути сжатого содержимого
+ENCODING_SUFFIXES = {'gzip': '.gz', 'zstd': '.zst'}
+# Размер начала файла, по которому оценивается его сжимаемость
+SAMPLE_SIZE = 64 * 1024
+# Размер блока при сжатии файла
+CHUNK_SIZE = 1024 * 1024
+
+
+def get_storage_encoding():
+    """
+    Возвращает кодировку для сжатия нового содержимого или пустую строку, если сжатие выключено
+    """
+    if STORAGE_COMPRESSION == 'zstd' and zstandard is None:
+        logger.warning('Пакет zstandard не установлен, содержимое сжимается gzip')
+        return 'gzip'
+    return STORAGE_COMPRESSION if STORAGE_COMPRESSION in ENCODING_SUFFIXES else ''
+
+
+STORAGE_ENCODING = get_storage_encoding()
+
+
+def get_content_encoding(name):
+    """
+    Определяет кодировку содержимого по суффиксу его пути в хранилище
+    """
+    for encoding, suffix in ENCODING_SUFFIXES.items():
+        if name.endswith(suffix):
+            return encoding
+    return ''
+
+
+def get_compressor(encoding):
+    """
+    Создаёт потоковый компрессор с методами compress и flush
+    """
+    if encoding == 'zstd':
+        return zstandard.ZstdCompressor(level=3).compressobj()
+    # wbits=31 — данные в формате gzip
+    return zlib.compressobj(6, zlib.DEFLATED, 31)
+
+
+def is_compressible(sample):
+    """
+    Пробно сжимает начало файла. Уже сжатые форматы (изображения, видео, архивы) почти не уменьшаются
+    """
+    return bool(sample) and len(zlib.compress(sample, 1)) <= len(sample) * STORAGE_COMPRESSION_MAX_RATIO
+
+
+def is_worth_storing(size, stored_size):
+    """
+    Проверяет, что сжатие файла целиком дало достаточную экономию места
+    """
+    return size >= STORAGE_COMPRESSION_MIN_SIZE and stored_size <= size * STORAGE_COMPRESSION_MAX_RATIO
+
+
+def compress_file(source_path, size, encoding=None, compressed_path=None):
+    """
+    Сжимает файл рядом с исходным (или в compressed_path), если сжатие включено,
+    а файл достаточно велик и хорошо сжимается.
+    Если метод сжатия передан явно, файл сжимается им без проверок.
+    Возвращает (кодировка, путь к сжатому файлу) или None
+    """
+    forced = encoding is not None
+    encoding = encoding or STORAGE_ENCODING
+    if not forced and (not encoding or size < STORAGE_COMPRESSION_MIN_SIZE):
+        return None
+    with open(source_path, 'rb') as source:
+        if not forced and not is_compressible(source.read(SAMPLE_SIZE)):
+            return None
+        source.seek(0)
+        compressed_path = compressed_path or source_path + ENCODING_SUFFIXES[encoding]
+        compressor = get_compressor(encoding)
+        with open(compressed_path, 'wb') as destination:
+            for chunk in iter(lambda: source.read(CHUNK_SIZE), b''):
+                destination.write(compressor.compress(chunk))
+            destination.write(compressor.flush())
+    if not forced and not is_worth_storing(size, os.path.getsize(compressed_path)):
+        os.remove(compressed_path)
+        return None
+    return encoding, compressed_path
+
+
+def open_content(stream, encoding=''):
+    """
+    Оборачивает открытый поток содержимого в распаковывающий поток (закрывается вместе с ним).
+    Распаковывающие потоки поддерживают перемещение вперёд, поэтому из них можно читать диапазоны
+    """
+    if encoding == 'gzip':
+        source = gzip.GzipFile(fileobj=stream, mode='rb')
+        # Переданный поток GzipFile закрывает, только если считает его своим
+        source.myfileobj = stream
+        return source
+    if encoding == 'zstd':
+        return zstandard.ZstdDecompressor().stream_reader(stream, closefd=True)
+    return stream
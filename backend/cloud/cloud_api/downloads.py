@@ -0,0 +1,287 @@
+import os
+import re
+import asyncio
+import logging
+import secrets
+import mimetypes
+from functools import partial
+from urllib.parse import quote
+
+from django.http import FileResponse, HttpResponse, HttpResponseRedirect, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe
+
+from cloud.settings import MEDIA_ROOT, DOWNLOAD_OFFLOAD, DOWNLOAD_OFFLOAD_PREFIX, DOWNLOAD_CHUNK_SIZE
+from .compression import open_content
+
+logger = logging.getLogger('main')
+
+# Один диапазон из заголовка Range: "начало-конец", "начало-" или "-длина_хвоста"
+RANGE_SPEC_RE = re.compile(r'^\s*(\d*)\s*-\s*(\d*)\s*$')
+# Больше диапазонов в одном запросе не обслуживаем, а отдаём файл целиком
+MAX_RANGES = 16
+
+
+def get_validators(storage, name):
+    """
+    Возвращает валидаторы содержимого (ETag и время изменения) и его размер по данным хранилища
+    """
+    size, modified = storage.stat(name)
+    etag = f'"{modified:x}-{size:x}"'
+    return etag, modified // 10 ** 9, size
+
+
+def parse_range_header(header, size):
+    """
+    Разбирает заголовок Range.
+    Возвращает None, если заголовок нужно игнорировать, пустой список, если ни один диапазон
+    не попадает в файл, иначе отсортированный список объединённых диапазонов (начало, конец) включительно
+    """
+    if not header or not header.startswith('bytes='):
+        return None
+    specs = header[len('bytes='):].split(',')
+    if len(specs) > MAX_RANGES:
+        return None
+    ranges = []
+    for spec in specs:
+        match = RANGE_SPEC_RE.match(spec)
+        if not match:
+            return None
+        first, last = match.groups()
+        if not first:
+            if not last:
+                return None
+            # Последние N байт файла
+            suffix = int(last)
+            if suffix == 0 or size == 0:
+                continue
+            ranges.append((max(size - suffix, 0), size - 1))
+            continue
+        start = int(first)
+        end = int(last) if last else size - 1
+        if last and end < start:
+            return None
+        if start >= size:
+            continue
+        ranges.append((start, min(end, size - 1)))
+
+    # Объединяем пересекающиеся и соседние диапазоны
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def if_range_matches(request, etag, last_modified):
+    """
+    Проверяет условие If-Range: при несовпадении валидатора файл отдаётся целиком
+    """
+    value = request.headers.get('If-Range')
+    if value is None:
+        return True
+    if value.startswith('"') or value.startswith('W/'):
+        return value == etag
+    return parse_http_date_safe(value) == last_modified
+
+
+def accepts_encoding(request, encoding):
+    """
+    Проверяет по заголовку Accept-Encoding, что клиент принимает ответ, сжатый методом encoding
+    """
+    for item in request.headers.get('Accept-Encoding', '').split(','):
+        token, _, params = item.partition(';')
+        token = token.strip().lower()
+        if token not in (encoding, '*') and not (encoding == 'gzip' and token == 'x-gzip'):
+            continue
+        params = params.replace(' ', '')
+        if params.startswith('q='):
+            try:
+                return float(params[2:]) > 0
+            except ValueError:
+                return False
+        return True
+    return False
+
+
+def read_range(opener, start, end):
+    """
+    Генератор, читающий блоками байты файла с start по end включительно.
+    opener открывает поток содержимого
+    """
+    with opener() as stream:
+        stream.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = stream.read(min(DOWNLOAD_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+async def aread_range(opener, start, end, name=''):
+    """
+    Асинхронный генератор, читающий блоками байты файла с start по end включительно.
+    Каждый блок читается в пуле потоков, между блоками поток не занят.
+    Следующий блок читается только после передачи предыдущего клиенту
+    """
+    stream = await asyncio.to_thread(opener)
+    try:
+        await asyncio.to_thread(stream.seek, start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = await asyncio.to_thread(stream.read, min(DOWNLOAD_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    except (asyncio.CancelledError, GeneratorExit):
+        logger.info(f'Клиент отключился во время скачивания файла {name}')
+        raise
+    finally:
+        stream.close()
+
+
+def read_multipart(opener, parts, boundary):
+    """
+    Генератор тела ответа multipart/byteranges
+    """
+    for part_header, start, end in parts:
+        yield part_header
+        yield from read_range(opener, start, end)
+        yield b'\r\n'
+    yield f'--{boundary}--\r\n'.encode()
+
+
+async def aread_multipart(opener, parts, boundary, name=''):
+    """
+    Асинхронный генератор тела ответа multipart/byteranges
+    """
+    for part_header, start, end in parts:
+        yield part_header
+        async for chunk in aread_range(opener, start, end, name):
+            yield chunk
+        yield b'\r\n'
+    yield f'--{boundary}--\r\n'.encode()
+
+
+def open_decoded(storage, name, encoding):
+    """
+    Открывает сжатое содержимое на чтение с распаковкой
+    """
+    return open_content(storage.open(name), encoding)
+
+
+def offload_response(file_path, content_type):
+    """
+    Формирует пустой ответ, по которому файл отдаёт фронт-прокси
+    """
+    response = HttpResponse(content_type=content_type)
+    if DOWNLOAD_OFFLOAD == 'nginx':
+        relative_path = os.path.relpath(file_path, MEDIA_ROOT).replace(os.sep, '/')
+        response['X-Accel-Redirect'] = DOWNLOAD_OFFLOAD_PREFIX.rstrip('/') + '/' + quote(relative_path)
+    else:
+        response['X-Sendfile'] = file_path
+    return response
+
+
+def build_file_response(request, storage, name, filename, etag=None, asynchronous=False, encoding='', size=None):
+    """
+    Формирует ответ на скачивание содержимого name из хранилища storage с учётом условных заголовков (304/412),
+    заголовка Range (206, 416) и режима передачи файла фронт-прокси.
+    Если хранилище выдаёт подписанные ссылки, клиент перенаправляется (302) на скачивание прямо из хранилища.
+    Если ETag не передан, он строится по времени изменения и размеру файла.
+    При asynchronous=True тело ответа отдаётся асинхронными генераторами.
+    Сжатое на диске содержимое (encoding) отдаётся как есть с заголовком Content-Encoding,
+    если клиент его принимает, иначе распаковывается на лету; size — размер распакованного содержимого.
+    Если содержимого нет в хранилище, выбрасывает FileNotFoundError
+    """
+    content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    decode = bool(encoding) and not accepts_encoding(request, encoding)
+    # Распаковывать на лету умеет только сервер приложения
+    url = None if decode else storage.url(name, filename, content_type, encoding)
+    if url:
+        response = HttpResponseRedirect(url)
+        if encoding:
+            response['Vary'] = 'Accept-Encoding'
+        return response
+
+    stat_etag, last_modified, stored_size = get_validators(storage, name)
+    etag = etag or stat_etag
+    if asynchronous:
+        range_reader, multipart_reader = partial(aread_range, name=name), partial(aread_multipart, name=name)
+    else:
+        range_reader, multipart_reader = read_range, read_multipart
+
+    if decode:
+        opener = partial(open_decoded, storage, name, encoding)
+        size = stored_size if size is None else size
+    else:
+        opener = partial(storage.open, name)
+        size = stored_size
+        if encoding:
+            # У сжатого представления свой ETag, чтобы кеши не смешивали его с распакованным
+            etag = f'{etag[:-1]}-{encoding}"'
+
+    conditional = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if conditional is not None:
+        conditional['ETag'] = etag
+        conditional['Last-Modified'] = http_date(last_modified)
+        if encoding:
+            conditional['Vary'] = 'Accept-Encoding'
+        return conditional
+
+    file_path = storage.path(name)
+    if DOWNLOAD_OFFLOAD and not decode and file_path:
+        response = offload_response(file_path, content_type)
+    else:
+        ranges = None
+        if if_range_matches(request, etag, last_modified):
+            ranges = parse_range_header(request.headers.get('Range'), size)
+
+        if ranges is None and (asynchronous or decode):
+            response = StreamingHttpResponse(range_reader(opener, 0, size - 1), content_type=content_type)
+            response['Content-Length'] = size
+        elif ranges is None:
+            response = FileResponse(opener(), as_attachment=True, content_type=content_type)
+        elif not ranges:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+        elif len(ranges) == 1:
+            start, end = ranges[0]
+            response = StreamingHttpResponse(range_reader(opener, start, end), status=206,
+                                             content_type=content_type)
+            response['Content-Range'] = f'bytes {start}-{end}/{size}'
+            response['Content-Length'] = end - start + 1
+        else:
+            boundary = secrets.token_hex(16)
+            parts = []
+            length = len(f'--{boundary}--\r\n')
+            for start, end in ranges:
+                part_header = (f'--{boundary}\r\nContent-Type: {content_type}\r\n'
+                               f'Content-Range: bytes {start}-{end}/{size}\r\n\r\n').encode()
+                parts.append((part_header, start, end))
+                length += len(part_header) + end - start + 1 + 2
+            response = StreamingHttpResponse(multipart_reader(opener, parts, boundary), status=206,
+                                             content_type=f'multipart/byteranges; boundary={boundary}')
+            response['Content-Length'] = length
+
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    if encoding:
+        response['Vary'] = 'Accept-Encoding'
+        if not decode:
+            response['Content-Encoding'] = encoding
+    return response
+
+
+async def abuild_file_response(request, storage, name, filename, etag=None, encoding='', size=None):
+    """
+    Асинхронный вариант build_file_response: обращение к хранилищу выполняется в пуле потоков
+    """
+    return await asyncio.to_thread(build_file_response, request, storage, name, filename, etag, asynchronous=True,
+                                   encoding=encoding, size=size)
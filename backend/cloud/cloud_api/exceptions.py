@@ -0,0 +1,15 @@
+from rest_framework import status
+from rest_framework.exceptions import APIException, Throttled
+
+
+class QuotaExceeded(APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_detail = 'Превышена квота хранилища пользователя.'
+    default_code = 'quota_exceeded'
+
+
+class DownloadThrottled(Throttled):
+    default_detail = 'Слишком много скачиваний.'
+    extra_detail_singular = 'Повторите через {wait} сек.'
+    extra_detail_plural = 'Повторите через {wait} сек.'
+    default_code = 'download_throttled'
@@ -0,0 +1,193 @@
+import os
+import time
+import logging
+from datetime import timedelta
+from functools import partial
+from collections import Counter, defaultdict
+
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from cloud.settings import MEDIA_ROOT, BLOB_DIR, UPLOAD_SESSION_TTL, JOBS_DELETE_BATCH_SIZE, JOBS_STALE_TIMEOUT, \
+    JOBS_RESULT_TTL
+from .changes import compact_changes, record_changes
+from .models import CloudUser, Blob, File, FileChange, Job, UploadSession
+from .previews import get_preview_key, preview_cache
+from .utils import remove_files
+
+logger = logging.getLogger('main')
+
+# Обработчики фоновых задач по их типу
+TASKS = {}
+
+# Поля файла, нужные для его удаления
+FILE_DELETE_FIELDS = ('id', 'cloud_user', 'filename', 'size', 'blob', 'content', 'external_link_key', 'tier')
+
+
+def task(kind):
+    """
+    Регистрирует функцию как обработчик фоновых задач указанного типа
+    """
+    def register(function):
+        TASKS[kind] = function
+        return function
+    return register
+
+
+def enqueue(kind, cloud_user=None, **params):
+    """
+    Ставит задачу в очередь. Параметры передаются обработчику именованными аргументами
+    """
+    job = Job.objects.create(kind=kind, params=params, cloud_user=cloud_user)
+    logger.info(f'Задача {job.id} ({kind}) поставлена в очередь')
+    return job
+
+
+def claim_jobs(limit):
+    """
+    Забирает из очереди не более limit задач и отмечает их выполняющимися.
+    Строки, заблокированные другим обработчиком, пропускаются
+    """
+    with transaction.atomic():
+        ids = list(Job.objects.select_for_update(skip_locked=True).filter(status=Job.QUEUED)
+                   .order_by('date_created').values_list('id', flat=True)[:limit])
+        Job.objects.filter(pk__in=ids).update(status=Job.RUNNING, date_started=timezone.now())
+    return ids
+
+
+def requeue_stale_jobs(timeout=JOBS_STALE_TIMEOUT):
+    """
+    Возвращает в очередь задачи, которые выполняются дольше timeout секунд (обработчик был остановлен аварийно)
+    """
+    deadline = timezone.now() - timedelta(seconds=timeout)
+    return Job.objects.filter(status=Job.RUNNING, date_started__lt=deadline).update(status=Job.QUEUED,
+                                                                                    date_started=None)
+
+
+def run_job(job_id):
+    """
+    Выполняет задачу и сохраняет её результат или текст ошибки
+    """
+    close_old_connections()
+    job = Job.objects.get(pk=job_id)
+    handler = TASKS.get(job.kind)
+    started = time.monotonic()
+    try:
+        if handler is None:
+            raise LookupError(f'Неизвестный тип задачи {job.kind}')
+        job.result = handler(**job.params)
+        job.status = Job.DONE
+    except Exception as error:
+        logger.exception(f'Задача {job.id} ({job.kind}) завершилась ошибкой')
+        job.status = Job.FAILED
+        job.error = str(error)
+    job.date_finished = timezone.now()
+    job.save(update_fields=['status', 'result', 'error', 'date_finished'])
+    logger.info(f'Задача {job.id} ({job.kind}) завершена за {time.monotonic() - started:.1f} с: {job.status}')
+    return job.status
+
+
+def delete_files(files, record=True):
+    """
+    Удаляет записи о файлах одним запросом, уменьшает счётчики их владельцев и освобождает содержимое.
+    Файлы из каталогов пользователей удаляются из хранилища после фиксации транзакции.
+    Без record удаление не попадает в журнал изменений (например, журнал удаляется вместе с владельцем)
+    """
+    usage = defaultdict(lambda: [0, 0])
+    legacy = defaultdict(list)
+    for file in files:
+        usage[file.cloud_user_id][0] -= file.size
+        usage[file.cloud_user_id][1] -= 1
+        if not file.blob_id:
+            legacy[file.storage].append(file.content.name)
+    preview_keys = [get_preview_key(file) for file in files]
+    with transaction.atomic():
+        # Записи индекса поиска удаляются вместе с файлами одним DELETE по идентификаторам файлов
+        File.objects.filter(pk__in=[file.pk for file in files]).delete()
+        if record:
+            record_changes((FileChange.DELETED, file) for file in files)
+        for user_id, (size, count) in usage.items():
+            CloudUser.change_usage(user_id, size, count)
+        Blob.release_many(Counter(file.blob_id for file in files if file.blob_id))
+        for storage, names in legacy.items():
+            transaction.on_commit(partial(storage.delete, names))
+        transaction.on_commit(lambda: preview_cache.discard(*preview_keys))
+
+
+@task('delete_files')
+def delete_files_task(ids, user_id, is_superuser=False):
+    """
+    Удаляет файлы по списку идентификаторов с проверкой прав и возвращает результат по каждому файлу
+    """
+    files = File.objects.only(*FILE_DELETE_FIELDS).in_bulk(ids)
+    results = []
+    deleted = []
+    for pk in ids:
+        file = files.get(pk)
+        if file is None:
+            results.append({'id': pk, 'status': 404, 'detail': 'Файл не найден'})
+        elif file.cloud_user_id != user_id and not is_superuser:
+            results.append({'id': pk, 'status': 403, 'detail': 'Нет доступа к файлу'})
+        else:
+            deleted.append(file)
+            results.append({'id': pk, 'status': 204})
+
+    for start in range(0, len(deleted), JOBS_DELETE_BATCH_SIZE):
+        delete_files(deleted[start:start + JOBS_DELETE_BATCH_SIZE])
+    logger.info(f'Удалено файлов: {len(deleted)} из {len(ids)}')
+    return {'results': results}
+
+
+@task('delete_user')
+def delete_user_task(user_id):
+    """
+    Удаляет пользователя вместе с файлами. Записи о файлах удаляются пакетами в отдельных транзакциях,
+    поэтому удаление большого хранилища не держит долгих блокировок
+    """
+    user = CloudUser.objects.filter(pk=user_id).first()
+    if user is None:
+        return {'deleted_files': 0}
+    deleted = 0
+    while True:
+        files = list(File.objects.filter(cloud_user_id=user_id).only(*FILE_DELETE_FIELDS)[:JOBS_DELETE_BATCH_SIZE])
+        if not files:
+            break
+        # Журнал изменений пользователя удаляется вместе с ним, записывать в него удаления не нужно
+        delete_files(files, record=False)
+        deleted += len(files)
+    for session in user.upload_sessions.all():
+        session.delete_part()
+    user.delete()
+    user.delete_storage()
+    logger.info(f'Пользователь {user} удален, удалено файлов: {deleted}')
+    return {'deleted_files': deleted}
+
+
+@task('cleanup_storage')
+def cleanup_storage_task():
+    """
+    Удаляет брошенные сессии загрузки, оставшиеся после сбоев временные файлы и корзину хранилища содержимого,
+    записи о давно завершённых задачах, давно не запрашивавшиеся миниатюры сверх размера кеша
+    и записи журнала изменений, которые получили все клиенты синхронизации
+    """
+    sessions = UploadSession.delete_expired(UPLOAD_SESSION_TTL)
+
+    deadline = time.time() - UPLOAD_SESSION_TTL
+    leftovers = []
+    try:
+        with os.scandir(os.path.join(MEDIA_ROOT, BLOB_DIR, 'tmp')) as entries:
+            leftovers.extend(entry.path for entry in entries if entry.is_file() and entry.stat().st_mtime < deadline)
+    except FileNotFoundError:
+        pass
+    remove_files(leftovers)
+    # Корзина остаётся после сбоев и откатов транзакций, освободивших содержимое
+    restored, trashed = Blob.empty_trash()
+
+    jobs, _ = Job.objects.filter(status__in=[Job.DONE, Job.FAILED],
+                                 date_finished__lt=timezone.now() - timedelta(seconds=JOBS_RESULT_TTL)).delete()
+    previews = preview_cache.evict()
+    changes = compact_changes()
+    logger.info(f'Очистка хранилища: сессий загрузки {sessions}, временных файлов {len(leftovers)}, '
+                f'файлов корзины {trashed}, задач {jobs}, миниатюр {previews}, записей журнала изменений {changes}')
+    return {'upload_sessions': sessions, 'temporary_files': len(leftovers), 'trash': trashed, 'restored': restored,
+            'jobs': jobs, 'previews': previews, 'changes': changes}
@@ -0,0 +1,179 @@
+import os
+import copy
+import json
+import queue
+import pickle
+import atexit
+import random
+import logging
+import threading
+import contextvars
+from datetime import datetime, timezone
+from logging.handlers import QueueListener
+
+from .metrics import metrics_registry
+
+# Идентификатор запроса, в рамках которого создана запись журнала
+request_id_var = contextvars.ContextVar('request_id', default=None)
+
+# Стандартные атрибуты записи журнала; остальные атрибуты (переданные через extra) попадают в событие как поля
+RECORD_ATTRIBUTES = frozenset(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'request_id'}
+
+
+# Типы аргументов сообщения, которые не меняются после записи и передаются в фоновый поток без проверки
+IMMUTABLE_TYPES = (str, int, float, bool, bytes, type(None))
+
+
+def freeze_arg(value):
+    """
+    Возвращает аргумент сообщения, который можно отформатировать позже в фоновом потоке.
+    Аргументы, которые нельзя сериализовать pickle (файлы, блокировки, генераторы), заменяются их строкой
+    """
+    if isinstance(value, IMMUTABLE_TYPES):
+        return value
+    try:
+        pickle.dumps(value)
+    except Exception:
+        return str(value)
+    return value
+
+
+def parse_sample_rates(value):
+    """
+    Разбирает доли записываемых событий из строки вида «download:0.1,upload:0.5»
+    """
+    rates = {}
+    for item in filter(None, (part.strip() for part in value.split(','))):
+        event, _, rate = item.partition(':')
+        rates[event.strip()] = min(max(float(rate), 0.0), 1.0)
+    return rates
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Форматирует запись журнала как одну строку JSON: время, уровень, модуль, сообщение,
+    идентификатор запроса и поля события, переданные через extra
+    """
+    def format(self, record):
+        event = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'module': record.module,
+            'message': record.getMessage(),
+        }
+        if getattr(record, 'request_id', None):
+            event['request_id'] = record.request_id
+        event.update((key, value) for key, value in vars(record).items() if key not in RECORD_ATTRIBUTES)
+        if record.exc_text or record.exc_info:
+            event['exception'] = record.exc_text or self.formatException(record.exc_info)
+        return json.dumps(event, ensure_ascii=False, default=str)
+
+
+class BackgroundHandler(logging.Handler):
+    """
+    Обработчик, который только кладёт запись в ограниченную очередь, а в поток вывода её пишет фоновый поток
+    (как QueueHandler с QueueListener, но очередь создаётся вместе с обработчиком по параметрам из LOGGING).
+    Если вывод не успевает, новые записи отбрасываются и считаются, а не копятся в памяти.
+    События с полем event из sample_rates записываются с заданной долей (например, скачивания файлов)
+    """
+    def __init__(self, stream=None, maxsize=10000, sample_rates=''):
+        super().__init__()
+        self.queue = queue.Queue(maxsize)
+        self.sink = logging.StreamHandler(stream)
+        self.sample_rates = parse_sample_rates(sample_rates) if isinstance(sample_rates, str) else sample_rates
+        self.counters_lock = threading.Lock()
+        self.dropped = 0
+        self.unreported = 0
+        self.sampled_out = 0
+        self.listener = QueueListener(self.queue, self.sink)
+        self.listener.start()
+        self.running = True
+        atexit.register(self.stop)
+        # Поток вывода не наследуется дочерним процессом (сервер с предзагрузкой приложения), его нужно запустить заново
+        os.register_at_fork(after_in_child=self.restart)
+        metrics_registry.add_collector(self.collect_metrics)
+
+    def setFormatter(self, fmt):
+        # Форматирование выполняет фоновый поток
+        self.sink.setFormatter(fmt)
+
+    def emit(self, record):
+        rate = self.sample_rates.get(getattr(record, 'event', None))
+        if rate is not None:
+            if random.random() >= rate:
+                with self.counters_lock:
+                    self.sampled_out += 1
+                return
+            record.sample_rate = rate
+        try:
+            self.enqueue(self.prepare(record))
+        except Exception:
+            self.handleError(record)
+
+    def prepare(self, record):
+        """
+        Подготавливает запись к передаче в другой поток: добавляет идентификатор запроса.
+        Сообщение и исключение форматирует фоновый поток, аргументы сообщения передаются как есть,
+        кроме тех, что нельзя сериализовать pickle
+        """
+        record = copy.copy(record)
+        if isinstance(record.args, dict):
+            record.args = {key: freeze_arg(value) for key, value in record.args.items()}
+        elif record.args:
+            record.args = tuple(freeze_arg(value) for value in record.args)
+        record.request_id = request_id_var.get()
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self.counters_lock:
+                self.dropped += 1
+                self.unreported += 1
+            return
+        if self.unreported:
+            with self.counters_lock:
+                unreported, self.unreported = self.unreported, 0
+            notice = logging.LogRecord('main', logging.WARNING, __file__, 0,
+                                       f'Очередь журнала была переполнена, отброшено записей: {unreported}',
+                                       None, None)
+            notice.event = 'log_dropped'
+            notice.dropped = unreported
+            try:
+                self.queue.put_nowait(notice)
+            except queue.Full:
+                with self.counters_lock:
+                    self.unreported += unreported
+
+    def collect_metrics(self):
+        with self.counters_lock:
+            dropped, sampled_out = self.dropped, self.sampled_out
+        return [
+            '# HELP cloud_log_records_dropped_total Записи журнала, отброшенные из-за переполнения очереди',
+            '# TYPE cloud_log_records_dropped_total counter',
+            f'cloud_log_records_dropped_total {dropped}',
+            '# HELP cloud_log_records_sampled_out_total Записи журнала, пропущенные при выборочной записи событий',
+            '# TYPE cloud_log_records_sampled_out_total counter',
+            f'cloud_log_records_sampled_out_total {sampled_out}',
+            '# HELP cloud_log_queue_size Записи журнала, ожидающие вывода',
+            '# TYPE cloud_log_queue_size gauge',
+            f'cloud_log_queue_size {self.queue.qsize()}',
+        ]
+
+    def restart(self):
+        if self.running:
+            self.queue = queue.Queue(self.queue.maxsize)
+            self.listener = QueueListener(self.queue, self.sink)
+            self.listener.start()
+
+    def stop(self):
+        # Дожидается вывода накопленных записей; повторный вызов ничего не делает
+        if self.running:
+            self.running = False
+            self.listener.stop()
+
+    def close(self):
+        self.stop()
+        super().close()
@@ -0,0 +1,68 @@
+import json
+import logging
+import tempfile
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from cloud_api.benchmarks import SCENARIOS, seed, remove_content, run_scenario, get_environment, get_peak_rss
+
+logger = logging.getLogger('main')
+
+
+class Command(BaseCommand):
+    help = ('Замеряет пропускную способность, задержки (p50/p95/p99), количество запросов к базе и пик памяти '
+            'основных точек API на синтетических данных во временной базе и выводит результат в JSON')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10, help='Количество синтетических пользователей')
+        parser.add_argument('--files', type=int, default=100, help='Количество файлов у каждого пользователя')
+        parser.add_argument('--file-size', type=int, default=64 * 1024, help='Размер файла в байтах')
+        parser.add_argument('--requests', type=int, default=200, help='Количество запросов в каждом сценарии')
+        parser.add_argument('--concurrency', type=int, default=8, help='Количество одновременных клиентов')
+        parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                            help=f'Сценарии через запятую: {", ".join(SCENARIOS)}')
+        parser.add_argument('--output', help='Файл для результата (по умолчанию — стандартный вывод)')
+
+    def handle(self, *args, **options):
+        scenarios = [name.strip() for name in options['scenarios'].split(',') if name.strip()]
+        unknown = set(scenarios) - set(SCENARIOS)
+        if unknown:
+            raise CommandError(f'Неизвестные сценарии: {", ".join(sorted(unknown))}')
+        if min(options['users'], options['files'], options['file_size'], options['requests'],
+               options['concurrency']) < 1:
+            raise CommandError('Параметры нагрузки должны быть положительными')
+
+        # Замеры выполняются во временной базе, как тесты. SQLite в памяти блокирует таблицы целиком
+        # при одновременной записи из нескольких потоков, поэтому для неё создаётся временный файл
+        if connection.vendor == 'sqlite' and not connection.settings_dict['TEST'].get('NAME'):
+            connection.settings_dict['TEST']['NAME'] = tempfile.mktemp(prefix='cloud-benchmark-', suffix='.sqlite3')
+        setup_test_environment(debug=False)
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            data = seed(options['users'], options['files'], options['file_size'])
+            logger.info(f'Подготовлены данные для замеров: {len(data.users)} пользователей, {len(data.files)} файлов')
+            results = {}
+            for name in scenarios:
+                results[name] = run_scenario(name, data, options['requests'], options['concurrency'])
+                self.stderr.write(f'{name}: {results[name]["throughput_rps"]} запросов/с, '
+                                  f'p95 {results[name]["latency_ms"]["p95"]} мс')
+        finally:
+            remove_content()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        report = {
+            'environment': get_environment(),
+            'parameters': {key: options[key] for key in ('users', 'files', 'file_size', 'requests', 'concurrency')},
+            'scenarios': results,
+            'peak_rss_bytes': get_peak_rss(),
+        }
+        output = json.dumps(report, indent=2, ensure_ascii=False)
+        if options['output']:
+            with open(options['output'], 'w') as destination:
+                destination.write(output + '\n')
+            self.stdout.write(self.style.SUCCESS(f'Результаты замеров записаны в {options["output"]}'))
+        else:
+            self.stdout.write(output)
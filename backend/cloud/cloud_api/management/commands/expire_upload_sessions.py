@@ -0,0 +1,21 @@
+import logging
+
+from django.core.management.base import BaseCommand
+
+from cloud.settings import UPLOAD_SESSION_TTL
+from cloud_api.models import UploadSession
+
+logger = logging.getLogger('main')
+
+
+class Command(BaseCommand):
+    help = 'Удаляет брошенные сессии возобновляемой загрузки и их недокачанные файлы'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ttl', type=int, default=UPLOAD_SESSION_TTL,
+                            help='Время неактивности сессии в секундах, после которого она удаляется')
+
+    def handle(self, *args, **options):
+        expired = UploadSession.delete_expired(options['ttl'])
+        logger.info(f'Удалено просроченных сессий загрузки: {expired}')
+        self.stdout.write(self.style.SUCCESS(f'Удалено просроченных сессий загрузки: {expired}'))
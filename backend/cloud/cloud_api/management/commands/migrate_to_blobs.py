@@ -0,0 +1,108 @@
+import os
+import shutil
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, transaction
+
+from cloud_api.models import Blob, File
+from cloud_api.storage import get_temporary_path
+from cloud_api.utils import get_file_sha256, remove_files
+
+logger = logging.getLogger('main')
+
+
+class Command(BaseCommand):
+    help = ('Переносит файлы из каталогов пользователей в хранилище содержимого по SHA-256, '
+            'разложенное по подкаталогам. Сервис при этом продолжает работать')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Количество записей, читаемых за один запрос')
+        parser.add_argument('--workers', type=int, default=4, help='Количество файлов, переносимых параллельно')
+
+    def handle(self, *args, **options):
+        migrated = missing = failed = 0
+        last_pk = 0
+        workers = max(options['workers'], 1)
+        # С одним исполнителем файлы переносятся в основном потоке
+        executor = ThreadPoolExecutor(workers, thread_name_prefix='migrate') if workers > 1 else None
+        while True:
+            # Обработанные записи получают ссылку на содержимое, поэтому повторный запуск продолжает с места остановки
+            batch = list(File.objects.filter(blob__isnull=True, pk__gt=last_pk).order_by('pk')[:options['batch_size']])
+            if not batch:
+                break
+            last_pk = batch[-1].pk
+            # Хеширование и копирование идут параллельно, следующий пакет читается после завершения текущего
+            for result in (executor.map if executor else map)(self.migrate_file, batch):
+                if result is None:
+                    failed += 1
+                elif result:
+                    migrated += 1
+                else:
+                    missing += 1
+            self.stdout.write(f'Обработаны записи до id {last_pk}: перенесено {migrated}, '
+                              f'не найдено {missing}, ошибок {failed}')
+        if executor:
+            executor.shutdown()
+        logger.info(f'Перенесено файлов в хранилище содержимого: {migrated}, не найдено на диске: {missing}, '
+                    f'ошибок: {failed}')
+        self.stdout.write(self.style.SUCCESS(f'Перенесено файлов: {migrated}, не найдено на диске: {missing}, '
+                                             f'ошибок: {failed}'))
+
+    def migrate_file(self, file):
+        """
+        Переносит файл и возвращает True, False если файла нет на диске, или None при ошибке.
+        Файл, перенос которого не удался, остаётся на месте и обрабатывается при следующем запуске
+        """
+        close_old_connections()
+        try:
+            return self.move_to_blob(file)
+        except Exception:
+            logger.exception(f'Не удалось перенести файл {file.content}')
+            return None
+
+    def move_to_blob(self, file):
+        storage = file.storage
+        name = file.content.name
+        if not storage.exists(name):
+            logger.error(f'Файл отсутствует по пути {file.content}')
+            return False
+        # Исходный файл удаляется только после фиксации транзакции, поэтому сбой не приводит к потере данных,
+        # а скачивание, начатое по старому пути, дочитывает уже открытый файл
+        source_path = storage.path(name)
+        link_path = get_temporary_path()
+        try:
+            if source_path:
+                try:
+                    os.link(source_path, link_path)
+                except OSError:
+                    shutil.copy2(source_path, link_path)
+            else:
+                with storage.open(name) as source, open(link_path, 'wb') as destination:
+                    shutil.copyfileobj(source, destination)
+            sha256 = get_file_sha256(link_path)
+            with transaction.atomic():
+                blob = Blob.store(link_path, sha256, os.path.getsize(link_path))
+                file.blob = blob
+                file.content.name = blob.name
+                # Содержимое помещается в основное хранилище, даже если исходный файл был на холодном уровне
+                file.tier = File.HOT
+                file.save(update_fields=['blob', 'content', 'tier'])
+        except Exception:
+            remove_files([link_path])
+            raise
+        storage.delete([name])
+        if source_path:
+            self.remove_empty_directories(os.path.dirname(source_path), storage.path(''))
+        return True
+
+    @staticmethod
+    def remove_empty_directories(directory, root):
+        # Удаляем опустевшие подкаталоги вплоть до каталога пользователя
+        while os.path.dirname(os.path.relpath(directory, root)):
+            try:
+                os.rmdir(directory)
+            except OSError:
+                return
+            directory = os.path.dirname(directory)
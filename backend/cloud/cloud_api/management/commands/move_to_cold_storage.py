@@ -0,0 +1,70 @@
+import logging
+from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from cloud.settings import COLD_STORAGE_IDLE_DAYS
+from cloud_api.models import Blob, File
+from cloud_api.tiers import demote, recently_used
+
+logger = logging.getLogger('main')
+
+
+class Command(BaseCommand):
+    help = 'Переносит на холодный уровень хранения файлы, которые давно не скачивали (запускается периодически)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=COLD_STORAGE_IDLE_DAYS,
+                            help='Количество дней без скачиваний, после которого файл переносится')
+        parser.add_argument('--batch-size', type=int, default=500, help='Количество записей, читаемых за один запрос')
+        parser.add_argument('--workers', type=int, default=4, help='Количество файлов, переносимых параллельно')
+
+    def handle(self, *args, **options):
+        since = timezone.now() - timedelta(days=options['days'])
+        batch_size = options['batch_size']
+        workers = max(options['workers'], 1)
+        # С одним исполнителем файлы переносятся в основном потоке
+        executor = ThreadPoolExecutor(workers, thread_name_prefix='tiering') if workers > 1 else None
+        moved = 0
+
+        def move(file):
+            close_old_connections()
+            try:
+                return demote(file, since)
+            except Exception:
+                logger.exception(f'Не удалось перенести на холодный уровень файл {file.content}')
+                return False
+
+        # Содержимое из хранилища содержимого переносится, только если ни один ссылающийся файл не использовался
+        hot = File.objects.filter(blob=OuterRef('pk'), tier=File.HOT)
+        recent = File.objects.filter(blob=OuterRef('pk')).filter(recently_used(since))
+        blobs = Blob.objects.filter(Exists(hot)).exclude(Exists(recent)).order_by('pk')
+        last_sha256 = ''
+        while True:
+            batch = list(blobs.filter(pk__gt=last_sha256).values_list('pk', flat=True)[:batch_size])
+            if not batch:
+                break
+            last_sha256 = batch[-1]
+            # Для каждого содержимого достаточно одной ссылающейся записи
+            files = {file.blob_id: file
+                     for file in File.objects.filter(blob__in=batch).only('id', 'content', 'blob', 'tier')}
+            moved += sum((executor.map if executor else map)(move, files.values()))
+
+        # Файлы из каталогов пользователей переносятся по отдельности
+        legacy = File.objects.filter(blob__isnull=True, tier=File.HOT).exclude(recently_used(since)).order_by('pk')
+        last_pk = 0
+        while True:
+            batch = list(legacy.filter(pk__gt=last_pk).only('id', 'content', 'blob', 'tier')[:batch_size])
+            if not batch:
+                break
+            last_pk = batch[-1].pk
+            moved += sum((executor.map if executor else map)(move, batch))
+
+        if executor:
+            executor.shutdown()
+        logger.info(f'Перенесено на холодный уровень хранения: {moved}')
+        self.stdout.write(self.style.SUCCESS(f'Перенесено на холодный уровень хранения: {moved}'))
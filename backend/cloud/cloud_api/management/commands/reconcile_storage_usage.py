@@ -0,0 +1,24 @@
+import logging
+
+from django.core.management.base import BaseCommand
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+from cloud_api.models import CloudUser, File
+
+logger = logging.getLogger('main')
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает занятое место и количество файлов всех пользователей по таблице файлов'
+
+    def handle(self, *args, **options):
+        files = File.objects.filter(cloud_user=OuterRef('pk')).order_by().values('cloud_user')
+        # Один UPDATE с коррелированными подзапросами вместо загрузки пользователей в память
+        updated = CloudUser.objects.update(
+            storage_used=Coalesce(Subquery(files.annotate(total=Sum('size')).values('total')), 0),
+            files_count=Coalesce(Subquery(files.annotate(total=Count('id')).values('total'),
+                                          output_field=IntegerField()), 0),
+        )
+        logger.info(f'Пересчитано занятое место пользователей: {updated}')
+        self.stdout.write(self.style.SUCCESS(f'Пересчитано занятое место пользователей: {updated}'))
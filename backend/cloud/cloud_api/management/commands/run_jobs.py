@@ -0,0 +1,78 @@
+import signal
+import logging
+import multiprocessing
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError
+
+from cloud.settings import JOBS_WORKERS, JOBS_POOL, JOBS_POLL_INTERVAL
+from cloud_api.jobs import claim_jobs, requeue_stale_jobs, run_job
+
+logger = logging.getLogger('main')
+
+
+class Command(BaseCommand):
+    help = 'Выполняет фоновые задачи из очереди в пуле потоков или процессов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=JOBS_WORKERS,
+                            help='Количество одновременно выполняемых задач')
+        parser.add_argument('--pool', choices=['thread', 'process'], default=JOBS_POOL,
+                            help='Тип пула исполнителей')
+        parser.add_argument('--poll-interval', type=float, default=JOBS_POLL_INTERVAL,
+                            help='Интервал опроса пустой очереди в секундах')
+        parser.add_argument('--once', action='store_true',
+                            help='Выполнить задачи, находящиеся в очереди, и завершить работу')
+
+    def handle(self, *args, **options):
+        workers = options['workers']
+        if workers < 1:
+            raise CommandError('Количество исполнителей должно быть положительным')
+        if options['pool'] == 'process':
+            # Дочерние процессы запускаются заново и не наследуют соединения с базой родительского процесса
+            executor = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'),
+                                           initializer=django.setup)
+        else:
+            executor = ThreadPoolExecutor(workers, thread_name_prefix='job')
+
+        stopping = []
+
+        def stop(signum, frame):
+            logger.info('Обработчик задач завершает работу после выполнения текущих задач')
+            stopping.append(signum)
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+
+        requeued = requeue_stale_jobs()
+        if requeued:
+            logger.warning(f'Возвращено в очередь брошенных задач: {requeued}')
+        logger.info(f'Обработчик задач запущен: {workers} исполнителей ({options["pool"]})')
+
+        running = set()
+        completed = 0
+        while not stopping:
+            free = workers - len(running)
+            try:
+                claimed = claim_jobs(free) if free else []
+            except DatabaseError as error:
+                # База временно недоступна: повторим попытку при следующем опросе
+                logger.warning(f'Не удалось получить задачи из очереди: {error}')
+                claimed = []
+            running.update(executor.submit(run_job, job_id) for job_id in claimed)
+            if options['once'] and not running:
+                break
+            if claimed and len(running) < workers:
+                continue
+            # Ждём освобождения исполнителя или следующего опроса очереди
+            done, running = wait(running, timeout=options['poll_interval'], return_when=FIRST_COMPLETED)
+            completed += len(done)
+            for future in done:
+                if future.exception():
+                    logger.error(f'Сбой исполнителя задачи: {future.exception()}')
+
+        executor.shutdown(wait=True)
+        completed += len(running)
+        self.stdout.write(self.style.SUCCESS(f'Обработчик задач остановлен, выполнено задач: {completed}'))
@@ -0,0 +1,124 @@
+import os
+import json
+import time
+import logging
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from cloud.settings import SCRUB_CHECKPOINT_PATH, SCRUB_GRACE_PERIOD
+from cloud_api.scrub import PHASES, Scrubber, run_in_order
+
+logger = logging.getLogger('main')
+
+# Как часто сохраняется положение проверки (сек.)
+CHECKPOINT_INTERVAL = 10
+
+
+class Command(BaseCommand):
+    help = ('Сверяет файлы на диске с записями в базе: находит отсутствующие файлы, файлы без записей '
+            'и несовпадения размеров и при необходимости исправляет их. Проверка продолжается с места, '
+            'на котором остановился предыдущий запуск, поэтому её можно выполнять по частям (например, каждую ночь)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repair', action='store_true',
+                            help='Исправлять найденные расхождения, которые можно исправить без потери данных')
+        parser.add_argument('--time-limit', type=int, default=0,
+                            help='Время работы (сек.), после которого проверка прерывается до следующего запуска '
+                                 '(0 — без ограничения)')
+        parser.add_argument('--restart', action='store_true', help='Начать проверку заново, а не с места остановки')
+        parser.add_argument('--checkpoint', default=SCRUB_CHECKPOINT_PATH, help='Файл с положением проверки')
+        parser.add_argument('--grace', type=int, default=SCRUB_GRACE_PERIOD,
+                            help='Возраст (сек.), начиная с которого файл без записи в базе считается лишним')
+        parser.add_argument('--batch-size', type=int, default=500, help='Количество записей, читаемых за один запрос')
+        parser.add_argument('--workers', type=int, default=4, help='Количество пакетов и каталогов, '
+                                                                   'проверяемых параллельно')
+
+    def handle(self, *args, **options):
+        path = options['checkpoint']
+        state = None if options['restart'] else self.load_checkpoint(path)
+        if state is None:
+            state = {'phase': PHASES[0], 'position': None, 'started': timezone.now().isoformat(), 'found': {},
+                     'repaired': {}}
+        else:
+            self.stdout.write(f'Проверка продолжается с этапа {state["phase"]}, положение {state["position"]}')
+        found = Counter(state['found'])
+        repaired = Counter(state['repaired'])
+        scrubber = Scrubber(options['repair'], options['grace'], options['batch_size'])
+        stages = {
+            'blobs': (scrubber.get_blob_batches, scrubber.check_blobs, lambda batch: batch[-1].pk),
+            'files': (scrubber.get_file_batches, scrubber.check_files, lambda batch: batch[-1].pk),
+            'disk': (scrubber.get_directories, scrubber.check_directory, lambda unit: unit),
+        }
+        deadline = time.monotonic() + options['time_limit'] if options['time_limit'] > 0 else None
+        workers = max(options['workers'], 1)
+        # С одним исполнителем проверка идёт в основном потоке
+        executor = ThreadPoolExecutor(workers, thread_name_prefix='scrub') if workers > 1 else None
+        saved = time.monotonic()
+        interrupted = False
+        try:
+            for phase in PHASES[PHASES.index(state['phase']):]:
+                get_items, check, get_position = stages[phase]
+                position = state['position'] if phase == state['phase'] else None
+                items = get_items() if position is None else get_items(position)
+                # Положение сохраняется по последнему элементу, проверенному вместе со всеми предыдущими,
+                # поэтому после прерывания ничего не пропускается
+                for item, findings in run_in_order(executor, check, items, workers * 2):
+                    for finding in findings:
+                        self.report(finding)
+                        found[finding['kind']] += 1
+                        if finding['repaired']:
+                            repaired[finding['kind']] += 1
+                    state.update(phase=phase, position=get_position(item), found=found, repaired=repaired)
+                    if time.monotonic() - saved >= CHECKPOINT_INTERVAL:
+                        self.save_checkpoint(path, state)
+                        saved = time.monotonic()
+                    if deadline is not None and time.monotonic() >= deadline:
+                        interrupted = True
+                        break
+                if interrupted:
+                    break
+                state.update(phase=phase, position=None)
+        finally:
+            if executor:
+                executor.shutdown(cancel_futures=True)
+
+        summary = ', '.join(f'{kind} {count} (исправлено {repaired[kind]})' for kind, count in sorted(found.items()))
+        if interrupted:
+            self.save_checkpoint(path, state)
+            logger.info(f'Сверка хранилища прервана на этапе {state["phase"]}, найдено: {summary or "ничего"}')
+            self.stdout.write(self.style.WARNING(f'Проверка прервана по времени на этапе {state["phase"]}, '
+                                                 f'найдено: {summary or "ничего"}'))
+            return
+        # Следующий запуск начнёт новый полный проход
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        logger.info(f'Сверка хранилища завершена (начата {state["started"]}), найдено: {summary or "ничего"}')
+        self.stdout.write(self.style.SUCCESS(f'Проверка завершена, найдено: {summary or "ничего"}'))
+
+    def report(self, finding):
+        repaired = ' (исправлено)' if finding['repaired'] else ''
+        logger.warning(f'Сверка хранилища: {finding["kind"]} {finding["target"]}: {finding["detail"]}{repaired}',
+                       extra={'event': 'scrub', **finding})
+        self.stdout.write(f'{finding["kind"]} {finding["target"]}: {finding["detail"]}{repaired}')
+
+    @staticmethod
+    def load_checkpoint(path):
+        try:
+            with open(path, encoding='utf-8') as stream:
+                state = json.load(stream)
+        except FileNotFoundError:
+            return None
+        return state if state.get('phase') in PHASES else None
+
+    @staticmethod
+    def save_checkpoint(path, state):
+        # Файл заменяется целиком, чтобы прерванная запись не испортила сохранённое положение
+        temporary_path = f'{path}.tmp'
+        with open(temporary_path, 'w', encoding='utf-8') as stream:
+            json.dump(state, stream, ensure_ascii=False)
+        os.replace(temporary_path, path)
@@ -0,0 +1,145 @@
+import time
+import bisect
+import threading
+
+# Границы корзин гистограммы длительности запросов (сек.)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# Маршрут запросов, не сопоставленных ни с одним URL
+UNMATCHED_ROUTE = '<unmatched>'
+
+
+def escape_label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class RouteMetrics:
+    """
+    Счётчики запросов одного маршрута и метода. Строка меток формируется один раз при создании,
+    поэтому учёт запроса не выделяет памяти под метки
+    """
+    __slots__ = ('labels', 'lock', 'buckets', 'duration_sum', 'statuses', 'db_queries', 'db_duration',
+                 'request_bytes', 'response_bytes', 'in_flight')
+
+    def __init__(self, route, method):
+        self.labels = f'route="{escape_label(route)}",method="{method}"'
+        self.lock = threading.Lock()
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.duration_sum = 0.0
+        self.statuses = {}
+        self.db_queries = 0
+        self.db_duration = 0.0
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self.in_flight = 0
+
+    def start(self):
+        with self.lock:
+            self.in_flight += 1
+
+    def finish(self, status, duration, request_bytes, db_queries, db_duration):
+        index = bisect.bisect_left(LATENCY_BUCKETS, duration)
+        with self.lock:
+            self.in_flight -= 1
+            self.buckets[index] += 1
+            self.duration_sum += duration
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+            self.request_bytes += request_bytes
+            self.db_queries += db_queries
+            self.db_duration += db_duration
+
+    def add_response_bytes(self, size):
+        with self.lock:
+            self.response_bytes += size
+
+
+class MetricsRegistry:
+    """
+    Метрики запросов процесса по маршрутам и методам. Каждый процесс сервера ведёт собственные метрики
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.routes = {}
+        # Функции, возвращающие строки дополнительных метрик процесса
+        self.collectors = []
+
+    def add_collector(self, collector):
+        self.collectors.append(collector)
+
+    def get(self, route, method):
+        methods = self.routes.get(route)
+        series = methods.get(method) if methods else None
+        if series is None:
+            with self.lock:
+                methods = self.routes.setdefault(route, {})
+                series = methods.get(method)
+                if series is None:
+                    series = methods[method] = RouteMetrics(route, method)
+        return series
+
+    def render(self):
+        """
+        Возвращает метрики в текстовом формате Prometheus
+        """
+        with self.lock:
+            series = [item for methods in self.routes.values() for item in methods.values()]
+        snapshots = []
+        for item in series:
+            with item.lock:
+                snapshots.append((item.labels, list(item.buckets), item.duration_sum, dict(item.statuses),
+                                  item.db_queries, item.db_duration, item.request_bytes, item.response_bytes,
+                                  item.in_flight))
+
+        lines = ['# HELP cloud_http_requests_total Количество обработанных запросов',
+                 '# TYPE cloud_http_requests_total counter']
+        for labels, _, _, statuses, *_ in snapshots:
+            lines.extend(f'cloud_http_requests_total{{{labels},status="{status}"}} {count}'
+                         for status, count in sorted(statuses.items()))
+
+        lines += ['# HELP cloud_http_request_duration_seconds Время обработки запроса до отправки заголовков ответа',
+                  '# TYPE cloud_http_request_duration_seconds histogram']
+        for labels, buckets, duration_sum, *_ in snapshots:
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), buckets):
+                cumulative += count
+                lines.append(f'cloud_http_request_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'cloud_http_request_duration_seconds_sum{{{labels}}} {duration_sum}')
+            lines.append(f'cloud_http_request_duration_seconds_count{{{labels}}} {cumulative}')
+
+        counters = [
+            ('cloud_http_db_queries_total', 'Количество запросов к базе данных', 4),
+            ('cloud_http_db_query_duration_seconds_total', 'Суммарное время запросов к базе данных', 5),
+            ('cloud_http_request_bytes_total', 'Объём принятых тел запросов (загрузки)', 6),
+            ('cloud_http_response_bytes_total', 'Объём отданных тел ответов (скачивания)', 7),
+        ]
+        for name, description, position in counters:
+            lines += [f'# HELP {name} {description}', f'# TYPE {name} counter']
+            lines.extend(f'{name}{{{snapshot[0]}}} {snapshot[position]}' for snapshot in snapshots)
+
+        lines += ['# HELP cloud_http_requests_in_flight Количество выполняющихся запросов',
+                  '# TYPE cloud_http_requests_in_flight gauge']
+        lines.extend(f'cloud_http_requests_in_flight{{{snapshot[0]}}} {snapshot[8]}' for snapshot in snapshots)
+        for collector in self.collectors:
+            lines.extend(collector())
+        return '\n'.join(lines) + '\n'
+
+
+metrics_registry = MetricsRegistry()
+
+
+class QueryTimer:
+    """
+    Обёртка выполнения запросов к базе, считающая их количество и суммарное время
+    """
+    __slots__ = ('count', 'duration')
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.duration += time.perf_counter() - started
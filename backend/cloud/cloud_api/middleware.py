@@ -0,0 +1,132 @@
+import re
+import time
+import uuid
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.db import connection
+
+from .logs import request_id_var
+from .metrics import UNMATCHED_ROUTE, QueryTimer, metrics_registry
+
+# Методы, которые учитываются под своим именем; остальные — как OTHER, чтобы число серий было ограничено
+KNOWN_METHODS = frozenset(['GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'])
+# Идентификатор запроса, переданный прокси или клиентом, принимается, только если он короткий и без спецсимволов
+REQUEST_ID_PATTERN = re.compile(r'[A-Za-z0-9._-]{1,64}')
+
+
+def count_bytes(content, series):
+    for chunk in content:
+        series.add_response_bytes(len(chunk))
+        yield chunk
+
+
+async def acount_bytes(content, series):
+    async for chunk in content:
+        series.add_response_bytes(len(chunk))
+        yield chunk
+
+
+class MetricsMiddleware:
+    """
+    Собирает метрики запросов по маршруту URL и методу: длительность, количество и время запросов к базе,
+    объём принятых и отданных данных, количество выполняющихся запросов.
+    В асинхронных представлениях запросы к базе выполняются в других потоках и не учитываются
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        started = time.perf_counter()
+        timer = QueryTimer()
+        with connection.execute_wrapper(timer):
+            response = self.get_response(request)
+        self.record(request, response, started, timer)
+        return response
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        response = await self.get_response(request)
+        self.record(request, response, started, None)
+        return response
+
+    @staticmethod
+    def process_view(request, view_func, view_args, view_kwargs):
+        # Маршрут известен только после сопоставления URL
+        method = request.method if request.method in KNOWN_METHODS else 'OTHER'
+        request.metrics = metrics_registry.get(request.resolver_match.route, method)
+        request.metrics.start()
+
+    @staticmethod
+    def record(request, response, started, timer):
+        series = getattr(request, 'metrics', None)
+        if series is None:
+            method = request.method if request.method in KNOWN_METHODS else 'OTHER'
+            series = metrics_registry.get(UNMATCHED_ROUTE, method)
+            series.start()
+        try:
+            request_bytes = int(request.META.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            request_bytes = 0
+        series.finish(response.status_code, time.perf_counter() - started, request_bytes,
+                      timer.count if timer else 0, timer.duration if timer else 0.0)
+
+        # Размер тела известен заранее у обычных ответов и у отдачи файлов; потоковые ответы без длины
+        # (архивы, распаковка на лету) подсчитываются по мере передачи
+        length = response.get('Content-Length')
+        if length is not None and length.isdigit():
+            series.add_response_bytes(int(length))
+        elif not response.streaming:
+            series.add_response_bytes(len(response.content))
+        elif response.is_async:
+            response.streaming_content = acount_bytes(response.streaming_content, series)
+        else:
+            response.streaming_content = count_bytes(response.streaming_content, series)
+
+
+class RequestIdMiddleware:
+    """
+    Назначает запросу идентификатор (из заголовка X-Request-ID или новый), который добавляется
+    ко всем записям журнала, сделанным при обработке запроса, и возвращается в заголовке ответа
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = request_id_var.set(self.get_request_id(request))
+        try:
+            response = self.get_response(request)
+        finally:
+            request_id_var.reset(token)
+        response['X-Request-ID'] = request.request_id
+        return response
+
+    async def __acall__(self, request):
+        token = request_id_var.set(self.get_request_id(request))
+        try:
+            response = await self.get_response(request)
+        finally:
+            request_id_var.reset(token)
+        response['X-Request-ID'] = request.request_id
+        return response
+
+    @staticmethod
+    def get_request_id(request):
+        request_id = request.META.get('HTTP_X_REQUEST_ID', '')
+        if not REQUEST_ID_PATTERN.fullmatch(request_id):
+            request_id = uuid.uuid4().hex
+        request.request_id = request_id
+        return request_id
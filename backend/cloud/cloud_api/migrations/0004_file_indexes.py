@@ -0,0 +1,25 @@
+# Generated by Django 5.0.2 on 2026-10-18 14:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cloud_api', '0003_blob'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='file',
+            index=models.Index(fields=['cloud_user', 'date_uploaded'], name='file_user_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='file',
+            index=models.Index(fields=['cloud_user', 'size'], name='file_user_size_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='file',
+            constraint=models.UniqueConstraint(fields=('cloud_user', 'filename'), name='unique_user_filename'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.0.2 on 2026-10-18 14:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cloud_api', '0004_file_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='file',
+            name='bytes_served',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='file',
+            name='download_count',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.0.2 on 2026-10-18 14:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cloud_api', '0005_download_stats'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='file',
+            name='external_link_key',
+            field=models.CharField(blank=True, max_length=32),
+        ),
+        migrations.AddConstraint(
+            model_name='file',
+            constraint=models.UniqueConstraint(condition=models.Q(('external_link_key', ''), _negated=True), fields=('external_link_key',), name='unique_external_link_key'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.0.2 on 2026-10-18 14:13
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def fill_storage_usage(apps, schema_editor):
+    CloudUser = apps.get_model('cloud_api', 'CloudUser')
+    File = apps.get_model('cloud_api', 'File')
+    files = File.objects.filter(cloud_user=OuterRef('pk')).order_by().values('cloud_user')
+    CloudUser.objects.update(
+        storage_used=Coalesce(Subquery(files.annotate(total=Sum('size')).values('total')), 0),
+        files_count=Coalesce(Subquery(files.annotate(total=Count('id')).values('total'),
+                                      output_field=IntegerField()), 0),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cloud_api', '0006_external_link_key_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='clouduser',
+            name='files_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='clouduser',
+            name='storage_quota',
+            field=models.PositiveBigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='clouduser',
+            name='storage_used',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.RunPython(fill_storage_usage, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.0.2 on 2026-10-18 14:26
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def fill_stored_size(apps, schema_editor):
+    # Существующее содержимое хранится без сжатия
+    Blob = apps.get_model('cloud_api', 'Blob')
+    Blob.objects.update(stored_size=F('size'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cloud_api', '0008_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='blob',
+            name='encoding',
+            field=models.CharField(blank=True, max_length=10),
+        ),
+        migrations.AddField(
+            model_name='blob',
+            name='stored_size',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.RunPython(fill_stored_size, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.2 on 2026-10-18 14:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cloud_api', '0009_blob_compression'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='file',
+            name='tier',
+            field=models.CharField(choices=[('hot', 'Основное хранилище'), ('cold', 'Холодное хранилище')], default='hot', max_length=4),
+        ),
+    ]
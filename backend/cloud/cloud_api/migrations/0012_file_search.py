@@ -0,0 +1,69 @@
+# Generated by Django 5.0.2 on 2026-10-18 14:49
+
+import re
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+TRIGRAM_INDEXES = (('file_filename_trgm_idx', 'filename'), ('file_comment_trgm_idx', 'comment'))
+
+
+def create_search_index(apps, schema_editor):
+    """
+    В PostgreSQL поиск использует GIN-индексы pg_trgm по тем же выражениям, что и icontains/istartswith.
+    Для остальных СУБД заполняется таблица триграмм по уже загруженным файлам
+    """
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        for name, column in TRIGRAM_INDEXES:
+            schema_editor.execute(f'CREATE INDEX IF NOT EXISTS {name} ON cloud_api_file '
+                                  f'USING gin ((UPPER({column}::text)) gin_trgm_ops)')
+        return
+
+    File = apps.get_model('cloud_api', 'File')
+    FileSearchTrigram = apps.get_model('cloud_api', 'FileSearchTrigram')
+    word_pattern = re.compile(r'[^\W_]+')
+    batch = []
+    for file in File.objects.only('id', 'cloud_user', 'filename', 'comment').iterator():
+        for field, text in ((0, file.filename), (1, file.comment)):
+            trigrams = set()
+            for word in word_pattern.findall(text.lower()):
+                word = f'  {word} '
+                trigrams.update(word[index:index + 3] for index in range(len(word) - 2))
+            batch.extend(FileSearchTrigram(file_id=file.pk, cloud_user_id=file.cloud_user_id, field=field,
+                                           trigram=trigram) for trigram in trigrams)
+        if len(batch) >= 1000:
+            FileSearchTrigram.objects.bulk_create(batch)
+            batch = []
+    FileSearchTrigram.objects.bulk_create(batch)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        for name, _ in TRIGRAM_INDEXES:
+            schema_editor.execute(f'DROP INDEX IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cloud_api', '0011_api_token'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FileSearchTrigram',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('field', models.PositiveSmallIntegerField(choices=[(0, 'Имя файла'), (1, 'Комментарий')])),
+                ('trigram', models.CharField(max_length=3)),
+                ('cloud_user', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('file', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_trigrams', to='cloud_api.file')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['cloud_user', 'trigram'], name='search_user_trigram_idx')],
+            },
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.0.2 on 2026-10-18 14:53
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cloud_api', '0012_file_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='clouduser',
+            name='change_sequence',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='FileChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sequence', models.PositiveBigIntegerField()),
+                ('action', models.CharField(choices=[('created', 'Создан'), ('renamed', 'Переименован'), ('updated', 'Изменён'), ('deleted', 'Удалён')], max_length=7)),
+                ('file_id', models.BigIntegerField()),
+                ('filename', models.CharField(max_length=100)),
+                ('date_created', models.DateTimeField(auto_now_add=True)),
+                ('cloud_user', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='file_changes', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SyncClient',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('client_id', models.CharField(max_length=64)),
+                ('cursor', models.PositiveBigIntegerField(default=0)),
+                ('last_seen', models.DateTimeField()),
+                ('cloud_user', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='sync_clients', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='filechange',
+            constraint=models.UniqueConstraint(fields=('cloud_user', 'sequence'), name='unique_user_change_sequence'),
+        ),
+        migrations.AddConstraint(
+            model_name='syncclient',
+            constraint=models.UniqueConstraint(fields=('cloud_user', 'client_id'), name='unique_user_sync_client'),
+        ),
+    ]
@@ -1,12 +1,20 @@
 import os
+import uuid
 import shutil
 import logging
+from datetime import timedelta
 
 from django.contrib.auth.models import AbstractUser
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.utils import timezone
 
-from cloud.settings import MEDIA_ROOT
-from .utils import get_user_directory_path
+from cloud.settings import BLOB_DIR, UPLOAD_SESSION_ROOT, UPLOAD_CHUNK_SIZE, STORAGE_DEFAULT_QUOTA
+from .compression import ENCODING_SUFFIXES, compress_file, get_content_encoding
+from .exceptions import QuotaExceeded
+from .storage import TRASH_DIR, cold_storage, get_storage, get_temporary_path, hot_storage
+from .utils import get_user_directory_path, get_blob_path, get_file_sha256, remove_files
 
 # Получаем логгер с именем 'main' из конфигурации логирования
 logger = logging.getLogger('main')
@@ -15,27 +23,504 @@ logger = logging.getLogger('main')
 class CloudUser(AbstractUser):
     email = models.EmailField(unique=True)  # Поле для адреса электронной почты пользователя
     storage_directory = models.CharField(max_length=100, blank=True)  # Папка хранения пользователя
+    storage_used = models.PositiveBigIntegerField(default=0)  # Суммарный размер файлов пользователя
+    files_count = models.PositiveIntegerField(default=0)  # Количество файлов пользователя
+    storage_quota = models.PositiveBigIntegerField(null=True, blank=True)  # Квота хранилища (пусто — квота по умолчанию)
+    change_sequence = models.PositiveBigIntegerField(default=0)  # Номер последнего изменения в журнале файлов
+
+    @property
+    def quota(self):
+        return self.get_quota(self.storage_quota)
+
+    @staticmethod
+    def get_quota(storage_quota):
+        # Действующая квота в байтах или None, если объём не ограничен
+        quota = storage_quota if storage_quota is not None else STORAGE_DEFAULT_QUOTA
+        return quota or None
+
+    def has_space_for(self, size):
+        """
+        Проверяет, поместятся ли ещё size байт в квоту. Счётчики читаются из базы,
+        так как пользователь запроса может быть взят из кеша аутентификации
+        """
+        counters = CloudUser.objects.filter(pk=self.pk).values('storage_used', 'storage_quota').first()
+        if counters is None:
+            return False
+        quota = self.get_quota(counters['storage_quota'])
+        return quota is None or counters['storage_used'] + size <= quota
+
+    @classmethod
+    def change_usage(cls, user_id, size, count, quota=None):
+        """
+        Изменяет счётчики занятого места и количества файлов одним UPDATE.
+        Если передана квота, увеличение выполняется только когда она не будет превышена,
+        иначе возвращается False
+        """
+        queryset = cls.objects.filter(pk=user_id)
+        if quota is not None and size > 0:
+            queryset = queryset.filter(storage_used__lte=quota - size)
+        return bool(queryset.update(storage_used=Greatest(F('storage_used') + size, 0),
+                                    files_count=Greatest(F('files_count') + count, 0)))
 
     # Метод для удаления директории пользователя
     def delete_storage(self):
-        # Удаляем директорию пользователя и все ее содержимое
-        shutil.rmtree(os.path.join(MEDIA_ROOT, str(self.storage_directory)), ignore_errors=True)
+        # Удаляем директорию пользователя и все ее содержимое на обоих уровнях хранения.
+        # Без имени директории удалять нечего: иначе был бы удалён корень хранилища
+        if not self.storage_directory:
+            return
+        for storage in (hot_storage, cold_storage):
+            storage.delete_directory(str(self.storage_directory))
         logger.info(f'Директория пользователя {self.username} удалена')
 
     def __str__(self):
         return self.username  # Возвращаем имя пользователя в виде строки
 
 
+# Класс модели содержимого файла, хранящегося один раз по хешу SHA-256
+class Blob(models.Model):
+    sha256 = models.CharField(max_length=64, primary_key=True)  # Хеш содержимого
+    size = models.BigIntegerField()  # Размер содержимого
+    encoding = models.CharField(max_length=10, blank=True)  # Метод сжатия на диске ('' — без сжатия)
+    stored_size = models.BigIntegerField(null=True, blank=True)  # Размер, занимаемый на диске
+    ref_count = models.PositiveIntegerField(default=0)  # Количество файлов, ссылающихся на содержимое
+    date_created = models.DateTimeField(auto_now_add=True)  # Дата первой загрузки содержимого
+
+    @property
+    def name(self):
+        # Путь к содержимому относительно корня уровня хранения (у сжатого содержимого с суффиксом метода сжатия)
+        return get_blob_path(self.sha256) + ENCODING_SUFFIXES.get(self.encoding, '')
+
+    @classmethod
+    def store(cls, source_path, sha256, size, references=1, compressed=None):
+        """
+        Помещает файл source_path в хранилище содержимого и добавляет ссылки на него.
+        compressed — уже подготовленная сжатая копия (кодировка, путь); для нового содержимого
+        без неё файл сжимается здесь, если это включено в настройках.
+        Если такое содержимое уже хранится, исходный файл и сжатая копия удаляются
+        """
+        if compressed is None and not cls.objects.filter(pk=sha256).exists():
+            compressed = compress_file(source_path, size)
+        encoding, compressed_path = compressed or ('', None)
+        try:
+            with transaction.atomic():
+                # Строка блокируется, поэтому параллельное освобождение не удалит содержимое до конца операции
+                blob, created = cls.objects.select_for_update().get_or_create(
+                    sha256=sha256, defaults={'size': size, 'encoding': encoding, 'stored_size': size})
+                if created or not hot_storage.exists(blob.name):
+                    if blob.encoding != encoding:
+                        # Пути файлов включают суффикс сжатия, поэтому утраченное содержимое восстанавливается
+                        # в прежнем виде
+                        remove_files([compressed_path] if compressed_path else [])
+                        compressed_path = compress_file(source_path, size, blob.encoding)[1] if blob.encoding else None
+                    stored_path = compressed_path or source_path
+                    blob.stored_size = os.path.getsize(stored_path)
+                    blob.save(update_fields=['stored_size'])
+                    hot_storage.save(blob.name, stored_path)
+                cls.objects.filter(pk=sha256).update(ref_count=F('ref_count') + references)
+        except Exception:
+            # Исходный файл остаётся вызывающему коду, сжатая копия больше не нужна
+            remove_files([compressed_path] if compressed_path else [])
+            raise
+        remove_files([source_path] + ([compressed_path] if compressed_path else []))
+        return blob
+
+    @classmethod
+    def store_uploaded_file(cls, uploaded_file):
+        """
+        Помещает загруженный файл в хранилище содержимого.
+        Временный файл переносится без копирования, файл из памяти записывается на диск
+        """
+        sha256 = getattr(uploaded_file, 'sha256', None)
+        compressed = None
+        if getattr(uploaded_file, 'compressed_file', None) is not None:
+            # Сжатая копия подготовлена обработчиком загрузки
+            compressed = (uploaded_file.encoding, uploaded_file.compressed_file.temporary_file_path())
+        if hasattr(uploaded_file, 'temporary_file_path'):
+            source_path = uploaded_file.temporary_file_path()
+        else:
+            source_path = get_temporary_path()
+            with open(source_path, 'wb') as destination:
+                for chunk in uploaded_file.chunks():
+                    destination.write(chunk)
+        if sha256 is None:
+            sha256 = get_file_sha256(source_path)
+        return cls.store(source_path, sha256, uploaded_file.size, compressed=compressed)
+
+    def release(self, references=1):
+        """
+        Снимает ссылки на содержимое и удаляет его из хранилища, когда ссылок не осталось
+        """
+        with transaction.atomic():
+            blob = Blob.objects.select_for_update().get(pk=self.pk)
+            blob.ref_count = max(blob.ref_count - references, 0)
+            if blob.ref_count:
+                blob.save(update_fields=['ref_count'])
+                return
+            name = blob.name
+            blob.delete()
+            # Удаляем файл, пока строка заблокирована: новая загрузка того же содержимого дождётся удаления
+            hot_storage.delete([name])
+            cold_storage.delete([name])
+        logger.info(f'Содержимое {self.sha256} удалено из хранилища')
+
+    @classmethod
+    def release_many(cls, references):
+        """
+        Снимает ссылки сразу с нескольких содержимых (словарь хеш → количество ссылок).
+        Содержимое без ссылок убирается в корзину хранилища под блокировкой строк,
+        а окончательно удаляется одним пакетом после фиксации транзакции.
+        Если откатывается эта транзакция, содержимое сразу возвращается из корзины,
+        а после отката внешней транзакции его возвращает empty_trash
+        """
+        trash = []
+        try:
+            with transaction.atomic():
+                blobs = list(cls.objects.select_for_update().filter(pk__in=references))
+                for blob in blobs:
+                    blob.ref_count = max(blob.ref_count - references[blob.pk], 0)
+                released = [blob for blob in blobs if not blob.ref_count]
+                cls.objects.bulk_update([blob for blob in blobs if blob.ref_count], ['ref_count'])
+                cls.objects.filter(pk__in=[blob.pk for blob in released]).delete()
+                for blob in released:
+                    trash.append((blob.name, hot_storage.trash(blob.name)))
+                names = [blob.name for blob in released]
+                transaction.on_commit(lambda: hot_storage.purge([trashed for _, trashed in trash]))
+                # Копии на холодном уровне удаляются вместе с корзиной
+                transaction.on_commit(lambda: cold_storage.delete(names))
+        except BaseException:
+            for name, trashed in trash:
+                if trashed:
+                    hot_storage.restore(trashed, name)
+            raise
+        if released:
+            logger.info(f'Из хранилища удалено содержимое файлов: {len(released)}')
+        return len(released)
+
+    @classmethod
+    def empty_trash(cls):
+        """
+        Разбирает корзину основного уровня: содержимое, запись которого осталась после отката транзакции,
+        возвращается на место, остальное удаляется. Возвращает количество возвращённых и удалённых файлов
+        """
+        restored = removed = 0
+        for trashed, _, _ in list(hot_storage.walk(f'{BLOB_DIR}/{TRASH_DIR}')):
+            with transaction.atomic():
+                # Блокировка дожидается транзакции, которая освобождает это содержимое
+                blob = cls.objects.select_for_update().filter(pk=os.path.basename(trashed)[:64]).first()
+                if blob is not None and not hot_storage.exists(blob.name):
+                    hot_storage.restore(trashed, blob.name)
+                    restored += 1
+                    continue
+            hot_storage.delete([trashed])
+            removed += 1
+        if restored:
+            logger.warning(f'Из корзины возвращено содержимое файлов: {restored}')
+        return restored, removed
+
+    def __str__(self):
+        return self.sha256
+
+
 # Класс модели файла
 class File(models.Model):
+    HOT = 'hot'
+    COLD = 'cold'
+    TIER_CHOICES = [
+        (HOT, 'Основное хранилище'),
+        (COLD, 'Холодное хранилище'),
+    ]
+
     cloud_user = models.ForeignKey(CloudUser, on_delete=models.CASCADE, related_name='files')  # Связь с пользователем
     filename = models.CharField(max_length=100, blank=True)  # Имя файла
-    size = models.IntegerField(blank=True)  # Размер файла
+    size = models.BigIntegerField(blank=True)  # Размер файла
     comment = models.CharField(max_length=255, blank=True)  # Комментарий к файлу
     date_uploaded = models.DateTimeField(auto_now_add=True)  # Дата загрузки файла
     last_download = models.DateTimeField(null=True)  # Дата последней загрузки
-    external_link_key = models.URLField(blank=True)  # Ключ для внешней ссылки на файл
+    download_count = models.PositiveBigIntegerField(default=0)  # Количество скачиваний
+    bytes_served = models.PositiveBigIntegerField(default=0)  # Количество отданных байт
+    external_link_key = models.CharField(max_length=32, blank=True)  # Ключ для внешней ссылки на файл
     content = models.FileField(upload_to=get_user_directory_path)  # Файловое поле с пользовательским путем сохранения
+    blob = models.ForeignKey(Blob, on_delete=models.PROTECT, null=True, blank=True, related_name='files')  # Содержимое файла
+    tier = models.CharField(max_length=4, choices=TIER_CHOICES, default=HOT)  # Уровень хранения содержимого
+
+    class Meta:
+        constraints = [
+            # Имя файла уникально в пределах хранилища пользователя
+            models.UniqueConstraint(fields=['cloud_user', 'filename'], name='unique_user_filename'),
+            # Уникальный индекс по ключу внешней ссылки (файлы без ссылки в индекс не попадают)
+            models.UniqueConstraint(fields=['external_link_key'], condition=~models.Q(external_link_key=''),
+                                    name='unique_external_link_key'),
+        ]
+        indexes = [
+            # Индексы для сортировки и постраничного вывода списка файлов пользователя
+            models.Index(fields=['cloud_user', 'date_uploaded'], name='file_user_date_idx'),
+            models.Index(fields=['cloud_user', 'size'], name='file_user_size_idx'),
+        ]
+
+    @property
+    def etag(self):
+        # Хеш содержимого служит сильным валидатором для условных запросов
+        return f'"{self.blob_id}"' if self.blob_id else None
+
+    @property
+    def storage(self):
+        # Хранилище уровня, на котором лежит содержимое
+        return get_storage(cold=self.tier == self.COLD)
+
+    @property
+    def content_encoding(self):
+        # Метод сжатия содержимого на диске (файлы из каталогов пользователей не сжимаются)
+        return get_content_encoding(self.content.name) if self.blob_id else ''
 
     def __str__(self):
         return self.filename  # Возвращаем имя файла в виде строки
+
+
+# Класс модели индекса поиска по имени и комментарию файла для СУБД без pg_trgm
+class FileSearchTrigram(models.Model):
+    FILENAME = 0
+    COMMENT = 1
+    FIELD_CHOICES = [
+        (FILENAME, 'Имя файла'),
+        (COMMENT, 'Комментарий'),
+    ]
+
+    file = models.ForeignKey(File, on_delete=models.CASCADE, related_name='search_trigrams')  # Файл
+    cloud_user = models.ForeignKey(CloudUser, on_delete=models.CASCADE, db_index=False,
+                                   related_name='+')  # Владелец файла (поиск ведётся в пределах пользователя)
+    field = models.PositiveSmallIntegerField(choices=FIELD_CHOICES)  # Поле, из которого взята триграмма
+    trigram = models.CharField(max_length=3)  # Триграмма слова в нижнем регистре
+
+    class Meta:
+        indexes = [
+            # Отбор файлов пользователя по триграммам запроса
+            models.Index(fields=['cloud_user', 'trigram'], name='search_user_trigram_idx'),
+        ]
+
+
+# Класс модели записи журнала изменений файлов пользователя
+class FileChange(models.Model):
+    CREATED = 'created'
+    RENAMED = 'renamed'
+    UPDATED = 'updated'
+    DELETED = 'deleted'
+    ACTION_CHOICES = [
+        (CREATED, 'Создан'),
+        (RENAMED, 'Переименован'),
+        (UPDATED, 'Изменён'),
+        (DELETED, 'Удалён'),
+    ]
+
+    cloud_user = models.ForeignKey(CloudUser, on_delete=models.CASCADE, db_index=False,
+                                   related_name='file_changes')  # Владелец файла
+    sequence = models.PositiveBigIntegerField()  # Номер изменения, без пропусков в пределах пользователя
+    action = models.CharField(max_length=7, choices=ACTION_CHOICES)  # Вид изменения
+    file_id = models.BigIntegerField()  # Идентификатор файла (запись о файле может быть уже удалена)
+    filename = models.CharField(max_length=100)  # Имя файла после изменения
+    date_created = models.DateTimeField(auto_now_add=True)  # Дата изменения
+
+    class Meta:
+        constraints = [
+            # Уникальный индекс служит и для выборки изменений пользователя после курсора
+            models.UniqueConstraint(fields=['cloud_user', 'sequence'], name='unique_user_change_sequence'),
+        ]
+
+    def __str__(self):
+        return f'{self.sequence}: {self.action} {self.filename}'
+
+
+# Класс модели клиента синхронизации: номер последнего полученного им изменения
+class SyncClient(models.Model):
+    cloud_user = models.ForeignKey(CloudUser, on_delete=models.CASCADE, db_index=False,
+                                   related_name='sync_clients')  # Пользователь
+    client_id = models.CharField(max_length=64)  # Идентификатор, который передаёт клиент
+    cursor = models.PositiveBigIntegerField(default=0)  # Номер последнего полученного изменения
+    last_seen = models.DateTimeField()  # Дата последнего обращения
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['cloud_user', 'client_id'], name='unique_user_sync_client'),
+        ]
+
+    def __str__(self):
+        return f'{self.client_id} ({self.cursor})'
+
+
+# Класс модели сессии возобновляемой загрузки
+class UploadSession(models.Model):
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)  # Идентификатор сессии
+    cloud_user = models.ForeignKey(CloudUser, on_delete=models.CASCADE, related_name='upload_sessions')  # Владелец загрузки
+    filename = models.CharField(max_length=100)  # Имя будущего файла
+    comment = models.CharField(max_length=255, blank=True)  # Комментарий к будущему файлу
+    size = models.BigIntegerField()  # Полный размер файла
+    offset = models.BigIntegerField(default=0)  # Количество уже принятых байт
+    date_created = models.DateTimeField(auto_now_add=True)  # Дата создания сессии
+    date_updated = models.DateTimeField(auto_now=True)  # Дата приёма последнего фрагмента
+
+    @property
+    def part_path(self):
+        # Путь к недокачанному файлу
+        return os.path.join(UPLOAD_SESSION_ROOT, f'{self.id}.part')
+
+    def create_part(self):
+        # Создаём пустой файл, в который будут дописываться фрагменты
+        os.makedirs(UPLOAD_SESSION_ROOT, exist_ok=True)
+        open(self.part_path, 'wb').close()
+
+    def write_chunk(self, stream, length):
+        """
+        Принимает не более length байт из потока во временный файл фрагмента.
+        Данные копируются блоками, тело запроса целиком в память не читается.
+        Возвращает путь к временному файлу и количество принятых байт (при обрыве соединения — успешно принятых)
+        """
+        chunk_path = get_temporary_path()
+        written = 0
+        with open(chunk_path, 'wb') as chunk_file:
+            while written < length:
+                try:
+                    chunk = stream.read(min(UPLOAD_CHUNK_SIZE, length - written))
+                except OSError:
+                    logger.warning(f'Обрыв соединения при загрузке фрагмента файла {self.filename}')
+                    break
+                if not chunk:
+                    break
+                chunk_file.write(chunk)
+                written += len(chunk)
+        return chunk_path, written
+
+    def append_chunk(self, chunk_path):
+        """
+        Дописывает принятый фрагмент в файл сессии с текущего смещения и удаляет временный файл фрагмента.
+        Возвращает количество дописанных байт
+        """
+        try:
+            with open(self.part_path, 'r+b') as part, open(chunk_path, 'rb') as chunk_file:
+                part.seek(self.offset)
+                # Отбрасываем хвост, оставшийся от прерванной записи
+                part.truncate()
+                shutil.copyfileobj(chunk_file, part, UPLOAD_CHUNK_SIZE)
+                return part.tell() - self.offset
+        finally:
+            remove_files([chunk_path])
+
+    def prepare_content(self):
+        """
+        Вычисляет хеш собранного файла и для нового содержимого готовит сжатую копию.
+        Вызывается вне транзакции: чтение большого файла не должно держать блокировку сессии.
+        Возвращает хеш и сжатую копию (кодировка, путь) или None
+        """
+        sha256 = get_file_sha256(self.part_path)
+        if Blob.objects.filter(pk=sha256).exists():
+            return sha256, None
+        # У каждого запроса своя сжатая копия: повторный запрос завершения не перезапишет копию первого
+        return sha256, compress_file(self.part_path, self.size, compressed_path=f'{self.part_path}.{uuid.uuid4().hex}')
+
+    def finalize(self, sha256, compressed=None):
+        """
+        Переносит собранный файл в хранилище содержимого и создаёт запись о файле.
+        Сессия блокируется заново: если её уже завершил параллельный запрос, выбрасывается UploadSession.DoesNotExist
+        """
+        try:
+            with transaction.atomic():
+                if not UploadSession.objects.select_for_update().filter(pk=self.pk, offset=self.size).exists():
+                    raise UploadSession.DoesNotExist()
+                # Запись создаётся первой: при совпадении имени ограничение уникальности прервёт операцию
+                # до переноса файла
+                file = File.objects.create(cloud_user=self.cloud_user, filename=self.filename, size=self.size,
+                                           comment=self.comment)
+                if not CloudUser.change_usage(self.cloud_user_id, self.size, 1, quota=self.cloud_user.quota):
+                    raise QuotaExceeded()
+                blob = Blob.store(self.part_path, sha256, self.size, compressed=compressed)
+                file.content.name = blob.name
+                file.blob = blob
+                file.save(update_fields=['content', 'blob'])
+                self.delete()
+        except BaseException:
+            # Сжатая копия не понадобилась (после переноса в хранилище её уже нет)
+            remove_files([compressed[1]] if compressed else [])
+            raise
+        return file
+
+    def delete_part(self):
+        # Удаляем недокачанный файл, если он ещё существует
+        try:
+            os.remove(self.part_path)
+        except FileNotFoundError:
+            pass
+
+    @classmethod
+    def delete_expired(cls, ttl):
+        """
+        Удаляет сессии, неактивные дольше ttl секунд, вместе с недокачанными файлами.
+        Возвращает количество удалённых сессий
+        """
+        deadline = timezone.now() - timedelta(seconds=ttl)
+        expired = 0
+        for session in cls.objects.filter(date_updated__lt=deadline).iterator():
+            session.delete_part()
+            session.delete()
+            expired += 1
+        return expired
+
+    def __str__(self):
+        return f'{self.filename} ({self.offset}/{self.size})'
+
+
+# Класс модели фоновой задачи, выполняемой обработчиком очереди (команда run_jobs)
+class Job(models.Model):
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'В очереди'),
+        (RUNNING, 'Выполняется'),
+        (DONE, 'Выполнена'),
+        (FAILED, 'Завершилась ошибкой'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)  # Идентификатор задачи
+    kind = models.CharField(max_length=50)  # Тип задачи (имя обработчика)
+    params = models.JSONField(default=dict)  # Параметры обработчика
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)  # Состояние задачи
+    result = models.JSONField(null=True, blank=True)  # Результат выполнения
+    error = models.TextField(blank=True)  # Текст ошибки
+    cloud_user = models.ForeignKey(CloudUser, on_delete=models.SET_NULL, null=True, blank=True,
+                                   related_name='jobs')  # Пользователь, поставивший задачу
+    date_created = models.DateTimeField(auto_now_add=True)  # Дата постановки в очередь
+    date_started = models.DateTimeField(null=True, blank=True)  # Дата начала выполнения
+    date_finished = models.DateTimeField(null=True, blank=True)  # Дата завершения
+
+    class Meta:
+        indexes = [
+            # Индекс для выборки очередных задач обработчиком
+            models.Index(fields=['status', 'date_created'], name='job_status_date_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.kind} ({self.status})'
+
+
+# Класс модели API-токена для доступа к API из скриптов и клиентов синхронизации
+class ApiToken(models.Model):
+    READ = 'read'
+    WRITE = 'write'
+    SCOPE_CHOICES = [
+        (READ, 'Чтение'),
+        (WRITE, 'Изменение'),
+    ]
+
+    cloud_user = models.ForeignKey(CloudUser, on_delete=models.CASCADE, related_name='api_tokens')  # Владелец токена
+    name = models.CharField(max_length=100)  # Название токена, заданное пользователем
+    prefix = models.CharField(max_length=12)  # Начало токена, по которому пользователь узнаёт его в списке
+    key_hash = models.CharField(max_length=64, unique=True)  # HMAC-SHA256 токена (сам токен не хранится)
+    scopes = models.JSONField(default=list)  # Разрешённые области доступа
+    expires_at = models.DateTimeField(null=True, blank=True)  # Срок действия (пусто — бессрочный)
+    last_used = models.DateTimeField(null=True, blank=True)  # Дата последнего использования (с точностью до TTL кеша)
+    date_created = models.DateTimeField(auto_now_add=True)  # Дата выпуска
+
+    def is_expired(self):
+        return self.expires_at is not None and self.expires_at <= timezone.now()
+
+    def __str__(self):
+        return f'{self.name} ({self.prefix}…)'
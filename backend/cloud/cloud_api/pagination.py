@@ -0,0 +1,20 @@
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+
+
+class FileCursorPagination(CursorPagination):
+    """
+    Постраничный вывод списка файлов по курсору: стоимость запроса не зависит от номера страницы
+    """
+    ordering = '-date_uploaded'
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+
+
+class FileSearchPagination(PageNumberPagination):
+    """
+    Постраничный вывод результатов поиска по номеру страницы: результаты упорядочены по рангу совпадения
+    """
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
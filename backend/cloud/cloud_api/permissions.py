@@ -18,7 +18,7 @@ class IsAdminOrUser(BasePermission):
 
 class IsAdminOrFileOwner(BasePermission):
     """
-    Разрешает доступ только для администратора или владельца файла
+    Разрешает доступ только для администратора или владельца файла (или другого объекта с полем cloud_user)
     """
     def has_object_permission(self, request, view, obj):
         return bool(request.user and request.user == obj.cloud_user) or bool(request.user and request.user.is_superuser)
@@ -0,0 +1,239 @@
+import io
+import os
+import uuid
+import shutil
+import hashlib
+import logging
+import mimetypes
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, ImageOps
+
+from cloud.settings import PREVIEW_CACHE_ROOT, PREVIEW_CACHE_MAX_SIZE, PREVIEW_SIZE, PREVIEW_WORKERS, \
+    PREVIEW_MAX_SOURCE_SIZE
+from .compression import open_content
+from .utils import get_sharded_path, remove_files
+
+logger = logging.getLogger('main')
+
+# Качество JPEG миниатюр
+PREVIEW_QUALITY = 80
+# Доля максимального размера, до которой кеш очищается при переполнении
+EVICTION_TARGET = 0.9
+# Утилита из poppler-utils для миниатюр PDF; без неё миниатюры строятся только для изображений
+PDFTOPPM = shutil.which('pdftoppm')
+
+# Ограничение Pillow на количество пикселей защищает от «бомб» — маленьких файлов с огромным разрешением
+Image.MAX_IMAGE_PIXELS = 64 * 1024 * 1024
+
+
+class PreviewUnavailable(Exception):
+    """
+    Для файла нельзя построить миниатюру: неподдерживаемый тип, слишком большой или повреждённый файл
+    """
+
+
+def is_previewable(filename):
+    content_type, _ = mimetypes.guess_type(filename)
+    return bool(content_type) and (content_type.startswith('image/')
+                                   or content_type == 'application/pdf' and PDFTOPPM is not None)
+
+
+def get_preview_key(file):
+    """
+    Ключ миниатюры меняется вместе с содержимым, именем файла и размером миниатюры,
+    поэтому устаревшая миниатюра не может быть отдана, даже если её не успели удалить
+    """
+    return hashlib.sha1(f'{file.pk}:{file.content.name}:{file.filename}:{PREVIEW_SIZE}'.encode()).hexdigest()
+
+
+def read_source(storage, name, encoding):
+    """
+    Читает содержимое файла в память: Pillow перемещается по файлу назад, что не поддерживают распаковывающие потоки
+    """
+    with open_content(storage.open(name), encoding) as source:
+        data = source.read(PREVIEW_MAX_SOURCE_SIZE + 1)
+    if len(data) > PREVIEW_MAX_SOURCE_SIZE:
+        raise PreviewUnavailable('Файл слишком большой для построения миниатюры')
+    return data
+
+
+def render_image(data):
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            # Для JPEG декодер сразу уменьшает изображение, не распаковывая его в полном разрешении
+            image.draft('RGB', (PREVIEW_SIZE, PREVIEW_SIZE))
+            image = ImageOps.exif_transpose(image)
+            image.thumbnail((PREVIEW_SIZE, PREVIEW_SIZE))
+            if image.mode in ('RGBA', 'LA', 'P'):
+                image = image.convert('RGBA')
+                background = Image.new('RGB', image.size, 'white')
+                background.paste(image, mask=image.getchannel('A'))
+                image = background
+            elif image.mode != 'RGB':
+                image = image.convert('RGB')
+            output = io.BytesIO()
+            image.save(output, 'JPEG', quality=PREVIEW_QUALITY, optimize=True)
+    except Image.DecompressionBombError:
+        raise PreviewUnavailable('Разрешение изображения слишком велико для построения миниатюры')
+    except (OSError, ValueError, SyntaxError):
+        raise PreviewUnavailable('Не удалось прочитать изображение')
+    return output.getvalue()
+
+
+def render_pdf(data):
+    # Первая страница документа отрисовывается сразу в нужном размере
+    try:
+        result = subprocess.run([PDFTOPPM, '-jpeg', '-f', '1', '-l', '1', '-singlefile',
+                                 '-scale-to', str(PREVIEW_SIZE), '-', '-'],
+                                input=data, capture_output=True, timeout=60, check=True)
+    except (OSError, subprocess.SubprocessError) as error:
+        raise PreviewUnavailable(f'Не удалось отрисовать документ: {error}')
+    return result.stdout
+
+
+def render_preview(storage, name, encoding, filename):
+    """
+    Строит JPEG-миниатюру файла, вписанную в квадрат PREVIEW_SIZE
+    """
+    content_type, _ = mimetypes.guess_type(filename)
+    if not is_previewable(filename):
+        raise PreviewUnavailable('Для файлов этого типа миниатюры не строятся')
+    data = read_source(storage, name, encoding)
+    if content_type == 'application/pdf':
+        return render_pdf(data)
+    return render_image(data)
+
+
+class PreviewCache:
+    """
+    Каталог миниатюр ограниченного размера. Время изменения файла обновляется при каждом обращении,
+    и при переполнении удаляются давно не запрашивавшиеся миниатюры (LRU).
+    Каталог общий для всех процессов сервера, поэтому размер пересчитывается по диску
+    """
+    def __init__(self, root, max_size):
+        self.root = root
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        # Объём, записанный с последнего подсчёта; None — подсчёт ещё не выполнялся
+        self.written = None
+
+    def get_path(self, key):
+        return os.path.join(self.root, f'{get_sharded_path(key)}.jpg')
+
+    def get(self, key):
+        """
+        Возвращает путь к миниатюре или None, если её нет в кеше
+        """
+        path = self.get_path(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def put(self, key, data):
+        path = self.get_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary_path = f'{path}.{uuid.uuid4().hex}.tmp'
+        with open(temporary_path, 'wb') as destination:
+            destination.write(data)
+        os.replace(temporary_path, path)
+        with self.lock:
+            # Полный подсчёт выполняется при первой записи и после того, как записана десятая часть кеша
+            if self.written is not None:
+                self.written += len(data)
+                if self.written < self.max_size * (1 - EVICTION_TARGET):
+                    return path
+            self.written = 0
+        self.evict()
+        return path
+
+    def discard(self, *keys):
+        remove_files([self.get_path(key) for key in keys])
+
+    def evict(self):
+        """
+        Удаляет самые старые по времени обращения миниатюры, пока кеш не уменьшится до 90% максимального размера.
+        Возвращает количество удалённых файлов
+        """
+        entries = []
+        total = 0
+        for directory, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                path = os.path.join(directory, filename)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+        if total <= self.max_size:
+            return 0
+        entries.sort()
+        evicted = []
+        for _, size, path in entries:
+            if total <= self.max_size * EVICTION_TARGET:
+                break
+            evicted.append(path)
+            total -= size
+        remove_files(evicted)
+        logger.info(f'Из кеша миниатюр удалено файлов: {len(evicted)}')
+        return len(evicted)
+
+
+preview_cache = PreviewCache(PREVIEW_CACHE_ROOT, PREVIEW_CACHE_MAX_SIZE)
+
+
+class PreviewGenerator:
+    """
+    Строит миниатюры в пуле потоков ограниченного размера, чтобы одновременные запросы
+    не занимали все процессоры сервера. Одновременные запросы одной миниатюры ждут одну задачу
+    """
+    def __init__(self, workers):
+        self.executor = ThreadPoolExecutor(workers, thread_name_prefix='preview')
+        self.lock = threading.Lock()
+        self.pending = {}
+
+    def submit(self, key, storage, name, encoding, filename):
+        with self.lock:
+            future = self.pending.get(key)
+            if future is None:
+                future = self.executor.submit(self.generate, key, storage, name, encoding, filename)
+                self.pending[key] = future
+                future.add_done_callback(lambda _: self.forget(key))
+            return future
+
+    def forget(self, key):
+        with self.lock:
+            self.pending.pop(key, None)
+
+    @staticmethod
+    def generate(key, storage, name, encoding, filename):
+        # Миниатюра могла появиться, пока задача ждала в очереди
+        cached_path = preview_cache.get(key)
+        if cached_path:
+            return cached_path
+        data = render_preview(storage, name, encoding, filename)
+        logger.info(f'Построена миниатюра файла {filename}')
+        return preview_cache.put(key, data)
+
+
+preview_generator = PreviewGenerator(PREVIEW_WORKERS)
+
+
+def get_preview_path(file, timeout=None):
+    """
+    Возвращает путь к миниатюре файла, при первом обращении строя её в пуле.
+    Если миниатюра не готова за timeout секунд, выбрасывает TimeoutError, а построение продолжается
+    """
+    key = get_preview_key(file)
+    path = preview_cache.get(key)
+    if path:
+        return path
+    if not is_previewable(file.filename):
+        raise PreviewUnavailable('Для файлов этого типа миниатюры не строятся')
+    return preview_generator.submit(key, file.storage, file.content.name, file.content_encoding,
+                                    file.filename).result(timeout)
@@ -0,0 +1,343 @@
+import os
+import time
+import logging
+from collections import deque
+
+from django.db import close_old_connections, transaction
+from django.db.models import Count, Q
+
+from cloud.settings import BLOB_DIR, PREVIEW_CACHE_ROOT, UPLOAD_SESSION_ROOT, SCRUB_GRACE_PERIOD
+from .models import Blob, CloudUser, File
+from .storage import cold_storage, get_storage, hot_storage
+from .tiers import lock_content
+
+logger = logging.getLogger('main')
+
+# Виды расхождений
+MISSING = 'missing'  # Содержимого нет ни на одном уровне хранения
+WRONG_TIER = 'wrong_tier'  # Содержимое лежит не на том уровне, который указан в записях файлов
+SIZE_MISMATCH = 'size_mismatch'  # Размер на диске или в записи файла не совпадает с ожидаемым
+STORED_SIZE = 'stored_size'  # У содержимого не записан размер на диске
+REF_COUNT = 'ref_count'  # Счётчик ссылок содержимого не совпадает с количеством файлов
+UNREFERENCED = 'unreferenced'  # На содержимое не ссылается ни один файл
+CONTENT_NAME = 'content_name'  # Путь в записи файла не совпадает с путём его содержимого
+ORPHAN = 'orphan'  # Файл на диске, которому не соответствует ни одна запись
+STALE_COPY = 'stale_copy'  # Лишняя копия на уровне хранения, которым записи не пользуются
+
+# Этапы проверки в порядке выполнения: содержимое, файлы, затем обход каталогов
+PHASES = ('blobs', 'files', 'disk')
+# Каталог внутри BLOB_DIR, куда при исправлении переносятся файлы без записей (для разбора вручную)
+ORPHANS_DIR = 'orphans'
+
+
+def get_size(storage, name):
+    try:
+        return storage.stat(name)[0]
+    except FileNotFoundError:
+        return None
+
+
+def get_blob_key(name):
+    # Хеш содержимого из пути файла в хранилище содержимого (без суффикса сжатия)
+    return name.rsplit('/', 1)[-1].split('.', 1)[0]
+
+
+def get_tier(cold):
+    return File.COLD if cold else File.HOT
+
+
+def run_in_order(executor, function, items, window):
+    """
+    Выполняет function для элементов items в пуле и возвращает пары (элемент, результат) в исходном порядке.
+    В работе одновременно не больше window элементов, поэтому items читаются по мере обработки,
+    а положение в обходе можно сохранять после каждого возвращённого элемента
+    """
+    if executor is None:
+        for item in items:
+            yield item, function(item)
+        return
+    pending = deque()
+    for item in items:
+        pending.append((item, executor.submit(function, item)))
+        if len(pending) >= window:
+            item, future = pending.popleft()
+            yield item, future.result()
+    while pending:
+        item, future = pending.popleft()
+        yield item, future.result()
+
+
+class Scrubber:
+    """
+    Сверяет файлы на диске с таблицами содержимого и файлов.
+    Записи читаются пакетами по возрастанию ключа, каталоги обходятся в постоянном порядке, поэтому проверку
+    можно прервать и продолжить с сохранённого положения. Каждый метод check_* возвращает список расхождений
+    и с repair=True исправляет те из них, которые можно исправить без потери данных
+    """
+    def __init__(self, repair=False, grace=SCRUB_GRACE_PERIOD, batch_size=500):
+        self.repair = repair
+        # Файлы моложе grace секунд не считаются лишними: их запись может быть ещё не зафиксирована
+        self.grace = grace
+        self.batch_size = batch_size
+        self.storages = [hot_storage, cold_storage]
+        # Каталоги миниатюр и сессий загрузки (и один уровень хранения внутри другого) могут лежать
+        # в корне локального хранилища
+        self.skipped = {os.path.realpath(path) for path in
+                        [PREVIEW_CACHE_ROOT, UPLOAD_SESSION_ROOT] + [storage.path('') for storage in self.storages]
+                        if path}
+
+    def finding(self, kind, target, detail, repair=None):
+        repaired = False
+        if self.repair and repair is not None:
+            try:
+                repaired = bool(repair())
+            except Exception:
+                logger.exception(f'Не удалось исправить расхождение {kind} у {target}')
+        return {'kind': kind, 'target': target, 'detail': detail, 'repaired': repaired}
+
+    # Содержимое
+
+    def get_blob_batches(self, after=''):
+        blobs = Blob.objects.annotate(
+            references=Count('files'),
+            cold_references=Count('files', filter=Q(files__tier=File.COLD)),
+        ).order_by('pk')
+        while True:
+            batch = list(blobs.filter(pk__gt=after)[:self.batch_size])
+            if not batch:
+                return
+            after = batch[-1].pk
+            yield batch
+
+    def check_blobs(self, batch):
+        close_old_connections()
+        findings = []
+        for blob in batch:
+            target = f'blob:{blob.pk}'
+            if blob.references != blob.ref_count:
+                findings.append(self.finding(REF_COUNT, target, f'{blob.ref_count} вместо {blob.references}',
+                                             lambda blob=blob: self.fix_ref_count(blob)))
+            if not blob.references:
+                findings.append(self.finding(UNREFERENCED, target, blob.name,
+                                             lambda blob=blob: self.release_blob(blob)))
+                continue
+            # Уровень хранения общий для всех ссылок; при расхождении ожидается основной уровень
+            cold = expected = blob.cold_references == blob.references
+            size = get_size(get_storage(cold), blob.name)
+            if size is None:
+                cold = not cold
+                size = get_size(get_storage(cold), blob.name)
+                if size is None:
+                    findings.append(self.finding(MISSING, target, blob.name))
+                    continue
+            if cold != expected or 0 < blob.cold_references < blob.references:
+                findings.append(self.finding(WRONG_TIER, target, f'содержимое на уровне {get_tier(cold)}',
+                                             lambda blob=blob, cold=cold: self.fix_blob_tier(blob, cold)))
+            if blob.stored_size is None:
+                findings.append(self.finding(STORED_SIZE, target, f'на диске {size}',
+                                             lambda blob=blob, size=size: Blob.objects.filter(
+                                                 pk=blob.pk, stored_size__isnull=True).update(stored_size=size)))
+            elif size != blob.stored_size:
+                # Повреждённое содержимое восстановить нельзя: его заменит следующая загрузка того же файла
+                findings.append(self.finding(SIZE_MISMATCH, target, f'на диске {size} вместо {blob.stored_size}'))
+        return findings
+
+    def fix_ref_count(self, blob):
+        with transaction.atomic():
+            locked = Blob.objects.select_for_update().filter(pk=blob.pk).first()
+            references = File.objects.filter(blob=blob.pk).count()
+            if locked is None or not references:
+                return False
+            return Blob.objects.filter(pk=blob.pk).update(ref_count=references)
+
+    def release_blob(self, blob):
+        with transaction.atomic():
+            # Ссылка могла появиться после чтения пакета
+            if not Blob.objects.select_for_update().filter(pk=blob.pk).exists() or \
+                    File.objects.filter(blob=blob.pk).exists():
+                return False
+            Blob.objects.filter(pk=blob.pk).update(ref_count=0)
+            return Blob.release_many({blob.pk: 0})
+
+    def fix_blob_tier(self, blob, cold):
+        with transaction.atomic():
+            Blob.objects.select_for_update().filter(pk=blob.pk).exists()
+            if get_size(get_storage(cold), blob.name) is None:
+                return False
+            return File.objects.filter(blob=blob.pk).exclude(tier=get_tier(cold)).update(tier=get_tier(cold))
+
+    # Записи файлов
+
+    def get_file_batches(self, after=0):
+        files = File.objects.select_related('blob').only(
+            'id', 'cloud_user', 'content', 'size', 'tier', 'blob__sha256', 'blob__size', 'blob__encoding'
+        ).order_by('pk')
+        while True:
+            batch = list(files.filter(pk__gt=after)[:self.batch_size])
+            if not batch:
+                return
+            after = batch[-1].pk
+            yield batch
+
+    def check_files(self, batch):
+        close_old_connections()
+        findings = []
+        for file in batch:
+            target = f'file:{file.pk}'
+            if file.blob_id:
+                # Наличие и размер содержимого проверяются на этапе содержимого
+                if file.content.name != file.blob.name:
+                    findings.append(self.finding(CONTENT_NAME, target, f'{file.content.name} вместо {file.blob.name}',
+                                                 lambda file=file: File.objects.filter(pk=file.pk, blob=file.blob_id)
+                                                 .update(content=file.blob.name)))
+                if file.size != file.blob.size:
+                    findings.append(self.finding(SIZE_MISMATCH, target, f'{file.size} вместо {file.blob.size}',
+                                                 lambda file=file: self.fix_file_size(file, file.blob.size)))
+                continue
+            cold = file.tier == File.COLD
+            size = get_size(get_storage(cold), file.content.name)
+            if size is None:
+                size = get_size(get_storage(not cold), file.content.name)
+                if size is None:
+                    findings.append(self.finding(MISSING, target, file.content.name))
+                    continue
+                findings.append(self.finding(WRONG_TIER, target, f'содержимое на уровне {get_tier(not cold)}',
+                                             lambda file=file, cold=not cold: self.fix_file_tier(file, cold)))
+            if size != file.size:
+                findings.append(self.finding(SIZE_MISMATCH, target, f'{file.size} вместо {size} на диске',
+                                             lambda file=file, size=size: self.fix_file_size(file, size)))
+        return findings
+
+    def fix_file_size(self, file, size):
+        with transaction.atomic():
+            if not File.objects.filter(pk=file.pk, size=file.size).update(size=size):
+                return False
+            CloudUser.change_usage(file.cloud_user_id, size - file.size, 0)
+        return True
+
+    def fix_file_tier(self, file, cold):
+        with transaction.atomic():
+            lock_content(file)
+            if get_size(get_storage(cold), file.content.name) is None:
+                return False
+            return File.objects.filter(pk=file.pk).update(tier=get_tier(cold))
+
+    # Каталоги
+
+    def get_directories(self, after=None):
+        """
+        Перечисляет проверяемые каталоги в постоянном порядке как ключи (уровень, группа, путь):
+        файлы в корне уровня, каталоги хранилища содержимого (по одному на два уровня префикса хеша)
+        и каталоги пользователей. Временные файлы, корзина и отложенные файлы хранилища содержимого,
+        а также вложенные в корень каталоги миниатюр и сессий загрузки пропускаются
+        """
+        for cold, storage in enumerate(self.storages):
+            directories, _ = storage.listdir('')
+            units = [(cold, 0, '')]
+            for first in self.list_shards(storage, BLOB_DIR):
+                for second in self.list_shards(storage, f'{BLOB_DIR}/{first}'):
+                    units.append((cold, 1, f'{BLOB_DIR}/{first}/{second}'))
+            units.extend(sorted((cold, 2, name) for name in directories
+                                if name != BLOB_DIR and not self.is_skipped(storage, name)))
+            for unit in units:
+                if after is None or unit > tuple(after):
+                    yield unit
+
+    def is_skipped(self, storage, name):
+        path = storage.path(name)
+        return path is not None and os.path.realpath(path) in self.skipped
+
+    @staticmethod
+    def list_shards(storage, path):
+        directories, _ = storage.listdir(path)
+        return sorted(name for name in directories
+                      if len(name) == 2 and all(char in '0123456789abcdef' for char in name))
+
+    def list_files(self, cold, group, relative):
+        """
+        Возвращает пути файлов каталога относительно корня уровня, изменённых раньше grace секунд назад
+        """
+        storage = self.storages[cold]
+        deadline = (time.time() - self.grace) * 10 ** 9
+        if group == 2:
+            files = storage.walk(relative)
+        else:
+            _, files = storage.listdir(relative)
+            files = ((f'{relative}/{name}' if relative else name, size, modified) for name, size, modified in files)
+        return [name for name, _, modified in files if modified < deadline]
+
+    def check_directory(self, unit):
+        close_old_connections()
+        cold, group, relative = unit
+        names = self.list_files(cold, group, relative)
+        findings = []
+        for start in range(0, len(names), self.batch_size):
+            chunk = names[start:start + self.batch_size]
+            if group == 1:
+                findings.extend(self.check_blob_names(cold, chunk))
+            else:
+                findings.extend(self.check_file_names(cold, chunk))
+        return findings
+
+    def check_blob_names(self, cold, names):
+        blobs = Blob.objects.filter(pk__in={get_blob_key(name) for name in names}).annotate(
+            references=Count('files'),
+            cold_references=Count('files', filter=Q(files__tier=File.COLD)),
+        ).in_bulk()
+        findings = []
+        for name in names:
+            blob = blobs.get(get_blob_key(name))
+            target = f'{get_tier(cold)}:{name}'
+            if blob is None or blob.name != name:
+                findings.append(self.finding(ORPHAN, target, 'нет записи содержимого',
+                                             lambda name=name: self.quarantine(name, cold)))
+            elif blob.references and blob.cold_references == (blob.references if not cold else 0):
+                # Копия осталась после прерванного переноса между уровнями; содержимое без ссылок
+                # удаляется на этапе содержимого
+                findings.append(self.finding(STALE_COPY, target, f'файлы на уровне {get_tier(not cold)}',
+                                             lambda blob=blob: self.remove_copy(
+                                                 File.objects.filter(blob=blob.pk).first(), cold)))
+        return findings
+
+    def check_file_names(self, cold, names):
+        files = {file.content.name: file
+                 for file in File.objects.filter(content__in=names).only('id', 'content', 'blob', 'tier')}
+        findings = []
+        for name in names:
+            file = files.get(name)
+            target = f'{get_tier(cold)}:{name}'
+            if file is None:
+                findings.append(self.finding(ORPHAN, target, 'нет записи файла',
+                                             lambda name=name: self.quarantine(name, cold)))
+            elif file.tier != get_tier(cold):
+                findings.append(self.finding(STALE_COPY, target, f'файл на уровне {file.tier}',
+                                             lambda file=file: self.remove_copy(file, cold)))
+        return findings
+
+    def quarantine(self, name, cold):
+        """
+        Переносит файл без записи в каталог отложенных файлов с сохранением пути: такие файлы
+        не удаляются автоматически, чтобы их можно было разобрать вручную
+        """
+        with transaction.atomic():
+            # Запись могла появиться после чтения пакета
+            blob = Blob.objects.select_for_update().filter(pk=get_blob_key(name)).first()
+            if blob is not None and blob.name == name or File.objects.filter(content=name).exists():
+                return False
+            get_storage(cold).rename(name, f'{BLOB_DIR}/{ORPHANS_DIR}/{name}')
+        return True
+
+    def remove_copy(self, file, cold):
+        """
+        Удаляет копию содержимого с уровня cold, если записи по-прежнему пользуются другим уровнем
+        и копия там есть
+        """
+        if file is None:
+            return False
+        with transaction.atomic():
+            files = lock_content(file)
+            if files.filter(tier=get_tier(cold)).exists() or \
+                    get_size(get_storage(not cold), file.content.name) is None:
+                return False
+            get_storage(cold).delete([file.content.name])
+        return True
@@ -0,0 +1,132 @@
+import re
+
+from django.db import connection
+from django.db.models import BooleanField, Case, Count, FloatField, Func, OuterRef, Q, Subquery, TextField, \
+    Value, When
+from django.db.models.functions import Cast, Coalesce, Greatest, Length, Upper
+
+from .models import File, FileSearchTrigram
+
+PREFIX = 'prefix'
+SUBSTRING = 'substring'
+FUZZY = 'fuzzy'
+MODES = (PREFIX, SUBSTRING, FUZZY)
+
+# Вес совпадения в комментарии относительно совпадения в имени файла
+COMMENT_WEIGHT = 0.5
+# Минимальная доля общих триграмм для нечёткого совпадения (как word_similarity_threshold в pg_trgm по умолчанию)
+FUZZY_THRESHOLD = 0.6
+# Слова разделяются любыми символами, кроме букв и цифр (в том числе подчёркиванием), как в pg_trgm
+WORD_PATTERN = re.compile(r'[^\W_]+')
+
+
+def uses_trigram_extension():
+    # В PostgreSQL поиск выполняется по GIN-индексам pg_trgm, для остальных СУБД ведётся таблица триграмм
+    return connection.vendor == 'postgresql'
+
+
+def get_trigrams(text, padded=True):
+    """
+    Возвращает множество триграмм слов текста в нижнем регистре. Дополненные пробелами триграммы
+    (как в pg_trgm) учитывают начало и конец слова; без дополнения остаются только триграммы,
+    которые встречаются в любом слове, содержащем данное как подстроку
+    """
+    trigrams = set()
+    for word in WORD_PATTERN.findall(text.lower()):
+        if padded:
+            word = f'  {word} '
+        trigrams.update(word[index:index + 3] for index in range(len(word) - 2))
+    return trigrams
+
+
+def index_files(files):
+    """
+    Перестраивает записи таблицы триграмм для файлов после загрузки, переименования или изменения комментария
+    """
+    if uses_trigram_extension():
+        return
+    files = list(files)
+    FileSearchTrigram.objects.filter(file__in=[file.pk for file in files]).delete()
+    FileSearchTrigram.objects.bulk_create([
+        FileSearchTrigram(file_id=file.pk, cloud_user_id=file.cloud_user_id, field=field, trigram=trigram)
+        for file in files
+        for field, text in ((FileSearchTrigram.FILENAME, file.filename), (FileSearchTrigram.COMMENT, file.comment))
+        for trigram in get_trigrams(text)
+    ], batch_size=1000)
+
+
+class WordSimilar(Func):
+    """
+    Оператор pg_trgm «<%»: в строке есть фрагмент, похожий на запрос. Использует GIN-индекс с gin_trgm_ops
+    """
+    arg_joiner = ' <%% '
+    template = '%(expressions)s'
+    output_field = BooleanField()
+
+
+class WordSimilarity(Func):
+    function = 'WORD_SIMILARITY'
+    output_field = FloatField()
+
+
+def get_indexed_expression(field):
+    # То же выражение, что в индексах миграции 0012 и в запросах icontains/istartswith в PostgreSQL
+    return Upper(Cast(field, TextField()))
+
+
+def search_files(cloud_user, query, mode=SUBSTRING):
+    """
+    Ищет файлы пользователя по имени и комментарию. Возвращает queryset с рангом rank, упорядоченный по нему:
+    для префиксного и подстрочного поиска совпадение в имени важнее совпадения в комментарии, а короткие имена
+    (точнее совпадающие с запросом) выше длинных; для нечёткого — по степени сходства с запросом
+    """
+    queryset = File.objects.filter(cloud_user=cloud_user)
+    if uses_trigram_extension():
+        queryset = search_postgresql(queryset, query, mode)
+    else:
+        queryset = search_trigram_table(queryset, cloud_user, query, mode)
+    return queryset.order_by('-rank', Length('filename'), 'pk')
+
+
+def annotate_exact_rank(queryset, lookup, value):
+    in_filename = Q(**{f'filename__{lookup}': value})
+    in_comment = Q(**{f'comment__{lookup}': value})
+    return queryset.filter(in_filename | in_comment).annotate(
+        rank=Case(When(in_filename, then=Value(1.0)), default=Value(COMMENT_WEIGHT), output_field=FloatField()))
+
+
+def search_postgresql(queryset, query, mode):
+    if mode == PREFIX:
+        return annotate_exact_rank(queryset, 'istartswith', query)
+    if mode == SUBSTRING:
+        return annotate_exact_rank(queryset, 'icontains', query)
+    filename = get_indexed_expression('filename')
+    comment = get_indexed_expression('comment')
+    return queryset.filter(WordSimilar(Value(query), filename) | WordSimilar(Value(query), comment)).annotate(
+        rank=Greatest(WordSimilarity(Value(query), filename), WordSimilarity(Value(query), comment) * COMMENT_WEIGHT))
+
+
+def search_trigram_table(queryset, cloud_user, query, mode):
+    trigrams = FileSearchTrigram.objects.filter(cloud_user=cloud_user)
+    if mode == FUZZY:
+        query_trigrams = get_trigrams(query)
+        if not query_trigrams:
+            return queryset.none().annotate(rank=Value(0.0, output_field=FloatField()))
+        # Доля триграмм запроса, найденных в поле, отдельно для имени и комментария
+        counts = trigrams.filter(trigram__in=query_trigrams).values('file').annotate(
+            rank=Greatest(
+                Count('trigram', filter=Q(field=FileSearchTrigram.FILENAME)) * 1.0,
+                Count('trigram', filter=Q(field=FileSearchTrigram.COMMENT)) * COMMENT_WEIGHT,
+            ) / len(query_trigrams)).filter(rank__gte=FUZZY_THRESHOLD)
+        return queryset.filter(pk__in=counts.values('file')).annotate(
+            rank=Coalesce(Subquery(counts.filter(file=OuterRef('pk')).values('rank')[:1]), Value(0.0)))
+
+    # Отбор по индексу: в поле есть все триграммы слов запроса. Точное совпадение проверяется регулярным
+    # выражением, которое в SQLite сравнивает без учёта регистра и нелатинские буквы
+    pattern = ('^' if mode == PREFIX else '') + re.escape(query)
+    query_trigrams = get_trigrams(query, padded=False)
+    if query_trigrams:
+        matched = trigrams.filter(trigram__in=query_trigrams).values('file', 'field').annotate(
+            matched=Count('trigram')).filter(matched=len(query_trigrams))
+        queryset = queryset.filter(pk__in=matched.values('file'))
+    return annotate_exact_rank(queryset, 'iregex', pattern)
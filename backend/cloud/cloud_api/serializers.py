@@ -1,8 +1,10 @@
+import os
 import re
 
+from django.utils import timezone
 from rest_framework import serializers
 
-from .models import CloudUser, File
+from .models import ApiToken, CloudUser, File, FileChange, Job, UploadSession
 
 
 class CloudUserSerializer(serializers.ModelSerializer):
@@ -33,11 +35,57 @@ class CloudUserSerializer(serializers.ModelSerializer):
         return value
 
 
+def validate_filename(value):
+    """
+    Валидирует имя файла (без разделителей каталогов «/» и «\\»)
+    """
+    if os.path.basename(value) != value or '\\' in value or value in ('.', '..'):
+        raise serializers.ValidationError('Недопустимое имя файла.')
+    return value
+
+
 class FileSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = File
         fields = '__all__'
+        read_only_fields = ['blob', 'download_count', 'bytes_served', 'tier']
+        extra_kwargs = {'filename': {'validators': [validate_filename]}}
+        # Задаются только при загрузке: их изменение разошлось бы со счётчиками использования хранилища
+        create_only_fields = ['cloud_user', 'size', 'content']
+
+    def get_extra_kwargs(self):
+        extra_kwargs = super().get_extra_kwargs()
+        if self.instance is not None:
+            for field in self.Meta.create_only_fields:
+                extra_kwargs.setdefault(field, {})['read_only'] = True
+        return extra_kwargs
+
+    def validate_external_link_key(self, value):
+        """
+        Валидирует ключ внешней ссылки: ключ выдаёт только сервер, клиент может лишь отозвать ссылку пустым ключом
+        """
+        current = self.instance.external_link_key if self.instance is not None else ''
+        if value not in ('', current):
+            raise serializers.ValidationError('Ключ внешней ссылки создаётся только сервером.')
+        return value
+
+
+class FileSearchResultSerializer(FileSerializer):
+    rank = serializers.FloatField(read_only=True)
+
+
+class FileChangeSerializer(serializers.ModelSerializer):
+    # Текущее состояние файла (None, если файл уже удалён); словарь файлов передаётся в контексте
+    file = serializers.SerializerMethodField()
+
+    class Meta:
+        model = FileChange
+        fields = ['sequence', 'action', 'file_id', 'filename', 'date_created', 'file']
+
+    def get_file(self, obj):
+        file = self.context['files'].get(obj.file_id)
+        return FileSerializer(file).data if file is not None else None
 
 
 class FileSerializerUserDetail(serializers.ModelSerializer):
@@ -45,9 +93,83 @@ class FileSerializerUserDetail(serializers.ModelSerializer):
         model = CloudUser
 
 
+class CloudUserAdminSerializer(CloudUserSerializer):
+
+    class Meta(CloudUserSerializer.Meta):
+        fields = CloudUserSerializer.Meta.fields + ['storage_quota', 'storage_used', 'files_count']
+        read_only_fields = ['storage_used', 'files_count']
+
+
+class CloudUserListSerializer(serializers.ModelSerializer):
+    storage_size = serializers.IntegerField(source='storage_used', read_only=True)
+
+    class Meta:
+        model = CloudUser
+        fields = ['id', 'username', 'email', 'date_joined', 'last_login', 'files_count', 'storage_size',
+                  'storage_quota', 'is_superuser']
+
+
 class CloudUsersDetailSerializer(serializers.ModelSerializer):
     files = FileSerializer(read_only=True, many=True)
 
     class Meta:
         model = CloudUser
         fields = ['id', 'username', 'email', 'date_joined', 'last_login', 'files', 'is_superuser']
+
+
+class FileBulkUploadSerializer(serializers.Serializer):
+    files = serializers.ListField(child=serializers.FileField(), allow_empty=False)
+    cloud_user = serializers.PrimaryKeyRelatedField(queryset=CloudUser.objects.all(), required=False)
+    comment = serializers.CharField(max_length=255, required=False, allow_blank=True, default='')
+
+
+class FileBulkDeleteSerializer(serializers.Serializer):
+    ids = serializers.ListField(child=serializers.IntegerField(), allow_empty=False, max_length=1000)
+
+
+class FileBulkUpdateItemSerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    filename = serializers.CharField(max_length=100, required=False, validators=[validate_filename])
+    comment = serializers.CharField(max_length=255, required=False, allow_blank=True)
+
+
+class FileBulkUpdateSerializer(serializers.Serializer):
+    items = FileBulkUpdateItemSerializer(many=True, allow_empty=False, max_length=1000)
+
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    size = serializers.IntegerField(min_value=1)
+
+    class Meta:
+        model = UploadSession
+        fields = ['id', 'filename', 'comment', 'size', 'offset', 'date_created', 'date_updated']
+        read_only_fields = ['offset']
+        extra_kwargs = {'filename': {'validators': [validate_filename]}}
+
+
+class JobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Job
+        fields = ['id', 'kind', 'status', 'result', 'error', 'date_created', 'date_started', 'date_finished']
+        read_only_fields = fields
+
+
+class ApiTokenSerializer(serializers.ModelSerializer):
+    scopes = serializers.ListField(child=serializers.ChoiceField(choices=ApiToken.SCOPE_CHOICES), allow_empty=False,
+                                   default=[ApiToken.READ])
+
+    class Meta:
+        model = ApiToken
+        fields = ['id', 'name', 'prefix', 'scopes', 'expires_at', 'last_used', 'date_created']
+        read_only_fields = ['prefix', 'last_used', 'date_created']
+
+    def validate_scopes(self, value):
+        return sorted(set(value))
+
+    def validate_expires_at(self, value):
+        """
+        Валидирует срок действия токена (должен быть в будущем)
+        """
+        if value is not None and value <= timezone.now():
+            raise serializers.ValidationError('Срок действия токена должен быть в будущем.')
+        return value
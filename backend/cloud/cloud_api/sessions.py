@@ -0,0 +1,15 @@
+from django.contrib.sessions.backends import cached_db
+
+from .caches import auth_cache
+
+
+class SessionStore(cached_db.SessionStore):
+    """
+    Сессии хранятся в базе, а читаются через кеш сессий и пользователей.
+    Удаление сессии при выходе из системы сразу удаляет её и из кеша
+    """
+    cache_key_prefix = 'cloud_api.session.'
+
+    def __init__(self, session_key=None):
+        super().__init__(session_key)
+        self._cache = auth_cache
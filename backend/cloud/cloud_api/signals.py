@@ -0,0 +1,25 @@
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .authentication import forget_user, verified_token_cache
+from .models import ApiToken, CloudUser
+
+
+@receiver([post_save, post_delete], sender=CloudUser)
+def forget_changed_user(sender, instance, **kwargs):
+    """
+    Удаляет пользователя из кешей аутентификации при любом его изменении или удалении, в том числе через админку.
+    Кеш очищается после фиксации транзакции, чтобы параллельный запрос не положил в него прежнюю запись
+    """
+    transaction.on_commit(partial(forget_user, instance.pk))
+
+
+@receiver(post_delete, sender=ApiToken)
+def forget_deleted_token(sender, instance, **kwargs):
+    """
+    Удаляет отозванный токен из кеша проверенных токенов, в том числе при удалении его владельца
+    """
+    transaction.on_commit(partial(verified_token_cache.discard, instance.key_hash))
@@ -0,0 +1,128 @@
+import os
+import atexit
+import logging
+import threading
+
+from django.db import DatabaseError, connection
+from django.db.models import Case, DateTimeField, F, PositiveBigIntegerField, Value, When
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+
+from cloud.settings import DOWNLOAD_STATS_FLUSH_INTERVAL, DOWNLOAD_STATS_MAX_PENDING
+from .models import File
+
+logger = logging.getLogger('main')
+
+
+class DownloadStatsBuffer:
+    """
+    Буфер статистики скачиваний с отложенной записью.
+    Скачивание только увеличивает счётчики в памяти, а фоновый поток периодически
+    записывает накопленные значения одним агрегированным UPDATE на пакет файлов.
+    Пока база недоступна, буфер растёт до overflow_factor * max_pending файлов,
+    скачивания остальных файлов не учитываются
+    """
+    batch_size = 500
+    overflow_factor = 10
+
+    def __init__(self, flush_interval, max_pending):
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.pending = {}
+        self.dropped = 0
+        self.pid = None
+
+    @property
+    def limit(self):
+        return self.max_pending * self.overflow_factor
+
+    def add(self, file_id, count, bytes_served, when):
+        # Вызывается под блокировкой. Новые файлы сверх предела отбрасываются, уже учтённые продолжают суммироваться
+        entry = self.pending.get(file_id)
+        if entry is None:
+            if len(self.pending) >= self.limit:
+                self.dropped += count
+                return
+            entry = self.pending[file_id] = [0, 0, when]
+        entry[0] += count
+        entry[1] += bytes_served
+        entry[2] = max(entry[2], when)
+
+    def record(self, file_id, bytes_served, when=None):
+        """
+        Учитывает скачивание файла
+        """
+        when = when or timezone.now()
+        with self.lock:
+            self.add(file_id, 1, bytes_served, when)
+            overflow = len(self.pending) >= self.max_pending
+            # Поток запускается в каждом процессе отдельно (в том числе после fork воркера)
+            if self.pid != os.getpid():
+                self.start()
+        if overflow:
+            self.wakeup.set()
+
+    def start(self):
+        self.pid = os.getpid()
+        threading.Thread(target=self.run, name='download-stats', daemon=True).start()
+
+    def run(self):
+        while True:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            try:
+                try:
+                    self.flush()
+                finally:
+                    connection.close()
+            except Exception:
+                # Поток не должен завершаться: record перезапускает его только в новом процессе,
+                # и без записи буфер рос бы до предела
+                logger.exception('Сбой записи статистики скачиваний')
+
+    def flush(self):
+        """
+        Записывает накопленную статистику в базу, возвращает количество обновлённых файлов
+        """
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            dropped, self.dropped = self.dropped, 0
+        if dropped:
+            logger.warning(f'Буфер статистики скачиваний переполнен, не учтено скачиваний: {dropped}')
+        if not pending:
+            return 0
+        ids = list(pending)
+        for start in range(0, len(ids), self.batch_size):
+            batch = ids[start:start + self.batch_size]
+            try:
+                File.objects.filter(pk__in=batch).update(
+                    download_count=F('download_count') + self.case(pending, batch, 0, PositiveBigIntegerField()),
+                    bytes_served=F('bytes_served') + self.case(pending, batch, 1, PositiveBigIntegerField()),
+                    last_download=Greatest(
+                        Coalesce('last_download', self.case(pending, batch, 2, DateTimeField())),
+                        self.case(pending, batch, 2, DateTimeField()),
+                    ),
+                )
+            except DatabaseError as error:
+                logger.error(f'Не удалось записать статистику скачиваний: {error}')
+                self.restore({file_id: pending[file_id] for file_id in ids[start:]})
+                break
+        return len(ids)
+
+    @staticmethod
+    def case(pending, batch, index, output_field):
+        # Выражение, выбирающее накопленное значение для каждой строки пакета
+        return Case(*[When(pk=file_id, then=Value(pending[file_id][index])) for file_id in batch],
+                    output_field=output_field)
+
+    def restore(self, entries):
+        # Возвращаем незаписанные значения в буфер, чтобы записать их при следующей попытке
+        with self.lock:
+            for file_id, (count, bytes_served, when) in entries.items():
+                self.add(file_id, count, bytes_served, when)
+
+
+download_stats = DownloadStatsBuffer(DOWNLOAD_STATS_FLUSH_INTERVAL, DOWNLOAD_STATS_MAX_PENDING)
+atexit.register(download_stats.flush)
@@ -0,0 +1,396 @@
+import io
+import os
+import abc
+import uuid
+import shutil
+from urllib.parse import quote
+
+try:
+    import boto3
+    from boto3.s3.transfer import TransferConfig
+    from botocore.exceptions import ClientError
+except ImportError:
+    boto3 = None
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.move import file_move_safe
+
+from cloud.settings import MEDIA_ROOT, BLOB_DIR, COLD_STORAGE_ROOT, DOWNLOAD_CHUNK_SIZE, STORAGE_BACKEND, \
+    S3_ENDPOINT_URL, S3_REGION, S3_ACCESS_KEY_ID, S3_SECRET_ACCESS_KEY, S3_BUCKET, S3_PREFIX, S3_COLD_BUCKET, \
+    S3_COLD_PREFIX, S3_COLD_STORAGE_CLASS, S3_MULTIPART_THRESHOLD, S3_MULTIPART_CHUNK_SIZE, S3_MAX_CONCURRENCY, \
+    S3_PRESIGNED_URL_TTL
+from .utils import remove_files
+
+# Коды ошибок S3, которыми сервис сообщает об отсутствующем объекте
+S3_MISSING_CODES = ('404', 'NoSuchKey', 'NotFound')
+# Каталог внутри BLOB_DIR, где освобождённое содержимое ждёт фиксации транзакции
+TRASH_DIR = 'trash'
+
+
+def get_temporary_path():
+    """
+    Путь для временного файла в локальном каталоге MEDIA_ROOT (файлы, брошенные после сбоя, удаляет очистка хранилища)
+    """
+    path = os.path.join(MEDIA_ROOT, BLOB_DIR, 'tmp', uuid.uuid4().hex)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
+
+
+class ContentStorage(abc.ABC):
+    """
+    Хранилище содержимого файлов одного уровня. Содержимое адресуется путём name относительно корня уровня
+    (как content.name у записи файла), каталоги в путях разделяются символом «/».
+    Отсутствующее содержимое обозначается исключением FileNotFoundError
+    """
+    @abc.abstractmethod
+    def stat(self, name):
+        """
+        Возвращает размер содержимого (байт) и время его изменения (нс)
+        """
+
+    def exists(self, name):
+        try:
+            self.stat(name)
+        except FileNotFoundError:
+            return False
+        return True
+
+    @abc.abstractmethod
+    def open(self, name):
+        """
+        Открывает содержимое на чтение как двоичный поток с перемещением по нему
+        """
+
+    @abc.abstractmethod
+    def save(self, name, source_path):
+        """
+        Помещает локальный файл source_path в хранилище под именем name, заменяя прежнее содержимое.
+        Исходный файл при этом переносится или удаляется
+        """
+
+    def copy(self, name, target):
+        """
+        Копирует содержимое в хранилище target (другой уровень). Копия появляется по месту назначения только целиком
+        """
+        temporary_path = get_temporary_path()
+        try:
+            with self.open(name) as source, open(temporary_path, 'wb') as destination:
+                shutil.copyfileobj(source, destination, DOWNLOAD_CHUNK_SIZE)
+            target.save(name, temporary_path)
+        finally:
+            remove_files([temporary_path])
+
+    @abc.abstractmethod
+    def rename(self, name, new_name):
+        """
+        Переименовывает содержимое внутри хранилища
+        """
+
+    @abc.abstractmethod
+    def delete(self, names):
+        """
+        Удаляет содержимое, пропуская уже отсутствующее
+        """
+
+    @abc.abstractmethod
+    def delete_directory(self, path):
+        """
+        Удаляет всё содержимое, путь которого начинается с каталога path
+        """
+
+    def trash(self, name):
+        """
+        Переносит содержимое в корзину, чтобы новое содержимое с тем же именем не было удалено вместе со старым.
+        Возвращает имя в корзине (None, если содержимого нет): после фиксации транзакции его удаляет purge,
+        а после отката возвращает на место restore
+        """
+        trashed = f'{BLOB_DIR}/{TRASH_DIR}/{os.path.basename(name)}-{uuid.uuid4().hex}'
+        try:
+            self.rename(name, trashed)
+        except FileNotFoundError:
+            return None
+        return trashed
+
+    def restore(self, trashed, name):
+        self.rename(trashed, name)
+
+    def purge(self, trashed):
+        self.delete([name for name in trashed if name])
+
+    @abc.abstractmethod
+    def listdir(self, path):
+        """
+        Возвращает имена подкаталогов каталога path и его файлы как тройки (имя, размер, время изменения в нс)
+        """
+
+    @abc.abstractmethod
+    def walk(self, path):
+        """
+        Перечисляет все файлы внутри каталога path как тройки (путь относительно корня, размер, время изменения в нс)
+        """
+
+    def path(self, name):
+        """
+        Локальный путь к содержимому или None, если хранилище не на локальном диске
+        """
+        return None
+
+    def url(self, name, filename, content_type, encoding=''):
+        """
+        Подписанная ссылка на скачивание содержимого напрямую из хранилища или None, если хранилище их не выдаёт
+        """
+        return None
+
+
+class LocalStorage(ContentStorage):
+    """
+    Хранилище в локальном каталоге (или общем сетевом каталоге, смонтированном на всех серверах)
+    """
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, name):
+        return os.path.join(self.root, name)
+
+    def stat(self, name):
+        stat = os.stat(self.path(name))
+        return stat.st_size, stat.st_mtime_ns
+
+    def open(self, name):
+        return open(self.path(name), 'rb')
+
+    def save(self, name, source_path):
+        # Файл перемещается переименованием, а между файловыми системами — копированием
+        path = self.path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        file_move_safe(source_path, path, allow_overwrite=True)
+
+    def copy(self, name, target):
+        if not isinstance(target, LocalStorage):
+            return super().copy(name, target)
+        destination_path = target.path(name)
+        os.makedirs(os.path.dirname(destination_path), exist_ok=True)
+        temporary_path = f'{destination_path}.{uuid.uuid4().hex}.tmp'
+        try:
+            shutil.copyfile(self.path(name), temporary_path)
+            os.replace(temporary_path, destination_path)
+        except BaseException:
+            remove_files([temporary_path])
+            raise
+
+    def rename(self, name, new_name):
+        new_path = self.path(new_name)
+        os.makedirs(os.path.dirname(new_path), exist_ok=True)
+        os.rename(self.path(name), new_path)
+
+    def delete(self, names):
+        remove_files([self.path(name) for name in names])
+
+    def delete_directory(self, path):
+        shutil.rmtree(self.path(path), ignore_errors=True)
+
+    def listdir(self, path):
+        directories, files = [], []
+        try:
+            with os.scandir(self.path(path)) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        directories.append(entry.name)
+                    elif entry.is_file(follow_symlinks=False):
+                        try:
+                            stat = entry.stat(follow_symlinks=False)
+                        except FileNotFoundError:
+                            continue
+                        files.append((entry.name, stat.st_size, stat.st_mtime_ns))
+        except FileNotFoundError:
+            pass
+        return directories, files
+
+    def walk(self, path):
+        for directory, _, names in os.walk(self.path(path)):
+            for filename in names:
+                file_path = os.path.join(directory, filename)
+                try:
+                    stat = os.lstat(file_path)
+                except FileNotFoundError:
+                    continue
+                yield os.path.relpath(file_path, self.root).replace(os.sep, '/'), stat.st_size, stat.st_mtime_ns
+
+
+class S3ObjectReader(io.RawIOBase):
+    """
+    Поток чтения объекта S3. Данные читаются одним запросом GET с текущей позиции до конца объекта;
+    после перемещения по потоку следующее чтение запрашивает диапазон от новой позиции
+    """
+    def __init__(self, client, bucket, key, size):
+        super().__init__()
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.size = size
+        self.position = 0
+        self.body = None
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        if offset != self.position:
+            self.release()
+            self.position = max(offset, 0)
+        return self.position
+
+    def readinto(self, buffer):
+        if self.position >= self.size:
+            return 0
+        if self.body is None:
+            self.body = self.client.get_object(Bucket=self.bucket, Key=self.key,
+                                               Range=f'bytes={self.position}-')['Body']
+        data = self.body.read(len(buffer))
+        buffer[:len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+    def release(self):
+        if self.body is not None:
+            self.body.close()
+            self.body = None
+
+    def close(self):
+        self.release()
+        super().close()
+
+
+class S3Storage(ContentStorage):
+    """
+    Хранилище в бакете S3-совместимого сервиса: файлы загружаются частями в несколько потоков,
+    а скачиваются клиентами по подписанным ссылкам, минуя сервер приложения
+    """
+    def __init__(self, bucket, prefix='', storage_class=''):
+        if boto3 is None:
+            raise ImproperlyConfigured('Для хранилища S3 нужен пакет boto3')
+        if not bucket:
+            raise ImproperlyConfigured('Не указан бакет хранилища S3 (S3_BUCKET)')
+        self.bucket = bucket
+        self.prefix = prefix
+        self.extra_args = {'StorageClass': storage_class} if storage_class else {}
+        self.client = boto3.client('s3', endpoint_url=S3_ENDPOINT_URL, region_name=S3_REGION,
+                                   aws_access_key_id=S3_ACCESS_KEY_ID, aws_secret_access_key=S3_SECRET_ACCESS_KEY)
+        self.transfer_config = TransferConfig(multipart_threshold=S3_MULTIPART_THRESHOLD,
+                                              multipart_chunksize=S3_MULTIPART_CHUNK_SIZE,
+                                              max_concurrency=S3_MAX_CONCURRENCY)
+
+    def get_key(self, name):
+        return self.prefix + name
+
+    def get_name(self, key):
+        return key[len(self.prefix):]
+
+    def stat(self, name):
+        try:
+            head = self.client.head_object(Bucket=self.bucket, Key=self.get_key(name))
+        except ClientError as error:
+            if error.response['Error']['Code'] in S3_MISSING_CODES:
+                raise FileNotFoundError(name) from error
+            raise
+        return head['ContentLength'], int(head['LastModified'].timestamp() * 10 ** 9)
+
+    def open(self, name):
+        size, _ = self.stat(name)
+        return io.BufferedReader(S3ObjectReader(self.client, self.bucket, self.get_key(name), size),
+                                 DOWNLOAD_CHUNK_SIZE)
+
+    def save(self, name, source_path):
+        # Большие файлы загружаются частями (multipart upload), чтение идёт с диска блоками
+        self.client.upload_file(source_path, self.bucket, self.get_key(name), ExtraArgs=self.extra_args,
+                                Config=self.transfer_config)
+        remove_files([source_path])
+
+    def copy(self, name, target):
+        if not isinstance(target, S3Storage):
+            return super().copy(name, target)
+        self.copy_object(name, target, name)
+
+    def copy_object(self, name, target, new_name):
+        # Копирование выполняется на стороне хранилища, большие объекты копируются частями
+        try:
+            target.client.copy({'Bucket': self.bucket, 'Key': self.get_key(name)}, target.bucket,
+                               target.get_key(new_name), ExtraArgs=target.extra_args, Config=target.transfer_config,
+                               SourceClient=self.client)
+        except ClientError as error:
+            if error.response['Error']['Code'] in S3_MISSING_CODES:
+                raise FileNotFoundError(name) from error
+            raise
+
+    def rename(self, name, new_name):
+        self.copy_object(name, self, new_name)
+        self.delete([name])
+
+    def delete(self, names):
+        keys = [{'Key': self.get_key(name)} for name in names]
+        # Запрос DeleteObjects принимает не больше 1000 ключей
+        for start in range(0, len(keys), 1000):
+            self.client.delete_objects(Bucket=self.bucket, Delete={'Objects': keys[start:start + 1000], 'Quiet': True})
+
+    def delete_directory(self, path):
+        names = []
+        for name, _, _ in self.walk(path):
+            names.append(name)
+            if len(names) == 1000:
+                self.delete(names)
+                names = []
+        self.delete(names)
+
+    def listdir(self, path):
+        prefix = self.get_key(f'{path.rstrip("/")}/' if path else '')
+        directories, files = [], []
+        for page in self.client.get_paginator('list_objects_v2').paginate(Bucket=self.bucket, Prefix=prefix,
+                                                                          Delimiter='/'):
+            directories.extend(item['Prefix'][len(prefix):].rstrip('/') for item in page.get('CommonPrefixes', ()))
+            files.extend((item['Key'][len(prefix):], item['Size'], int(item['LastModified'].timestamp() * 10 ** 9))
+                         for item in page.get('Contents', ()))
+        return directories, files
+
+    def walk(self, path):
+        prefix = self.get_key(f'{path.rstrip("/")}/' if path else '')
+        for page in self.client.get_paginator('list_objects_v2').paginate(Bucket=self.bucket, Prefix=prefix):
+            for item in page.get('Contents', ()):
+                yield self.get_name(item['Key']), item['Size'], int(item['LastModified'].timestamp() * 10 ** 9)
+
+    def url(self, name, filename, content_type, encoding=''):
+        # Заголовки ответа задаются в подписанной ссылке: хранилище отдаёт файл под его именем в облаке
+        params = {
+            'Bucket': self.bucket,
+            'Key': self.get_key(name),
+            'ResponseContentType': content_type,
+            'ResponseContentDisposition': f"attachment; filename*=UTF-8''{quote(filename)}",
+        }
+        if encoding:
+            params['ResponseContentEncoding'] = encoding
+        return self.client.generate_presigned_url('get_object', Params=params, ExpiresIn=S3_PRESIGNED_URL_TTL)
+
+
+def create_storages():
+    if STORAGE_BACKEND == 's3':
+        return S3Storage(S3_BUCKET, S3_PREFIX), S3Storage(S3_COLD_BUCKET, S3_COLD_PREFIX, S3_COLD_STORAGE_CLASS)
+    if STORAGE_BACKEND != 'local':
+        raise ImproperlyConfigured(f'Неизвестное хранилище содержимого: {STORAGE_BACKEND}')
+    return LocalStorage(MEDIA_ROOT), LocalStorage(COLD_STORAGE_ROOT)
+
+
+# Основной и холодный уровни хранения
+hot_storage, cold_storage = create_storages()
+
+
+def get_storage(cold=False):
+    return cold_storage if cold else hot_storage
@@ -1,3 +1,1222 @@
-from django.test import TestCase
+import io
+import gzip
+import base64
+import os
+import shutil
+import logging
+import tempfile
+import threading
+import zipfile
+from datetime import timedelta
+from unittest import mock, skipIf
+from urllib.parse import parse_qs, urlsplit
 
-# Create your tests here.
+try:
+    import boto3
+    from moto import mock_aws
+except ImportError:
+    mock_aws = None
+
+from asgiref.sync import async_to_sync
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.signals import request_finished
+from django.db import DatabaseError, close_old_connections, transaction
+from django.db.models import QuerySet
+from django.http import StreamingHttpResponse
+from django.test import AsyncRequestFactory, RequestFactory, SimpleTestCase, TestCase
+from django.utils import timezone
+from PIL import Image
+from rest_framework.test import APIClient
+
+from cloud.settings import BLOB_DIR, PREVIEW_SIZE
+
+from .archives import stream_zip
+from .authentication import forget_user, hash_token, verified_token_cache
+from .changes import compact_changes, record_changes
+from .compression import compress_file, get_content_encoding, open_content
+from .downloads import MAX_RANGES, parse_range_header
+from .exceptions import DownloadThrottled
+from .jobs import TASKS, claim_jobs, delete_files, delete_user_task, enqueue, requeue_stale_jobs, run_job
+from .logs import BackgroundHandler
+from .models import ApiToken, Blob, CloudUser, File, FileChange, Job, UploadSession
+from .previews import PreviewCache, PreviewUnavailable, preview_cache, render_image
+from .scrub import MISSING, ORPHAN, ORPHANS_DIR, REF_COUNT, SIZE_MISMATCH, STALE_COPY, UNREFERENCED, Scrubber
+from .search import COMMENT_WEIGHT, get_trigrams, index_files
+from .stats import DownloadStatsBuffer
+from .storage import S3Storage, cold_storage, get_temporary_path, hot_storage
+from .throttling import DownloadThrottle, Limits, TokenBucket
+from .utils import get_blob_path, get_sharded_path, get_user_directory_path, remove_files
+from .views import ChangesAsyncView, FileAsyncDownload, FileAsyncExternalDownload
+
+
+class StorageTestCase(TestCase):
+    """
+    Тест с отдельными временными каталогами хранилища, сессий загрузки и временных файлов
+    """
+    def setUp(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root, True)
+        for target, value in [
+            (hot_storage, {'root': f'{root}/hot'}),
+            (cold_storage, {'root': f'{root}/cold'}),
+        ]:
+            patcher = mock.patch.multiple(target, **value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        for name, value in [
+            ('cloud_api.storage.MEDIA_ROOT', f'{root}/hot'),
+            ('cloud_api.models.UPLOAD_SESSION_ROOT', f'{root}/sessions'),
+        ]:
+            patcher = mock.patch(name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        caches['throttle'].clear()
+        self.user = CloudUser.objects.create_user('alice', 'alice@example.com', 'Password1!',
+                                                  storage_directory='alice')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+
+class RangeHeaderTests(SimpleTestCase):
+    def test_single_ranges(self):
+        self.assertEqual(parse_range_header('bytes=0-9', 100), [(0, 9)])
+        self.assertEqual(parse_range_header('bytes=90-', 100), [(90, 99)])
+        self.assertEqual(parse_range_header('bytes=-10', 100), [(90, 99)])
+        self.assertEqual(parse_range_header('bytes=95-200', 100), [(95, 99)])
+        self.assertEqual(parse_range_header('bytes=-200', 100), [(0, 99)])
+
+    def test_ranges_are_sorted_and_merged(self):
+        self.assertEqual(parse_range_header('bytes=50-59,0-9,10-19,55-70', 100), [(0, 19), (50, 70)])
+
+    def test_unsatisfiable_ranges(self):
+        self.assertEqual(parse_range_header('bytes=100-', 100), [])
+        self.assertEqual(parse_range_header('bytes=-0', 100), [])
+        self.assertEqual(parse_range_header('bytes=0-', 0), [])
+
+    def test_invalid_headers_are_ignored(self):
+        for header in ('', 'items=0-9', 'bytes=', 'bytes=-', 'bytes=9-0', 'bytes=a-b', 'bytes=0-9;1-2'):
+            self.assertIsNone(parse_range_header(header, 100), header)
+        self.assertIsNone(parse_range_header('bytes=' + ','.join(['0-0'] * (MAX_RANGES + 1)), 100))
+
+
+class UploadSessionTests(StorageTestCase):
+    def create_session(self, size=10):
+        response = self.client.post('/api/files/uploads/', {'filename': 'data.bin', 'size': size}, format='json')
+        self.assertEqual(response.status_code, 201)
+        return response['Location']
+
+    def send(self, location, data, offset):
+        return self.client.patch(location, data, content_type='application/offset+octet-stream',
+                                 HTTP_UPLOAD_OFFSET=str(offset))
+
+    def test_chunks_are_assembled_into_file(self):
+        location = self.create_session()
+        response = self.send(location, b'hello', 0)
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(response['Upload-Offset'], '5')
+        response = self.send(location, b'world', 5)
+        self.assertEqual(response.status_code, 201)
+        file = File.objects.get()
+        with file.storage.open(file.content.name) as stream:
+            self.assertEqual(stream.read(), b'helloworld')
+        self.assertFalse(UploadSession.objects.exists())
+
+    def test_name_conflict_keeps_session_for_retry(self):
+        location = self.create_session()
+        File.objects.create(cloud_user=self.user, filename='data.bin', size=1)
+        response = self.send(location, b'helloworld', 0)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(UploadSession.objects.get().offset, 10)
+        File.objects.filter(filename='data.bin').update(filename='old.bin')
+        response = self.send(location, b'', 10)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(File.objects.get(filename='data.bin').blob.size, 10)
+
+    def test_upload_finalized_by_concurrent_request(self):
+        location = self.create_session()
+        prepare_content = UploadSession.prepare_content
+
+        def prepare_and_finish(self):
+            result = prepare_content(self)
+            # Параллельный запрос завершил загрузку, пока вычислялся хеш
+            UploadSession.objects.filter(pk=self.pk).delete()
+            return result
+
+        with mock.patch.object(UploadSession, 'prepare_content', prepare_and_finish):
+            response = self.send(location, b'helloworld', 0)
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(File.objects.exists())
+
+    def test_compressed_copy_is_prepared_before_finalize(self):
+        data = b'abcdef' * 1000
+        location = self.create_session(size=len(data))
+        with mock.patch.multiple('cloud_api.compression', STORAGE_ENCODING='gzip', STORAGE_COMPRESSION_MIN_SIZE=1):
+            response = self.send(location, data, 0)
+        self.assertEqual(response.status_code, 201)
+        file = File.objects.select_related('blob').get()
+        self.assertEqual(file.blob.encoding, 'gzip')
+        self.assertEqual(os.listdir(os.path.dirname(UploadSession().part_path)), [])
+        response = self.client.get(f'/api/files/{file.pk}/download/')
+        self.assertEqual(b''.join(response.streaming_content), data)
+
+    def test_wrong_offset_is_rejected(self):
+        location = self.create_session()
+        self.send(location, b'hello', 0)
+        response = self.send(location, b'hello', 0)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response['Upload-Offset'], '5')
+
+    def test_chunk_beyond_size_is_rejected(self):
+        location = self.create_session(size=4)
+        response = self.send(location, b'hello', 0)
+        self.assertEqual(response.status_code, 413)
+
+    def test_chunk_received_during_concurrent_write_is_discarded(self):
+        location = self.create_session()
+        session = UploadSession.objects.get()
+        write_chunk = UploadSession.write_chunk
+
+        def write_and_advance(self, stream, length):
+            result = write_chunk(self, stream, length)
+            # Параллельный запрос успел дописать свой фрагмент, пока принимался этот
+            UploadSession.objects.filter(pk=session.pk).update(offset=3)
+            return result
+
+        with mock.patch.object(UploadSession, 'write_chunk', write_and_advance):
+            response = self.send(location, b'hello', 0)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(UploadSession.objects.get().offset, 3)
+
+
+class FileUpdateTests(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.file = File.objects.create(cloud_user=self.user, filename='a.txt', size=3)
+        self.other = File.objects.create(cloud_user=self.user, filename='b.txt', size=3, external_link_key='bKey1234')
+
+    def test_link_key_cannot_be_chosen_by_client(self):
+        response = self.client.patch(f'/api/files/{self.file.pk}/', {'external_link_key': 'mine'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.patch(f'/api/files/{self.file.pk}/', {'external_link_key': 'bKey1234'}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_link_key_can_be_revoked(self):
+        response = self.client.get(f'/api/files/{self.file.pk}/generatelink/')
+        self.assertTrue(response.data['external_link_key'])
+        response = self.client.patch(f'/api/files/{self.file.pk}/', {'external_link_key': ''}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.file.refresh_from_db()
+        self.assertEqual(self.file.external_link_key, '')
+
+    def test_size_owner_and_content_cannot_be_changed(self):
+        other_user = CloudUser.objects.create_user('bob', 'bob@example.com', 'Password1!', storage_directory='bob')
+        response = self.client.patch(f'/api/files/{self.file.pk}/',
+                                     {'size': 1, 'cloud_user': other_user.pk, 'content': 'other/path'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.file.refresh_from_db()
+        self.assertEqual((self.file.size, self.file.cloud_user_id, self.file.content.name), (3, self.user.pk, ''))
+
+
+class FileUploadTests(StorageTestCase):
+    def test_upload_is_charged_to_owner(self):
+        response = self.client.post('/api/files/upload/', {'cloud_user': self.user.pk, 'content':
+                                    SimpleUploadedFile('a.txt', b'hello')})
+        self.assertEqual(response.status_code, 201)
+        self.user.refresh_from_db()
+        self.assertEqual((self.user.storage_used, self.user.files_count), (5, 1))
+
+    def test_bulk_upload_conflict_leaves_no_content(self):
+        stored = {os.path.join(path, name) for path, _, names in os.walk(hot_storage.root) for name in names}
+        bulk_create = File.objects.bulk_create
+
+        def create_with_conflict(files, *args, **kwargs):
+            # Параллельный запрос успевает создать файл с тем же именем после проверки имён
+            File.objects.create(cloud_user=self.user, filename='d.txt', size=1)
+            return bulk_create(files, *args, **kwargs)
+
+        with mock.patch.object(File.objects, 'bulk_create', create_with_conflict):
+            response = self.client.post('/api/files/bulk/upload/', {'files': [SimpleUploadedFile('d.txt', b'new')]})
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(stored,
+                         {os.path.join(path, name) for path, _, names in os.walk(hot_storage.root) for name in names})
+        self.assertFalse(File.objects.filter(filename='d.txt').exists())
+        self.user.refresh_from_db()
+        self.assertEqual((self.user.storage_used, self.user.files_count), (0, 0))
+
+    def test_upload_for_another_user_is_forbidden(self):
+        other_user = CloudUser.objects.create_user('bob', 'bob@example.com', 'Password1!', storage_directory='bob')
+        response = self.client.post('/api/files/upload/', {'cloud_user': other_user.pk, 'content':
+                                    SimpleUploadedFile('a.txt', b'hello')})
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(File.objects.exists())
+        other_user.refresh_from_db()
+        self.assertEqual(other_user.storage_used, 0)
+
+
+class CachedUserTests(StorageTestCase):
+    """
+    Пользователь сессии берётся из кеша аутентификации
+    """
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.login(username='alice', password='Password1!')
+        self.addCleanup(forget_user, self.user.pk)
+
+    def test_quota_check_reads_current_usage(self):
+        CloudUser.objects.filter(pk=self.user.pk).update(storage_quota=10)
+        forget_user(self.user.pk)
+        response = self.client.post('/api/files/uploads/', {'filename': 'a.bin', 'size': 5}, format='json')
+        self.assertEqual(response.status_code, 201)
+        # Счётчики меняются запросом UPDATE без сигналов, закешированный пользователь их не видит
+        CloudUser.change_usage(self.user.pk, 8, 1)
+        response = self.client.post('/api/files/uploads/', {'filename': 'b.bin', 'size': 5}, format='json')
+        self.assertEqual(response.status_code, 413)
+
+    def test_user_changes_reset_cache(self):
+        self.assertEqual(self.client.get('/api/session/').status_code, 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+        self.assertEqual(self.client.get('/api/session/').status_code, 403)
+
+
+class ColdTierTests(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.file = File.objects.create(cloud_user=self.user, filename='a.txt', size=5, content='alice/a.txt',
+                                        tier=File.COLD, external_link_key='coldKey1')
+
+    def test_promoted_file_is_downloaded(self):
+        path = cold_storage.path('alice/a.txt')
+        os.makedirs(os.path.dirname(path))
+        with open(path, 'wb') as stream:
+            stream.write(b'hello')
+        response = self.client.get(f'/api/files/{self.file.pk}/download/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'hello')
+        self.file.refresh_from_db()
+        self.assertEqual(self.file.tier, File.HOT)
+
+    def test_missing_cold_copy_is_not_found(self):
+        response = self.client.get(f'/api/files/{self.file.pk}/download/')
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get('/f/coldKey1')
+        self.assertEqual(response.status_code, 302)
+        self.file.refresh_from_db()
+        self.assertEqual(self.file.tier, File.COLD)
+
+
+@skipIf(mock_aws is None, 'Для тестов хранилища S3 нужны пакеты boto3 и moto')
+class S3StorageTests(SimpleTestCase):
+    def setUp(self):
+        aws = mock_aws()
+        aws.start()
+        self.addCleanup(aws.stop)
+        client = boto3.client('s3', region_name='us-east-1')
+        client.create_bucket(Bucket='bkt')
+        self.storage = S3Storage('bkt', 'hot/')
+        self.cold = S3Storage('bkt', 'cold/')
+        # Клиенты, созданные до запуска mock_aws, обращаются к настоящему сервису
+        self.storage.client = self.cold.client = client
+        self.content = bytes(range(256)) * 40
+        self.save('a/data.bin', self.content)
+
+    def save(self, name, data):
+        source = tempfile.NamedTemporaryFile(delete=False)
+        with source:
+            source.write(data)
+        self.storage.save(name, source.name)
+        self.assertFalse(os.path.exists(source.name))
+
+    def test_stat(self):
+        size, modified = self.storage.stat('a/data.bin')
+        self.assertEqual(size, len(self.content))
+        self.assertGreater(modified, 0)
+        self.assertTrue(self.storage.exists('a/data.bin'))
+        self.assertFalse(self.storage.exists('a/missing.bin'))
+        with self.assertRaises(FileNotFoundError):
+            self.storage.stat('a/missing.bin')
+
+    def test_open_reads_ranges(self):
+        with self.storage.open('a/data.bin') as stream:
+            self.assertEqual(stream.read(10), self.content[:10])
+            stream.seek(1000)
+            self.assertEqual(stream.read(24), self.content[1000:1024])
+            stream.seek(-16, os.SEEK_END)
+            self.assertEqual(stream.read(), self.content[-16:])
+            self.assertEqual(stream.read(), b'')
+            stream.seek(5)
+            stream.seek(3, os.SEEK_CUR)
+            self.assertEqual(stream.tell(), 8)
+            self.assertEqual(stream.read(4), self.content[8:12])
+        with self.assertRaises(FileNotFoundError):
+            self.storage.open('a/missing.bin')
+
+    def test_copy_and_delete(self):
+        self.storage.copy('a/data.bin', self.cold)
+        with self.cold.open('a/data.bin') as stream:
+            self.assertEqual(stream.read(), self.content)
+        with self.assertRaises(FileNotFoundError):
+            self.storage.copy('a/missing.bin', self.cold)
+        self.storage.delete(['a/data.bin', 'a/missing.bin'])
+        self.assertFalse(self.storage.exists('a/data.bin'))
+        self.assertTrue(self.cold.exists('a/data.bin'))
+
+    def test_trash(self):
+        trashed = self.storage.trash('a/data.bin')
+        self.assertFalse(self.storage.exists('a/data.bin'))
+        self.storage.restore(trashed, 'a/data.bin')
+        with self.storage.open('a/data.bin') as stream:
+            self.assertEqual(stream.read(), self.content)
+        trashed = self.storage.trash('a/data.bin')
+        self.assertIsNone(self.storage.trash('a/data.bin'))
+        self.storage.purge([trashed, None])
+        self.assertEqual(list(self.storage.walk('')), [])
+
+    def test_listing(self):
+        self.save('a/b/other.bin', b'xyz')
+        self.assertEqual(sorted(name for name, _, _ in self.storage.walk('a')), ['a/b/other.bin', 'a/data.bin'])
+        self.storage.delete_directory('a/b')
+        self.assertEqual([name for name, _, _ in self.storage.walk('a')], ['a/data.bin'])
+
+    def test_presigned_url(self):
+        url = self.storage.url('a/data.bin', 'отчёт.bin', 'application/octet-stream', encoding='gzip')
+        parts = urlsplit(url)
+        query = parse_qs(parts.query)
+        self.assertTrue(parts.path.endswith('/hot/a/data.bin'))
+        self.assertTrue(query.keys() & {'Signature', 'X-Amz-Signature'})
+        self.assertEqual(query['response-content-encoding'], ['gzip'])
+        self.assertEqual(query['response-content-disposition'],
+                         ["attachment; filename*=UTF-8''%D0%BE%D1%82%D1%87%D1%91%D1%82.bin"])
+
+
+class CompactChangesTests(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        file = File.objects.create(cloud_user=self.user, filename='a.txt', size=3)
+        record_changes([(FileChange.CREATED, file), (FileChange.UPDATED, file)])
+
+    def test_recent_changes_are_kept_without_clients(self):
+        self.assertEqual(compact_changes(), 0)
+        self.assertEqual(FileChange.objects.count(), 2)
+
+    def test_old_changes_are_removed(self):
+        FileChange.objects.filter(sequence=1).update(date_created=timezone.now() - timedelta(days=30))
+        self.assertEqual(compact_changes(), 1)
+        self.assertEqual(list(FileChange.objects.values_list('sequence', flat=True)), [2])
+
+
+class BlobTrashTests(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        response = self.client.post('/api/files/bulk/upload/', {
+            'files': [SimpleUploadedFile('a.txt', b'hello'), SimpleUploadedFile('b.txt', b'world!')],
+        })
+        self.files = list(File.objects.select_related('blob').filter(
+            pk__in=[result['id'] for result in response.data['results']]))
+
+    def stored(self, file):
+        return hot_storage.exists(file.blob.name)
+
+    def test_content_is_deleted_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            delete_files(self.files)
+        self.assertFalse(any(self.stored(file) for file in self.files))
+        self.assertEqual(list(hot_storage.walk('')), [])
+
+    def test_failed_release_restores_content(self):
+        trash = hot_storage.trash
+
+        def fail_second(name):
+            if trash_calls:
+                raise OSError('диск недоступен')
+            trash_calls.append(name)
+            return trash(name)
+
+        trash_calls = []
+        with mock.patch.object(hot_storage, 'trash', fail_second), self.assertRaises(OSError):
+            delete_files(self.files)
+        self.assertEqual(Blob.objects.count(), 2)
+        self.assertTrue(all(self.stored(file) for file in self.files))
+
+    def test_outer_rollback_is_restored_from_trash(self):
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            delete_files(self.files)
+            raise RuntimeError()
+        self.assertEqual(Blob.objects.count(), 2)
+        self.assertFalse(any(self.stored(file) for file in self.files))
+        self.assertEqual(Blob.empty_trash(), (2, 0))
+        self.assertTrue(all(self.stored(file) for file in self.files))
+        response = self.client.get(f'/api/files/{self.files[0].pk}/download/')
+        self.assertEqual(b''.join(response.streaming_content), b'hello')
+
+    def test_committed_trash_is_removed(self):
+        delete_files(self.files[:1])
+        self.assertEqual(Blob.empty_trash(), (0, 1))
+        self.assertEqual(Blob.objects.count(), 1)
+
+
+class DeleteUserTests(StorageTestCase):
+    def test_files_are_deleted_without_change_log(self):
+        for name in ('a.txt', 'b.txt'):
+            self.client.post('/api/files/upload/', {'cloud_user': self.user.pk,
+                                                    'content': SimpleUploadedFile(name, b'hello')})
+        with mock.patch('cloud_api.jobs.record_changes') as record:
+            self.assertEqual(delete_user_task(self.user.pk), {'deleted_files': 2})
+        record.assert_not_called()
+        self.assertFalse(CloudUser.objects.filter(pk=self.user.pk).exists())
+        self.assertFalse(File.objects.exists())
+
+
+class BackgroundHandlerTests(SimpleTestCase):
+    def setUp(self):
+        self.stream = io.StringIO()
+        self.handler = BackgroundHandler(self.stream)
+        self.addCleanup(self.handler.close)
+        self.threads = []
+        handler = self
+
+        class Formatter(logging.Formatter):
+            def format(self, record):
+                handler.threads.append(threading.current_thread())
+                return super().format(record)
+
+        self.handler.setFormatter(Formatter('%(message)s'))
+
+    def test_message_is_formatted_in_listener_thread(self):
+        lock = threading.Lock()
+        record = logging.LogRecord('main', logging.INFO, __file__, 0, 'Файл %s, блокировка %s', ('a.txt', lock), None)
+        self.handler.handle(record)
+        self.handler.stop()
+        self.assertEqual(self.stream.getvalue(), f'Файл a.txt, блокировка {lock}\n')
+        self.assertNotIn(threading.current_thread(), self.threads)
+
+    def test_prepare_keeps_picklable_args(self):
+        lock = threading.Lock()
+        args = {'names': ['a.txt'], 'lock': lock}
+        record = logging.LogRecord('main', logging.INFO, __file__, 0, '%(names)s %(lock)s', (args,), None)
+        prepared = self.handler.prepare(record)
+        self.assertEqual(prepared.msg, '%(names)s %(lock)s')
+        self.assertIs(prepared.args['names'], args['names'])
+        self.assertEqual(prepared.args['lock'], str(lock))
+
+
+class QuotaTests(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user.storage_quota = 8
+        self.user.save()
+
+    def upload(self, name, data):
+        return self.client.post('/api/files/upload/', {'cloud_user': self.user.pk,
+                                                       'content': SimpleUploadedFile(name, data)})
+
+    def assertUsage(self, storage_used, files_count):
+        self.user.refresh_from_db()
+        self.assertEqual((self.user.storage_used, self.user.files_count), (storage_used, files_count))
+
+    def test_upload_over_quota_is_rejected(self):
+        self.assertEqual(self.upload('a.txt', b'hello').status_code, 201)
+        self.assertEqual(self.upload('b.txt', b'hello').status_code, 413)
+        self.assertUsage(5, 1)
+        self.assertEqual(File.objects.count(), 1)
+
+    def test_delete_releases_space(self):
+        file_id = self.upload('a.txt', b'hello').data['id']
+        self.assertEqual(self.client.delete(f'/api/files/{file_id}/').status_code, 204)
+        self.assertUsage(0, 0)
+        self.assertEqual(self.upload('b.txt', b'hello').status_code, 201)
+
+    def test_bulk_upload_over_quota_is_rejected(self):
+        response = self.client.post('/api/files/bulk/upload/', {'files': [SimpleUploadedFile('a.txt', b'hello'),
+                                                                          SimpleUploadedFile('b.txt', b'hello')]})
+        self.assertEqual(response.status_code, 413)
+        self.assertUsage(0, 0)
+        self.assertFalse(File.objects.exists())
+
+
+class BulkFilesTests(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        response = self.client.post('/api/files/bulk/upload/', {
+            'files': [SimpleUploadedFile('a.txt', b'hello'), SimpleUploadedFile('b.txt', b'world!')],
+            'comment': 'отчёт',
+        })
+        self.assertEqual(response.status_code, 200)
+        self.ids = [result['id'] for result in response.data['results']]
+        self.other_user = CloudUser.objects.create_user('bob', 'bob@example.com', 'Password1!',
+                                                        storage_directory='bob')
+        self.other_file = File.objects.create(cloud_user=self.other_user, filename='c.txt', size=3)
+
+    def test_upload_reports_each_file(self):
+        response = self.client.post('/api/files/bulk/upload/', {'files': [SimpleUploadedFile('a.txt', b'x'),
+                                                                          SimpleUploadedFile('d.txt', b'x')]})
+        self.assertEqual([result['status'] for result in response.data['results']], [400, 201])
+        self.assertEqual(set(File.objects.filter(cloud_user=self.user).values_list('filename', flat=True)),
+                         {'a.txt', 'b.txt', 'd.txt'})
+        self.user.refresh_from_db()
+        self.assertEqual((self.user.storage_used, self.user.files_count), (12, 3))
+
+    def test_upload_for_another_user_is_forbidden(self):
+        response = self.client.post('/api/files/bulk/upload/', {'files': [SimpleUploadedFile('d.txt', b'x')],
+                                                                'cloud_user': self.other_user.pk})
+        self.assertEqual(response.status_code, 403)
+
+    def test_update(self):
+        response = self.client.post('/api/files/bulk/update/', {'items': [
+            {'id': self.ids[0], 'filename': 'renamed.txt'},
+            {'id': self.ids[1], 'filename': 'renamed.txt'},
+            {'id': self.other_file.pk, 'comment': 'чужой'},
+            {'id': 0, 'comment': 'нет'},
+        ]}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([result['status'] for result in response.data['results']], [200, 400, 403, 404])
+        self.assertEqual(File.objects.get(pk=self.ids[0]).filename, 'renamed.txt')
+        self.assertEqual(File.objects.get(pk=self.ids[1]).filename, 'b.txt')
+        self.assertEqual(File.objects.get(pk=self.other_file.pk).comment, '')
+
+    def test_delete_runs_as_job(self):
+        response = self.client.post('/api/files/bulk/delete/', {'ids': [self.ids[0], self.other_file.pk, 0]},
+                                    format='json')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual([str(pk) for pk in claim_jobs(10)], [response.data['id']])
+        self.assertEqual(run_job(response.data['id']), Job.DONE)
+        response = self.client.get(response['Location'])
+        self.assertEqual([result['status'] for result in response.data['result']['results']], [204, 403, 404])
+        self.assertEqual(set(File.objects.values_list('pk', flat=True)), {self.ids[1], self.other_file.pk})
+        self.user.refresh_from_db()
+        self.assertEqual((self.user.storage_used, self.user.files_count), (6, 1))
+
+
+class JobQueueTests(TestCase):
+    def test_jobs_are_claimed_once_in_order(self):
+        first = enqueue('cleanup_storage')
+        second = enqueue('cleanup_storage')
+        self.assertEqual(claim_jobs(1), [first.pk])
+        self.assertEqual(claim_jobs(10), [second.pk])
+        self.assertEqual(claim_jobs(10), [])
+        self.assertEqual(Job.objects.get(pk=first.pk).status, Job.RUNNING)
+
+    def test_unknown_task_fails(self):
+        job = enqueue('unknown')
+        claim_jobs(1)
+        self.assertEqual(run_job(job.pk), Job.FAILED)
+        job.refresh_from_db()
+        self.assertIn('unknown', job.error)
+        self.assertIsNotNone(job.date_finished)
+
+    def test_task_receives_params(self):
+        with mock.patch.dict(TASKS, {'echo': lambda **params: params}):
+            job = enqueue('echo', value=1)
+            claim_jobs(1)
+            self.assertEqual(run_job(job.pk), Job.DONE)
+        job.refresh_from_db()
+        self.assertEqual(job.result, {'value': 1})
+
+    def test_stale_jobs_are_requeued(self):
+        job = enqueue('cleanup_storage')
+        claim_jobs(1)
+        Job.objects.filter(pk=job.pk).update(date_started=timezone.now() - timedelta(hours=1))
+        self.assertEqual(requeue_stale_jobs(timeout=60), 1)
+        self.assertEqual(claim_jobs(1), [job.pk])
+
+
+class ApiTokenTests(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        verified_token_cache.clear()
+
+    def issue(self, **data):
+        response = self.client.post('/api/tokens/', data, format='json')
+        self.assertEqual(response.status_code, 201)
+        return response.data
+
+    def token_client(self, key):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {key}')
+        return client
+
+    def test_token_is_stored_as_hash(self):
+        token = self.issue(name='sync')
+        self.assertTrue(token['key'].startswith(token['prefix']))
+        stored = ApiToken.objects.get()
+        self.assertEqual(stored.key_hash, hash_token(token['key']))
+        self.assertNotIn(token['key'], str(vars(stored)))
+
+    def test_scopes(self):
+        client = self.token_client(self.issue(name='read')['key'])
+        self.assertEqual(client.get('/api/files/').status_code, 200)
+        response = client.post('/api/files/bulk/delete/', {'ids': [1]}, format='json')
+        self.assertEqual(response.status_code, 403)
+        client = self.token_client(self.issue(name='write', scopes=['read', 'write'])['key'])
+        response = client.post('/api/files/bulk/delete/', {'ids': [1]}, format='json')
+        self.assertEqual(response.status_code, 202)
+
+    def test_invalid_tokens_are_rejected(self):
+        token = self.issue(name='sync')
+        self.assertEqual(self.token_client(token['key'] + 'x').get('/api/files/').status_code, 401)
+        ApiToken.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(self.token_client(token['key']).get('/api/files/').status_code, 401)
+
+    def test_revoked_token_is_rejected(self):
+        token = self.issue(name='sync')
+        client = self.token_client(token['key'])
+        self.assertEqual(client.get('/api/files/').status_code, 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.client.delete(f'/api/tokens/{token["id"]}/').status_code, 204)
+        self.assertEqual(client.get('/api/files/').status_code, 401)
+
+    def test_token_cannot_issue_tokens(self):
+        client = self.token_client(self.issue(name='write', scopes=['read', 'write'])['key'])
+        self.assertEqual(client.post('/api/tokens/', {'name': 'other'}, format='json').status_code, 401)
+        self.assertEqual(ApiToken.objects.count(), 1)
+
+
+class ChangesTests(StorageTestCase):
+    def changes(self, **params):
+        return self.client.get('/api/changes/', params)
+
+    def test_cursor_pages_through_changes(self):
+        cursor = self.changes().data['cursor']
+        file = File.objects.create(cloud_user=self.user, filename='a.txt', size=3)
+        record_changes([(FileChange.CREATED, file), (FileChange.UPDATED, file), (FileChange.RENAMED, file)])
+        response = self.changes(cursor=cursor, limit=2)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([change['sequence'] for change in response.data['changes']], [cursor + 1, cursor + 2])
+        self.assertTrue(response.data['has_more'])
+        self.assertEqual(response.data['changes'][0]['file']['filename'], 'a.txt')
+        response = self.changes(cursor=response.data['cursor'], limit=2)
+        self.assertEqual([change['action'] for change in response.data['changes']], [FileChange.RENAMED])
+        self.assertFalse(response.data['has_more'])
+        response = self.changes(cursor=response.data['cursor'])
+        self.assertEqual(response.data['changes'], [])
+
+    def test_sync_view_limits_long_polling(self):
+        with mock.patch('cloud_api.views.wait_for_changes') as wait_for_changes:
+            self.assertEqual(self.changes(wait=30).status_code, 200)
+            wait_for_changes.assert_not_called()
+            with mock.patch('cloud_api.views.CHANGES_SYNC_MAX_WAIT', 2):
+                wait_for_changes.return_value = 0
+                self.changes(wait=30)
+            self.assertEqual(wait_for_changes.call_args.args[2], 2)
+
+    def test_compacted_cursor_requires_full_sync(self):
+        file = File.objects.create(cloud_user=self.user, filename='a.txt', size=3)
+        record_changes([(FileChange.CREATED, file), (FileChange.UPDATED, file)])
+        FileChange.objects.filter(sequence=1).delete()
+        response = self.changes(cursor=0)
+        self.assertEqual(response.status_code, 410)
+        self.assertEqual(response.data['cursor'], 2)
+
+    def test_invalid_cursors(self):
+        self.assertEqual(self.changes(cursor=5).status_code, 400)
+        self.assertEqual(self.changes(cursor=-1).status_code, 400)
+        self.assertEqual(self.changes(cursor='a').status_code, 400)
+
+    def test_client_cursor_holds_back_compaction(self):
+        file = File.objects.create(cloud_user=self.user, filename='a.txt', size=3)
+        record_changes([(FileChange.CREATED, file), (FileChange.UPDATED, file)])
+        self.changes(cursor=1, client='laptop')
+        FileChange.objects.update(date_created=timezone.now() - timedelta(days=30))
+        self.assertEqual(compact_changes(), 1)
+        self.assertEqual(self.changes(cursor=1).data['changes'][0]['sequence'], 2)
+
+
+class ThrottlingTests(SimpleTestCase):
+    def setUp(self):
+        caches['throttle'].clear()
+        self.request = RequestFactory().get('/', REMOTE_ADDR='10.0.0.1')
+
+    def test_token_bucket(self):
+        bucket = TokenBucket(rate=1, burst=2)
+        self.assertEqual(bucket.take('bucket'), 0)
+        self.assertEqual(bucket.take('bucket'), 0)
+        wait = bucket.take('bucket')
+        self.assertGreater(wait, 0)
+        self.assertLessEqual(wait, 1)
+        # Отклонённый запрос не расходует токены, взятие в долг расходует
+        self.assertGreater(bucket.take('bucket', debt=True), 0)
+        self.assertGreater(bucket.take('bucket'), wait)
+
+    def test_request_rate(self):
+        throttle = DownloadThrottle({'ip': Limits(0, 1, 1, 0)})
+        with throttle.limit(self.request):
+            pass
+        with self.assertRaises(DownloadThrottled):
+            with throttle.limit(self.request):
+                pass
+
+    def test_concurrent_downloads(self):
+        throttle = DownloadThrottle({'link': Limits(1, 0, 0, 0)})
+        with throttle.limit(self.request, link_key='key1'):
+            with self.assertRaises(DownloadThrottled):
+                with throttle.limit(self.request, link_key='key1'):
+                    pass
+            with throttle.limit(self.request, link_key='key2'):
+                pass
+        with throttle.limit(self.request, link_key='key1'):
+            pass
+
+    def test_slot_is_held_until_response_is_closed(self):
+        throttle = DownloadThrottle({'ip': Limits(1, 0, 0, 0)})
+        response = StreamingHttpResponse(iter([b'data']))
+        with throttle.limit(self.request) as limit:
+            limit.attach(response)
+        with self.assertRaises(DownloadThrottled):
+            throttle.limit(self.request).acquire()
+        # Закрытие ответа вне обработчика запросов не должно трогать соединения с базой (как в тестовом клиенте Django)
+        request_finished.disconnect(close_old_connections)
+        try:
+            response.close()
+        finally:
+            request_finished.connect(close_old_connections)
+        with throttle.limit(self.request):
+            pass
+
+    def test_bandwidth(self):
+        throttle = DownloadThrottle({'user': Limits(0, 0, 0, 1000)})
+        user = CloudUser(pk=1)
+        limit = throttle.limit(self.request, user=user)
+        self.assertEqual(limit.bandwidth, 1000)
+        self.assertEqual(limit.consume(1000), 0)
+        self.assertAlmostEqual(limit.consume(500), 0.5, places=1)
+
+
+class ArchiveTests(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        response = self.client.post('/api/files/bulk/upload/', {
+            'files': [SimpleUploadedFile('a.txt', b'hello'), SimpleUploadedFile('b.jpg', b'image')],
+        })
+        self.ids = [result['id'] for result in response.data['results']]
+
+    def download(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        archive = zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+        return response, {info.filename: archive.read(info) for info in archive.infolist()}
+
+    def test_selected_files(self):
+        response, entries = self.download(f'/api/files/archive/?ids={self.ids[0]},{self.ids[1]}')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="files.zip"')
+        self.assertEqual(entries, {'a.txt': b'hello', 'b.jpg': b'image'})
+
+    def test_user_storage(self):
+        response, entries = self.download(f'/api/userfiles/{self.user.pk}/archive/')
+        self.assertEqual(response['Filename'], 'alice.zip')
+        self.assertEqual(set(entries), {'a.txt', 'b.jpg'})
+
+    def test_traversal_names_are_rejected(self):
+        for name in ('../../etc/evil.sh', 'dir/evil.sh', 'dir\\evil.sh', '..'):
+            response = self.client.patch(f'/api/files/{self.ids[0]}/', {'filename': name}, format='json')
+            self.assertEqual(response.status_code, 400, name)
+        self.assertEqual(File.objects.get(pk=self.ids[0]).filename, 'a.txt')
+
+    def test_stored_traversal_names_are_reduced_to_basename(self):
+        # Имена, сохранённые до проверки имён файлов
+        File.objects.filter(pk=self.ids[0]).update(filename='../../etc/evil.sh')
+        File.objects.filter(pk=self.ids[1]).update(filename='/tmp/evil.sh')
+        _, entries = self.download(f'/api/files/archive/?ids={self.ids[0]},{self.ids[1]}')
+        self.assertEqual(set(entries), {'evil.sh', 'evil (2).sh'})
+
+    def test_stream_zip_cleans_entry_names(self):
+        path = hot_storage.path('x')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as stream:
+            stream.write(b'x')
+        date = timezone.now()
+        entries = [(name, hot_storage, 'x', date, 1, '') for name in ('../a.txt', 'bob/../../a.txt', '..\\..\\b')]
+        archive = zipfile.ZipFile(io.BytesIO(b''.join(stream_zip(entries))))
+        self.assertEqual(archive.namelist(), ['a.txt', 'bob/a.txt', 'b'])
+
+
+class AsyncAuthenticationTests(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        verified_token_cache.clear()
+        self.factory = AsyncRequestFactory()
+
+    def get(self, view, path, authorization=None, **kwargs):
+        headers = {'Authorization': authorization} if authorization else {}
+        return async_to_sync(view.as_view())(self.factory.get(path, headers=headers), **kwargs)
+
+    @staticmethod
+    def basic(password):
+        return 'Basic ' + base64.b64encode(f'alice:{password}'.encode()).decode()
+
+    def test_credentials_are_required(self):
+        response = self.get(ChangesAsyncView, '/api/changes/')
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response['WWW-Authenticate'], 'Basic realm="api"')
+
+    def test_basic_authentication(self):
+        self.assertEqual(self.get(ChangesAsyncView, '/api/changes/', self.basic('Password1!')).status_code, 200)
+        response = self.get(ChangesAsyncView, '/api/changes/', self.basic('wrong'))
+        self.assertEqual(response.status_code, 401)
+        self.assertIn('WWW-Authenticate', response)
+
+    def test_token_authentication(self):
+        key = self.client.post('/api/tokens/', {'name': 'sync'}, format='json').data['key']
+        file = File.objects.create(cloud_user=self.user, filename='a.txt', size=3)
+        self.assertEqual(self.get(ChangesAsyncView, '/api/changes/', f'Token {key}').status_code, 200)
+        # Файла нет на диске, но права проверены
+        response = self.get(FileAsyncDownload, f'/api/files/{file.pk}/download/', f'Token {key}', pk=file.pk)
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(self.get(ChangesAsyncView, '/api/changes/', 'Token cld_wrong').status_code, 401)
+
+    def test_external_link_rejects_only_wrong_credentials(self):
+        response = self.get(FileAsyncExternalDownload, '/f/missing1', link_key='missing1')
+        self.assertEqual(response.status_code, 302)
+        response = self.get(FileAsyncExternalDownload, '/f/missing1', self.basic('wrong'), link_key='missing1')
+        self.assertEqual(response.status_code, 401)
+
+
+class DownloadStatsBufferTests(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.files = [File.objects.create(cloud_user=self.user, filename=name, size=10) for name in ('a', 'b', 'c')]
+        self.buffer = DownloadStatsBuffer(flush_interval=60, max_pending=1)
+        self.buffer.overflow_factor = 2
+        # Фоновый поток в тестах не запускается: буфер записывается вызовом flush
+        self.buffer.pid = os.getpid()
+
+    def test_downloads_are_aggregated(self):
+        first, second = timezone.now() - timedelta(hours=1), timezone.now()
+        self.buffer.record(self.files[0].pk, 10, second)
+        self.buffer.record(self.files[0].pk, 4, first)
+        self.buffer.record(self.files[1].pk, 10, first)
+        self.assertTrue(self.buffer.wakeup.is_set())
+        self.assertEqual(self.buffer.flush(), 2)
+        self.assertEqual(self.buffer.pending, {})
+        file = File.objects.get(pk=self.files[0].pk)
+        self.assertEqual((file.download_count, file.bytes_served, file.last_download), (2, 14, second))
+        self.assertEqual(File.objects.get(pk=self.files[1].pk).download_count, 1)
+
+    def test_new_files_beyond_limit_are_dropped(self):
+        for file in self.files:
+            self.buffer.record(file.pk, 10)
+        self.buffer.record(self.files[0].pk, 10)
+        self.assertEqual(set(self.buffer.pending), {self.files[0].pk, self.files[1].pk})
+        self.assertEqual(self.buffer.dropped, 1)
+        with self.assertLogs('main', 'WARNING'):
+            self.buffer.flush()
+        self.assertEqual(self.buffer.dropped, 0)
+        self.assertEqual(File.objects.get(pk=self.files[0].pk).download_count, 2)
+
+    def test_failed_flush_is_restored_within_limit(self):
+        for file in self.files[:2]:
+            self.buffer.record(file.pk, 10)
+        with mock.patch.object(QuerySet, 'update', side_effect=DatabaseError('нет соединения')), \
+                self.assertLogs('main', 'ERROR'):
+            self.buffer.flush()
+        self.assertEqual(len(self.buffer.pending), 2)
+        self.buffer.record(self.files[2].pk, 10)
+        self.assertEqual(self.buffer.dropped, 1)
+        self.buffer.flush()
+        self.assertEqual(File.objects.filter(download_count=1).count(), 2)
+
+    def test_thread_survives_errors(self):
+        buffer = DownloadStatsBuffer(flush_interval=0.01, max_pending=1)
+        survived = threading.Event()
+
+        def flush():
+            if not hasattr(flush, 'failed'):
+                flush.failed = True
+                raise RuntimeError('сбой')
+            # Повторный вызов показывает, что поток жив; дальше поток ждёт до конца процесса
+            survived.set()
+            threading.Event().wait()
+
+        buffer.flush = flush
+        with mock.patch('cloud_api.stats.connection'), self.assertLogs('main', 'ERROR') as logs:
+            thread = threading.Thread(target=buffer.run, daemon=True)
+            thread.start()
+            self.assertTrue(survived.wait(5))
+        self.assertTrue(thread.is_alive())
+        self.assertIn('RuntimeError', logs.output[0])
+
+
+class ShardedPathTests(SimpleTestCase):
+    def test_paths_are_sharded_by_key_prefix(self):
+        self.assertEqual(get_sharded_path('0123456789'), '01/23/0123456789')
+        self.assertEqual(get_blob_path('ab' * 32), f'{BLOB_DIR}/ab/ab/{"ab" * 32}')
+
+    def test_user_path_does_not_depend_on_filename(self):
+        file = File(cloud_user=CloudUser(username='alice'), filename='отчёт.pdf')
+        path = get_user_directory_path(file, 'отчёт.pdf')
+        username, first, second, key = path.split('/')
+        self.assertEqual(username, 'alice')
+        self.assertEqual((first, second), (key[:2], key[2:4]))
+        self.assertNotEqual(path, get_user_directory_path(file, 'отчёт.pdf'))
+
+
+class MigrateToBlobsTests(StorageTestCase):
+    def create_legacy_file(self, filename, data):
+        file = File.objects.create(cloud_user=self.user, filename=filename, size=len(data) if data else 1,
+                                   content=get_user_directory_path(File(cloud_user=self.user), filename))
+        if data is not None:
+            path = hot_storage.path(file.content.name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as stream:
+                stream.write(data)
+        return file
+
+    def migrate(self):
+        output = io.StringIO()
+        call_command('migrate_to_blobs', workers=1, batch_size=2, stdout=output)
+        return output.getvalue()
+
+    def test_files_are_moved_into_shared_blobs(self):
+        files = [self.create_legacy_file('a.txt', b'same'), self.create_legacy_file('b.txt', b'same'),
+                 self.create_legacy_file('c.txt', b'other'), self.create_legacy_file('lost.txt', None)]
+        output = self.migrate()
+        self.assertIn('Перенесено файлов: 3, не найдено на диске: 1, ошибок: 0', output)
+        a, b, c, lost = [File.objects.select_related('blob').get(pk=file.pk) for file in files]
+        self.assertEqual(a.blob_id, b.blob_id)
+        self.assertEqual(a.blob.ref_count, 2)
+        self.assertEqual(a.content.name, get_blob_path(a.blob_id))
+        with hot_storage.open(c.content.name) as stream:
+            self.assertEqual(stream.read(), b'other')
+        self.assertIsNone(lost.blob)
+        # Исходные файлы и опустевшие каталоги удалены, каталог пользователя остаётся
+        self.assertEqual(os.listdir(hot_storage.path('alice')), [])
+        self.assertIn('Перенесено файлов: 0, не найдено на диске: 1, ошибок: 0', self.migrate())
+
+
+class CompressionTests(StorageTestCase):
+    data = b'compressible line\n' * 1000
+
+    def setUp(self):
+        super().setUp()
+        for target in ('cloud_api.compression', 'cloud_api.uploadhandlers'):
+            patcher = mock.patch(f'{target}.STORAGE_ENCODING', 'gzip')
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def write(self, data):
+        path = get_temporary_path()
+        with open(path, 'wb') as stream:
+            stream.write(data)
+        self.addCleanup(remove_files, [path, path + '.gz'])
+        return path
+
+    def test_compress_file(self):
+        encoding, compressed_path = compress_file(self.write(self.data), len(self.data))
+        self.assertEqual((encoding, compressed_path[-3:]), ('gzip', '.gz'))
+        with open_content(open(compressed_path, 'rb'), encoding) as stream:
+            self.assertEqual(stream.read(), self.data)
+        self.assertEqual(get_content_encoding(compressed_path), 'gzip')
+
+    def test_incompressible_and_small_files_are_stored_as_is(self):
+        random_data = os.urandom(len(self.data))
+        self.assertIsNone(compress_file(self.write(random_data), len(random_data)))
+        self.assertIsNone(compress_file(self.write(b'tiny' * 10), 40))
+
+    def upload(self, name):
+        response = self.client.post('/api/files/upload/', {'cloud_user': self.user.pk,
+                                                           'content': SimpleUploadedFile(name, self.data)})
+        self.assertEqual(response.status_code, 201)
+        return File.objects.select_related('blob').get(pk=response.data['id'])
+
+    def assert_served(self, file):
+        self.assertEqual(file.blob.encoding, 'gzip')
+        self.assertLess(file.blob.stored_size, len(self.data))
+        response = self.client.get(f'/api/files/{file.pk}/download/', HTTP_ACCEPT_ENCODING='gzip, br')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), self.data)
+        response = self.client.get(f'/api/files/{file.pk}/download/', HTTP_RANGE='bytes=18-35')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(b''.join(response.streaming_content), self.data[18:36])
+
+    def test_content_is_compressed_on_store(self):
+        self.assert_served(self.upload('a.txt'))
+
+    def test_large_upload_is_compressed_while_received(self):
+        with self.settings(FILE_UPLOAD_MAX_MEMORY_SIZE=0):
+            file = self.upload('a.txt')
+        self.assert_served(file)
+        self.assertEqual(os.listdir(os.path.dirname(get_temporary_path())), [])
+
+
+class PreviewTests(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root, True)
+        patcher = mock.patch.multiple(preview_cache, root=root, written=None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @staticmethod
+    def image(size, mode='RGBA', image_format='PNG'):
+        output = io.BytesIO()
+        Image.new(mode, size, (200, 30, 30, 128) if mode == 'RGBA' else 'red').save(output, image_format)
+        return output.getvalue()
+
+    def upload(self, name, data):
+        response = self.client.post('/api/files/upload/', {'cloud_user': self.user.pk,
+                                                           'content': SimpleUploadedFile(name, data)})
+        self.assertEqual(response.status_code, 201)
+        return response.data['id']
+
+    def test_preview_is_rendered_and_cached(self):
+        pk = self.upload('photo.png', self.image((1024, 512)))
+        response = self.client.get(f'/api/files/{pk}/preview/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        with Image.open(io.BytesIO(b''.join(response.streaming_content))) as preview:
+            self.assertEqual((preview.format, preview.size), ('JPEG', (PREVIEW_SIZE, PREVIEW_SIZE // 2)))
+        etag = response['ETag']
+        response = self.client.get(f'/api/files/{pk}/preview/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        # Переименование меняет ключ миниатюры
+        self.client.patch(f'/api/files/{pk}/', {'filename': 'renamed.png'}, format='json')
+        response = self.client.get(f'/api/files/{pk}/preview/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        b''.join(response.streaming_content)
+
+    def test_unsupported_and_broken_files(self):
+        self.assertEqual(self.client.get(f'/api/files/{self.upload("a.txt", b"text")}/preview/').status_code, 415)
+        self.assertEqual(self.client.get(f'/api/files/{self.upload("b.png", b"broken")}/preview/').status_code, 415)
+        with self.assertRaises(PreviewUnavailable):
+            render_image(b'broken')
+
+    def test_cache_evicts_least_recently_used(self):
+        cache = PreviewCache(preview_cache.root, max_size=250)
+        for number, key in enumerate(('aaaa', 'bbbb', 'cccc')):
+            path = cache.put(key, b'x' * 100)
+            os.utime(path, (number, number))
+        self.assertIsNone(cache.get('aaaa'))
+        self.assertIsNotNone(cache.get('bbbb'))
+        self.assertIsNotNone(cache.get('cccc'))
+
+
+class SearchTests(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        for name, comment in [('Годовой отчёт.pdf', ''), ('report-2024.xlsx', 'квартал'),
+                              ('notes.txt', 'черновик: ОТЧЁТ за квартал')]:
+            self.client.post('/api/files/bulk/upload/', {'files': [SimpleUploadedFile(name, name.encode())],
+                                                         'comment': comment})
+        other_user = CloudUser.objects.create_user('bob', 'bob@example.com', 'Password1!', storage_directory='bob')
+        other_file = File.objects.create(cloud_user=other_user, filename='отчёт bob.pdf', size=1)
+        index_files([other_file])
+
+    def search(self, q, mode=None):
+        params = {'q': q, 'mode': mode} if mode else {'q': q}
+        response = self.client.get('/api/files/search/', params)
+        self.assertEqual(response.status_code, 200)
+        return [(result['filename'], result['rank']) for result in response.data['results']]
+
+    def test_trigrams(self):
+        self.assertEqual(get_trigrams('Ab_c'), {'  a', ' ab', 'ab ', '  c', ' c '})
+        self.assertEqual(get_trigrams('Отчёт', padded=False), {'отч', 'тчё', 'чёт'})
+
+    def test_substring_search_ranks_filename_above_comment(self):
+        self.assertEqual(self.search('отчёт'), [('Годовой отчёт.pdf', 1.0), ('notes.txt', COMMENT_WEIGHT)])
+        self.assertEqual(self.search('ОТ'), [('Годовой отчёт.pdf', 1.0), ('notes.txt', COMMENT_WEIGHT)])
+        self.assertEqual(self.search('2024'), [('report-2024.xlsx', 1.0)])
+        self.assertEqual(self.search('отчёт.pdf'), [('Годовой отчёт.pdf', 1.0)])
+
+    def test_prefix_search(self):
+        self.assertEqual(self.search('rep', 'prefix'), [('report-2024.xlsx', 1.0)])
+        self.assertEqual(self.search('кварт', 'prefix'), [('report-2024.xlsx', COMMENT_WEIGHT)])
+        self.assertEqual(self.search('port', 'prefix'), [])
+
+    def test_fuzzy_search(self):
+        self.assertEqual([name for name, _ in self.search('reports', 'fuzzy')], ['report-2024.xlsx'])
+        self.assertEqual(self.search('zzz', 'fuzzy'), [])
+
+    def test_rename_updates_index(self):
+        pk = File.objects.get(filename='notes.txt').pk
+        self.client.patch(f'/api/files/{pk}/', {'filename': 'отчёт 2.txt'}, format='json')
+        self.assertEqual([name for name, _ in self.search('отчёт')], ['отчёт 2.txt', 'Годовой отчёт.pdf'])
+        self.assertEqual(self.search('notes'), [])
+
+    def test_invalid_parameters(self):
+        self.assertEqual(self.client.get('/api/files/search/', {'q': ' '}).status_code, 400)
+        self.assertEqual(self.client.get('/api/files/search/', {'q': 'a', 'mode': 'regex'}).status_code, 400)
+
+
+class ScrubberTests(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        response = self.client.post('/api/files/bulk/upload/', {
+            'files': [SimpleUploadedFile('a.txt', b'hello'), SimpleUploadedFile('b.txt', b'world!')],
+        })
+        self.files = list(File.objects.select_related('blob').filter(
+            pk__in=[result['id'] for result in response.data['results']]).order_by('pk'))
+
+    def scrub(self, repair=False):
+        scrubber = Scrubber(repair=repair, grace=0)
+        findings = []
+        for batch in scrubber.get_blob_batches():
+            findings.extend(scrubber.check_blobs(batch))
+        for batch in scrubber.get_file_batches():
+            findings.extend(scrubber.check_files(batch))
+        for unit in scrubber.get_directories():
+            findings.extend(scrubber.check_directory(unit))
+        return [(finding['kind'], finding['target'], finding['repaired']) for finding in findings]
+
+    @staticmethod
+    def write(storage, name, data):
+        path = storage.path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as stream:
+            stream.write(data)
+
+    def test_consistent_storage(self):
+        self.assertEqual(self.scrub(), [])
+
+    def test_ref_count_is_repaired(self):
+        blob = self.files[0].blob
+        Blob.objects.filter(pk=blob.pk).update(ref_count=3)
+        self.assertEqual(self.scrub(repair=True), [(REF_COUNT, f'blob:{blob.pk}', True)])
+        self.assertEqual(Blob.objects.get(pk=blob.pk).ref_count, 1)
+        self.assertEqual(self.scrub(), [])
+
+    def test_missing_content_is_reported(self):
+        blob = self.files[0].blob
+        hot_storage.delete([blob.name])
+        self.assertEqual(self.scrub(repair=True), [(MISSING, f'blob:{blob.pk}', False)])
+
+    def test_unreferenced_content_is_released(self):
+        blob = self.files[0].blob
+        File.objects.filter(pk=self.files[0].pk).delete()
+        with self.captureOnCommitCallbacks(execute=True):
+            findings = self.scrub(repair=True)
+        self.assertIn((UNREFERENCED, f'blob:{blob.pk}', True), findings)
+        self.assertFalse(Blob.objects.filter(pk=blob.pk).exists())
+        self.assertFalse(hot_storage.exists(blob.name))
+
+    def test_orphans_are_quarantined(self):
+        name = get_blob_path('f' * 64)
+        self.write(hot_storage, name, b'lost')
+        self.write(hot_storage, 'alice/ab/cd/abcd', b'lost')
+        self.assertEqual(sorted(self.scrub(repair=True)), [(ORPHAN, f'hot:{name}', True),
+                                                           (ORPHAN, 'hot:alice/ab/cd/abcd', True)])
+        self.assertTrue(hot_storage.exists(f'{BLOB_DIR}/{ORPHANS_DIR}/{name}'))
+        self.assertTrue(hot_storage.exists(f'{BLOB_DIR}/{ORPHANS_DIR}/alice/ab/cd/abcd'))
+        self.assertEqual(self.scrub(), [])
+
+    def test_stale_cold_copy_is_removed(self):
+        blob = self.files[1].blob
+        self.write(cold_storage, blob.name, b'world!')
+        self.assertEqual(self.scrub(repair=True), [(STALE_COPY, f'cold:{blob.name}', True)])
+        self.assertFalse(cold_storage.exists(blob.name))
+        self.assertTrue(hot_storage.exists(blob.name))
+
+    def test_legacy_file_size_is_repaired(self):
+        file = File.objects.create(cloud_user=self.user, filename='c.txt', size=2, content='alice/c1/c2/c1c2')
+        CloudUser.change_usage(self.user.pk, 2, 1)
+        self.write(hot_storage, file.content.name, b'12345')
+        self.assertEqual(self.scrub(repair=True), [(SIZE_MISMATCH, f'file:{file.pk}', True)])
+        self.assertEqual(File.objects.get(pk=file.pk).size, 5)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.storage_used, 16)
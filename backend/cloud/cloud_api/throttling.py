@@ -0,0 +1,242 @@
+import math
+import time
+import asyncio
+import logging
+import threading
+from collections import namedtuple
+
+from django.core.cache import caches
+from rest_framework.throttling import BaseThrottle
+
+from cloud.settings import DOWNLOAD_USER_CONCURRENCY, DOWNLOAD_USER_RATE, DOWNLOAD_USER_BURST, \
+    DOWNLOAD_USER_BANDWIDTH, DOWNLOAD_LINK_CONCURRENCY, DOWNLOAD_LINK_RATE, DOWNLOAD_LINK_BURST, \
+    DOWNLOAD_LINK_BANDWIDTH, DOWNLOAD_IP_CONCURRENCY, DOWNLOAD_IP_RATE, DOWNLOAD_IP_BURST, DOWNLOAD_IP_BANDWIDTH, \
+    DOWNLOAD_SLOT_TTL
+from .exceptions import DownloadThrottled
+
+logger = logging.getLogger('main')
+
+# Ограничения одной области: одновременные скачивания, частота запросов (в секунду), всплеск запросов
+# и скорость отдачи (байт/с). Нулевое значение снимает ограничение
+Limits = namedtuple('Limits', ['concurrency', 'rate', 'burst', 'bandwidth'])
+
+DOWNLOAD_LIMITS = {
+    'user': Limits(DOWNLOAD_USER_CONCURRENCY, DOWNLOAD_USER_RATE, DOWNLOAD_USER_BURST, DOWNLOAD_USER_BANDWIDTH),
+    'link': Limits(DOWNLOAD_LINK_CONCURRENCY, DOWNLOAD_LINK_RATE, DOWNLOAD_LINK_BURST, DOWNLOAD_LINK_BANDWIDTH),
+    'ip': Limits(DOWNLOAD_IP_CONCURRENCY, DOWNLOAD_IP_RATE, DOWNLOAD_IP_BURST, DOWNLOAD_IP_BANDWIDTH),
+}
+
+# Через сколько секунд предлагается повторить запрос, отклонённый из-за числа одновременных скачиваний
+CONCURRENCY_RETRY_AFTER = 5
+# Сколько секунд запись ведра токенов живёт в кеше сверх времени его наполнения
+BUCKET_TTL_MARGIN = 60
+
+
+def get_throttle_cache():
+    # Подключения к кешу у каждого потока свои, поэтому кеш берётся при каждом обращении, а не один раз
+    return caches['throttle']
+
+
+class TokenBucket:
+    """
+    Ведро токенов в общем кеше (в форме GCRA): в кеше хранится одно число — момент в микросекундах,
+    к которому ведро наполнится снова. Взятие токенов сдвигает этот момент атомарным incr,
+    поэтому ведро можно делить между процессами сервера без блокировок
+    """
+    def __init__(self, rate, burst):
+        # Время наполнения одного токена и всего ведра (мкс)
+        self.interval = 10 ** 6 / rate
+        self.capacity = max(burst, 1) * self.interval
+        self.timeout = math.ceil(self.capacity / 10 ** 6) + BUCKET_TTL_MARGIN
+
+    def take(self, key, amount=1, debt=False):
+        """
+        Берёт amount токенов. Возвращает 0, если токенов хватило, иначе время (сек.) до их появления.
+        Без debt недостающие токены не берутся. С debt токены берутся в долг, а возвращённое время —
+        пауза, которую нужно выдержать, чтобы не превысить скорость
+        """
+        cache = get_throttle_cache()
+        now = int(time.time() * 10 ** 6)
+        cost = round(amount * self.interval)
+        try:
+            ready = cache.incr(key, cost)
+        except ValueError:
+            ready = None
+        if ready is None or ready < now + cost:
+            # Ведро было полным: отсчёт начинается заново от текущего момента
+            ready = now + cost
+            cache.set(key, ready, self.timeout)
+        excess = ready - now - self.capacity
+        if excess <= 0:
+            return 0
+        if not debt:
+            try:
+                cache.decr(key, cost)
+            except ValueError:
+                pass
+        return excess / 10 ** 6
+
+
+class DownloadThrottle:
+    """
+    Ограничения скачивания файлов по областям: пользователь, внешняя ссылка и адрес клиента.
+    Состояние ограничений хранится в кеше 'throttle' и при общем бэкенде действует во всех процессах сервера
+    """
+    def __init__(self, limits):
+        self.configure(limits)
+
+    def configure(self, limits):
+        self.limits = limits
+        self.request_buckets = {scope: TokenBucket(item.rate, item.burst)
+                                for scope, item in limits.items() if item.rate}
+        # Скачивание может передать без пауз объём, отдаваемый за секунду
+        self.bandwidth_buckets = {scope: TokenBucket(item.bandwidth, item.bandwidth)
+                                  for scope, item in limits.items() if item.bandwidth}
+
+    def limit(self, request, user=None, link_key=None):
+        """
+        Возвращает ограничения скачивания для запроса. Области — пользователь (если он вошёл в систему),
+        внешняя ссылка (если скачивание идёт по ней) и адрес клиента
+        """
+        scopes = []
+        if user is not None and user.is_authenticated:
+            scopes.append(('user', str(user.pk)))
+        if link_key:
+            scopes.append(('link', link_key))
+        scopes.append(('ip', BaseThrottle().get_ident(request)))
+        return DownloadLimit(self, scopes)
+
+    def take_slot(self, key, limit):
+        """
+        Занимает место в счётчике одновременных скачиваний, если он не достиг limit
+        """
+        cache = get_throttle_cache()
+        cache.add(key, 0, DOWNLOAD_SLOT_TTL)
+        try:
+            count = cache.incr(key)
+        except ValueError:
+            # Запись вытеснена из кеша между add и incr
+            cache.set(key, 1, DOWNLOAD_SLOT_TTL)
+            count = 1
+        if count > limit:
+            self.free_slot(key)
+            return False
+        cache.touch(key, DOWNLOAD_SLOT_TTL)
+        return True
+
+    def free_slot(self, key):
+        try:
+            get_throttle_cache().decr(key)
+        except ValueError:
+            pass
+
+
+class DownloadLimit:
+    """
+    Ограничения одного скачивания. При входе в блок with проверяется частота запросов и занимаются места
+    в счётчиках одновременных скачиваний (при превышении выбрасывается DownloadThrottled).
+    Места освобождаются при выходе из блока, а если ответ передан в attach — после закрытия ответа
+    """
+    def __init__(self, throttle, scopes):
+        self.throttle = throttle
+        self.scopes = scopes
+        self.slots = []
+        self.attached = False
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        if not self.attached:
+            self.release()
+
+    async def __aenter__(self):
+        await asyncio.to_thread(self.acquire)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        if not self.attached:
+            await asyncio.to_thread(self.release)
+
+    def acquire(self):
+        for scope, ident in self.scopes:
+            bucket = self.throttle.request_buckets.get(scope)
+            wait = bucket.take(f'throttle:rate:{scope}:{ident}') if bucket else 0
+            if wait:
+                self.reject(scope, ident, 'rate', wait)
+        for scope, ident in self.scopes:
+            limits = self.throttle.limits.get(scope)
+            if not (limits and limits.concurrency):
+                continue
+            key = f'throttle:slots:{scope}:{ident}'
+            if not self.throttle.take_slot(key, limits.concurrency):
+                self.release()
+                self.reject(scope, ident, 'concurrency', CONCURRENCY_RETRY_AFTER)
+            self.slots.append(key)
+
+    def release(self):
+        # Ответ может закрываться из другого потока, поэтому места освобождаются ровно один раз
+        with self.lock:
+            slots, self.slots = self.slots, []
+        for key in slots:
+            self.throttle.free_slot(key)
+
+    @staticmethod
+    def reject(scope, ident, reason, wait):
+        logger.warning('Скачивание отклонено: превышено ограничение %s для %s %s', reason, scope, ident,
+                       extra={'event': 'throttle', 'scope': scope, 'ident': ident, 'reason': reason,
+                              'retry_after': math.ceil(wait)})
+        raise DownloadThrottled(wait)
+
+    @property
+    def bandwidth(self):
+        # Наименьшая из скоростей отдачи областей скачивания (0 — без ограничения)
+        return min((self.throttle.limits[scope].bandwidth for scope, _ in self.scopes
+                    if scope in self.throttle.bandwidth_buckets), default=0)
+
+    def consume(self, size):
+        """
+        Учитывает size отданных байт во всех ограничениях скорости. Возвращает паузу (сек.) перед следующей отдачей
+        """
+        return max((self.throttle.bandwidth_buckets[scope].take(f'throttle:bandwidth:{scope}:{ident}', size, True)
+                    for scope, ident in self.scopes if scope in self.throttle.bandwidth_buckets), default=0)
+
+    def attach(self, response):
+        """
+        Переносит ограничения на ответ: тело потокового ответа отдаётся не быстрее разрешённой скорости,
+        а места в счётчиках освобождаются при закрытии ответа. Файлы, которые отдаёт фронт-прокси
+        или хранилище по подписанной ссылке, в счётчиках не удерживаются; nginx ограничивает их скорость сам
+        """
+        self.attached = True
+        bandwidth = self.bandwidth
+        if bandwidth and response.streaming:
+            if response.is_async:
+                response.streaming_content = athrottle_bytes(response.streaming_content, self)
+            else:
+                response.streaming_content = throttle_bytes(response.streaming_content, self)
+        elif bandwidth and response.has_header('X-Accel-Redirect'):
+            response['X-Accel-Limit-Rate'] = bandwidth
+        # Django закрывает ответ после передачи тела или обрыва соединения, даже если тело не начинало читаться
+        response._resource_closers.append(self.release)
+        return response
+
+
+def throttle_bytes(content, limit):
+    for chunk in content:
+        wait = limit.consume(len(chunk))
+        if wait:
+            time.sleep(wait)
+        yield chunk
+
+
+async def athrottle_bytes(content, limit):
+    async for chunk in content:
+        wait = await asyncio.to_thread(limit.consume, len(chunk))
+        if wait:
+            await asyncio.sleep(wait)
+        yield chunk
+
+
+download_throttle = DownloadThrottle(DOWNLOAD_LIMITS)
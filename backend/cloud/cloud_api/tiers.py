@@ -0,0 +1,89 @@
+import logging
+
+from django.db import transaction
+from django.db.models import Q
+
+from .models import Blob, File
+from .storage import cold_storage, hot_storage
+
+logger = logging.getLogger('main')
+
+
+def recently_used(since):
+    """
+    Условие для файлов, которые скачивали (а если не скачивали — загрузили) не раньше since
+    """
+    return Q(last_download__gte=since) | Q(last_download__isnull=True, date_uploaded__gte=since)
+
+
+def lock_content(file):
+    """
+    Блокирует содержимое файла и возвращает все записи, ссылающиеся на него.
+    У файлов из хранилища содержимого уровень хранения общий для всех ссылок
+    """
+    if file.blob_id:
+        Blob.objects.select_for_update().filter(pk=file.blob_id).exists()
+        return File.objects.filter(blob_id=file.blob_id)
+    File.objects.select_for_update().filter(pk=file.pk).exists()
+    return File.objects.filter(pk=file.pk)
+
+
+def demote(file, since):
+    """
+    Переносит содержимое файла на холодный уровень, если ни один ссылающийся на него файл
+    не использовался после since. Возвращает True, если содержимое перенесено
+    """
+    with transaction.atomic():
+        files = lock_content(file)
+        if files.filter(recently_used(since)).exists() or not files.filter(tier=File.HOT).exists():
+            return False
+        name = file.content.name
+        if hot_storage.exists(name):
+            hot_storage.copy(name, cold_storage)
+        elif not cold_storage.exists(name):
+            logger.error(f'Файл отсутствует по пути {file.content}')
+            return False
+        files.update(tier=File.COLD)
+        # Файл с основного уровня удаляется после фиксации: начатые скачивания дочитывают открытый файл
+        transaction.on_commit(lambda: hot_storage.delete([name]))
+    return True
+
+
+def promote(file):
+    """
+    Возвращает содержимое файла с холодного уровня на основной и отмечает это во всех ссылающихся записях.
+    Возвращает False, если содержимого нет ни на одном уровне
+    """
+    with transaction.atomic():
+        files = lock_content(file)
+        # Файл мог быть уже поднят параллельным запросом
+        if files.filter(tier=File.COLD).exists():
+            name = file.content.name
+            if not hot_storage.exists(name):
+                try:
+                    cold_storage.copy(name, hot_storage)
+                except FileNotFoundError:
+                    logger.error(f'Файл отсутствует на холодном уровне хранения по пути {file.content}')
+                    return False
+            files.update(tier=File.HOT)
+            transaction.on_commit(lambda: cold_storage.delete([name]))
+            logger.info(f'Файл {file.content} возвращён с холодного уровня хранения')
+    file.tier = File.HOT
+    return True
+
+
+def get_download_storage(file):
+    """
+    Возвращает хранилище, из которого отдаётся файл, при необходимости поднимая его с холодного уровня.
+    Если содержимого нет ни там, ни после перечитывания записи, возвращает None
+    """
+    if file.tier == File.COLD:
+        promote(file)
+    if not file.storage.exists(file.content.name):
+        # Файл мог быть перенесён в хранилище содержимого или на холодный уровень после чтения записи
+        file.refresh_from_db(fields=['content', 'blob', 'tier'])
+        if file.tier == File.COLD:
+            promote(file)
+        if not file.storage.exists(file.content.name):
+            return None
+    return file.storage
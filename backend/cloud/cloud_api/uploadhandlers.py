@@ -0,0 +1,90 @@
+import hashlib
+
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from django.core.files.uploadhandler import MemoryFileUploadHandler, TemporaryFileUploadHandler
+
+from .compression import STORAGE_ENCODING, get_compressor, is_compressible, is_worth_storing
+
+
+class HashingUploadMixin:
+    """
+    Считает SHA-256 файла по мере приёма фрагментов и сохраняет его в атрибуте sha256 загруженного файла
+    """
+    def new_file(self, *args, **kwargs):
+        self.sha256 = hashlib.sha256()
+        super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        self.sha256.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        if file is not None:
+            file.sha256 = self.sha256.hexdigest()
+        return file
+
+
+class HashingMemoryFileUploadHandler(HashingUploadMixin, MemoryFileUploadHandler):
+    """
+    Обработчик небольших файлов, которые целиком помещаются в памяти
+    """
+    def receive_data_chunk(self, raw_data, start):
+        # Если файл слишком велик для памяти, данные принимает и хеширует следующий обработчик
+        if not self.activated:
+            return raw_data
+        return super().receive_data_chunk(raw_data, start)
+
+
+class CompressibleTemporaryUploadedFile(TemporaryUploadedFile):
+    """
+    Временный файл загрузки, рядом с которым может лежать его сжатая копия.
+    Сжатая копия удаляется вместе с файлом, если её не перенесли в хранилище
+    """
+    encoding = ''
+    compressed_file = None
+
+    def close(self):
+        if self.compressed_file is not None:
+            self.compressed_file.close()
+        return super().close()
+
+
+class HashingTemporaryFileUploadHandler(HashingUploadMixin, TemporaryFileUploadHandler):
+    """
+    Обработчик больших файлов, которые записываются во временный файл.
+    Если включено сжатие и начало файла хорошо сжимается, параллельно пишется сжатая копия
+    """
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        # Заменяем созданный базовым обработчиком временный файл на файл, знающий о сжатой копии
+        self.file.close()
+        self.file = CompressibleTemporaryUploadedFile(self.file_name, self.content_type, 0, self.charset,
+                                                      self.content_type_extra)
+        self.compressor = None
+        self.compressed_file = None
+
+    def receive_data_chunk(self, raw_data, start):
+        if start == 0 and STORAGE_ENCODING and is_compressible(raw_data):
+            self.compressor = get_compressor(STORAGE_ENCODING)
+            self.compressed_file = TemporaryUploadedFile(self.file_name, 'application/octet-stream', 0, None)
+        if self.compressor is not None:
+            self.compressed_file.write(self.compressor.compress(raw_data))
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        if self.compressor is not None:
+            self.compressed_file.write(self.compressor.flush())
+            self.compressed_file.flush()
+            if is_worth_storing(file_size, self.compressed_file.tell()):
+                file.encoding = STORAGE_ENCODING
+                file.compressed_file = self.compressed_file
+            else:
+                self.compressed_file.close()
+        return file
+
+    def upload_interrupted(self):
+        if self.compressed_file is not None:
+            self.compressed_file.close()
+        super().upload_interrupted()
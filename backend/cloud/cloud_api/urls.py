@@ -1,8 +1,18 @@
 from django.urls import path
 
+from cloud.settings import ASYNC_DOWNLOADS
 from .views import CloudUserAPICreate, CloudUserAPIList, CloudUserAPIRetrieveUpdateDestroy, FileAPICreate, \
     FileAPIRetrieveUpdateDestroy, FileAPIDownload, FileAPICreateExternalLink, FileAPIExternalDownload, UserLoginAPIView, \
-    UserLogoutAPIView, SessionView, CSRFTokenView, UserFilesAPIRetrieve
+    UserLogoutAPIView, SessionView, CSRFTokenView, UserFilesAPIRetrieve, UploadSessionAPICreate, UploadSessionAPIDetail, \
+    FileAPIList, FileAsyncDownload, FileAsyncExternalDownload, FileAPIBulkUpload, FileAPIBulkDelete, FileAPIBulkUpdate, \
+    FileAPIArchive, UserFilesAPIArchive, JobAPIRetrieve, StorageCleanupAPIView, FilePreviewAPIView, \
+    FileSearchAPIList, ApiTokenAPIListCreate, ApiTokenAPIRetrieveDestroy, MetricsAPIView, ChangesAPIView, ChangesAsyncView
+
+# Под ASGI скачивание обслуживают асинхронные представления
+DownloadView = FileAsyncDownload if ASYNC_DOWNLOADS else FileAPIDownload
+ExternalDownloadView = FileAsyncExternalDownload if ASYNC_DOWNLOADS else FileAPIExternalDownload
+# Под ASGI длинный опрос изменений не занимает поток на время ожидания
+ChangesView = ChangesAsyncView if ASYNC_DOWNLOADS else ChangesAPIView
 
 urlpatterns = [
     path('api/login/', UserLoginAPIView.as_view()),
@@ -15,10 +25,29 @@ urlpatterns = [
     path('api/users/<int:pk>/', CloudUserAPIRetrieveUpdateDestroy.as_view()),
 
     path('api/userfiles/<int:pk>/', UserFilesAPIRetrieve.as_view()),
+    path('api/userfiles/<int:pk>/archive/', UserFilesAPIArchive.as_view()),
+    path('api/files/', FileAPIList.as_view()),
+    path('api/changes/', ChangesView.as_view()),
+    path('api/files/search/', FileSearchAPIList.as_view()),
     path('api/files/upload/', FileAPICreate.as_view()),
+    path('api/files/uploads/', UploadSessionAPICreate.as_view()),
+    path('api/files/uploads/<uuid:pk>/', UploadSessionAPIDetail.as_view()),
+    path('api/files/bulk/upload/', FileAPIBulkUpload.as_view()),
+    path('api/files/bulk/delete/', FileAPIBulkDelete.as_view()),
+    path('api/files/bulk/update/', FileAPIBulkUpdate.as_view()),
+    path('api/files/archive/', FileAPIArchive.as_view()),
     path('api/files/<int:pk>/', FileAPIRetrieveUpdateDestroy.as_view()),
-    path('api/files/<int:pk>/download/', FileAPIDownload.as_view()),
+    path('api/files/<int:pk>/download/', DownloadView.as_view()),
+    path('api/files/<int:pk>/preview/', FilePreviewAPIView.as_view()),
     path('api/files/<int:pk>/generatelink/', FileAPICreateExternalLink.as_view()),
 
-    path('f/<str:link_key>', FileAPIExternalDownload.as_view()),
+    path('api/tokens/', ApiTokenAPIListCreate.as_view()),
+    path('api/tokens/<int:pk>/', ApiTokenAPIRetrieveDestroy.as_view()),
+
+    path('api/jobs/<uuid:pk>/', JobAPIRetrieve.as_view()),
+    path('api/jobs/cleanup/', StorageCleanupAPIView.as_view()),
+
+    path('api/metrics/', MetricsAPIView.as_view()),
+
+    path('f/<str:link_key>', ExternalDownloadView.as_view()),
 ]
@@ -1,15 +1,67 @@
-import random
+import os
+import uuid
+import hashlib
+import secrets
 import string
 
+from cloud.settings import BLOB_DIR
+
+def get_sharded_path(key):
+    """
+    Раскладывает файлы по двум уровням подкаталогов по префиксу ключа,
+    чтобы ни в одном каталоге не скапливались десятки тысяч файлов
+    """
+    return f'{key[:2]}/{key[2:4]}/{key}'
+
 def get_user_directory_path(instance, filename):
     """
-    Определяет путь к файлу при его сохранении
+    Определяет путь к файлу при его сохранении.
+    Путь строится по случайному идентификатору и не зависит от имени файла, поэтому при переименовании файл не переносится
+    """
+    return f'{instance.cloud_user.username}/{get_sharded_path(uuid.uuid4().hex)}'
+
+def get_blob_path(sha256):
+    """
+    Определяет путь к содержимому файла по его хешу
+    """
+    return f'{BLOB_DIR}/{get_sharded_path(sha256)}'
+
+def get_file_sha256(path, chunk_size=1024 * 1024):
+    """
+    Считает SHA-256 файла, читая его блоками
+    """
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as stream:
+        for chunk in iter(lambda: stream.read(chunk_size), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+def remove_files(paths):
+    """
+    Удаляет файлы, пропуская уже отсутствующие
+    """
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+def encode_base62(number):
+    """
+    Записывает неотрицательное число символами из цифр и латинских букв
     """
-    return f'{instance.cloud_user.username}/{filename}'
+    characters = string.digits + string.ascii_letters
+    encoded = ''
+    while True:
+        number, remainder = divmod(number, len(characters))
+        encoded = characters[remainder] + encoded
+        if not number:
+            return encoded
 
-def generate_external_link_key():
+def generate_external_link_key(file_id, secret_length=8):
     """
-    Генерирует ключ из символов и цифр
+    Генерирует ключ внешней ссылки: идентификатор файла в base62 и случайная часть фиксированной длины.
+    Ключи разных файлов не могут совпасть, поэтому проверять уникальность в базе не нужно
     """
     characters = string.ascii_letters + string.digits
-    return ''.join(random.choice(characters) for i in range(6))
+    return encode_base62(file_id) + ''.join(secrets.choice(characters) for i in range(secret_length))
@@ -5,41 +5,93 @@ UserLogoutAPIView: Это представление REST API для выход
 SessionView: Это представление REST API для проверки сеанса пользователя. Оно возвращает информацию о текущем пользователе и его статусе аутентификации.
 CSRFTokenView: Это представление REST API для получения токена CSRF. Оно возвращает токен CSRF для защиты от межсайтовой подделки запросов (CSRF).
 CloudUserAPIRetrieveUpdateDestroy: Это представление REST API для просмотра, обновления и удаления пользователей. Оно позволяет только администраторам просматривать, обновлять и удалять пользователей.
-CloudUserAPIList: Это представление REST API для просмотра списка пользователей. Оно возвращает список всех пользователей в системе.
+CloudUserAPIList: Это представление REST API для просмотра списка пользователей. Оно возвращает список всех пользователей в системе с количеством и общим размером их файлов.
 FileAPICreate: Это представление REST API для загрузки нового файла. Оно принимает POST-запрос с данными файла и сохраняет его в базе данных.
 FileAPIRetrieveUpdateDestroy: Это представление REST API для просмотра, обновления и удаления файлов. Оно позволяет пользователям просматривать, обновлять и удалять только свои собственные файлы.
+FileAPIBulkUpload: Это представление REST API для загрузки нескольких файлов одним запросом.
+FileAPIBulkDelete: Это представление REST API для удаления файлов по списку идентификаторов.
+FileAPIBulkUpdate: Это представление REST API для изменения имён и комментариев нескольких файлов.
 UserFilesAPIRetrieve: Это представление REST API для просмотра файлов, принадлежащих определенному пользователю.
-FileAPIDownload: Это представление REST API для скачивания файла. Оно возвращает запрошенный файл для скачивания.
-FileAPIExternalDownload: Это представление REST API для скачивания файла по внешней ссылке. Оно возвращает запрошенный файл для скачивания по его внешнему ключу.
+FileAPIList: Это представление REST API для постраничного просмотра файлов пользователя с сортировкой и фильтрацией по имени, размеру и дате загрузки.
+FileSearchAPIList: Это представление REST API для поиска файлов пользователя по имени и комментарию (по началу строки, подстроке или нечёткому совпадению) с ранжированием результатов.
+FileAPIArchive: Это представление REST API для скачивания выбранных файлов одним ZIP-архивом, формируемым на лету.
+UserFilesAPIArchive: Это представление REST API для скачивания всего хранилища пользователя одним ZIP-архивом.
+FileAPIDownload: Это представление REST API для скачивания файла. Оно возвращает запрошенный файл для скачивания, поддерживает частичную (Range) и условную отдачу, а при хранении в S3 перенаправляет на подписанную ссылку.
+FileAPIExternalDownload: Это представление REST API для скачивания файла по внешней ссылке. Оно возвращает запрошенный файл для скачивания по его внешнему ключу. Число скачиваний и скорость отдачи ограничены для ссылки и адреса клиента.
+FileAsyncDownload: Это асинхронное представление для скачивания файла под ASGI. Файл читается блоками без блокировки потока на всё время передачи.
+FileAsyncExternalDownload: Это асинхронное представление для скачивания файла по внешней ссылке под ASGI.
+FilePreviewAPIView: Это представление REST API для получения миниатюры изображения или документа. Миниатюра строится при первом запросе и кешируется на диске.
 FileAPICreateExternalLink: Это представление REST API для создания внешней ссылки на файл. Оно генерирует уникальный внешний ключ и связывает его с запрошенным файлом.
+UploadSessionAPICreate: Это представление REST API для создания сессии возобновляемой загрузки. Оно принимает имя и полный размер файла и возвращает адрес сессии.
+UploadSessionAPIDetail: Это представление REST API для работы с сессией возобновляемой загрузки. HEAD возвращает текущее смещение, PATCH дописывает фрагмент, DELETE отменяет загрузку.
+JobAPIRetrieve: Это представление REST API для проверки состояния фоновой задачи (удаление пользователя, пакетное удаление файлов, очистка хранилища).
+StorageCleanupAPIView: Это представление REST API для постановки в очередь очистки хранилища. Оно доступно только администраторам.
+ApiTokenAPIListCreate: Это представление REST API для выпуска и просмотра API-токенов пользователя. Сам токен возвращается только при выпуске.
+ApiTokenAPIRetrieveDestroy: Это представление REST API для просмотра и отзыва API-токена.
+ChangesAPIView: Это представление REST API для получения изменений файлов пользователя после курсора клиента синхронизации. Поддерживает длинный опрос.
+ChangesAsyncView: Это асинхронное представление для длинного опроса изменений под ASGI: ожидание не занимает поток.
+MetricsAPIView: Это представление REST API для выгрузки метрик запросов процесса в формате Prometheus. Оно доступно только администраторам.
 '''
 
-import os
+import re
 import logging
 
+from asgiref.sync import sync_to_async
 from django.contrib.auth import authenticate, login, logout
 from django.core.exceptions import ObjectDoesNotExist
+from django.db import IntegrityError, transaction
+from django.utils.dateparse import parse_datetime
+from django.views import View
 from django.contrib.auth.hashers import make_password
-from django.http import FileResponse
+from django.http import FileResponse, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.middleware.csrf import get_token
 from django.shortcuts import redirect
-from django.utils import timezone
-from rest_framework import generics, status
-from rest_framework.authentication import SessionAuthentication
-from rest_framework.exceptions import NotFound
+from django.utils.cache import get_conditional_response
+from rest_framework import filters, generics, status
+from rest_framework.authentication import BasicAuthentication, SessionAuthentication
+from rest_framework.exceptions import APIException, AuthenticationFailed, NotAuthenticated, NotFound, PermissionDenied
 from rest_framework.exceptions import ValidationError
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.request import Request
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 from rest_framework.views import APIView
 
-from cloud.settings import MEDIA_ROOT
-from .models import CloudUser, File
+from cloud.settings import PREVIEW_TIMEOUT, CHANGES_PAGE_SIZE, CHANGES_MAX_WAIT, CHANGES_SYNC_MAX_WAIT
+
+from .models import ApiToken, CloudUser, Blob, File, FileChange, Job, UploadSession
+from .archives import safe_basename, stream_zip
+from .authentication import forget_user, generate_api_token
+from .caches import external_link_cache, resolve_external_link, aresolve_external_link, get_external_link_storage
+from .changes import ChangesCompacted, await_changes, get_changes, get_sequence, record_changes, remember_client, \
+    wait_for_changes
+from .downloads import build_file_response, abuild_file_response
+from .exceptions import DownloadThrottled, QuotaExceeded
+from .jobs import enqueue
+from .metrics import metrics_registry
+from .pagination import FileCursorPagination, FileSearchPagination
 from .permissions import IsAdmin, IsAdminOrUser, IsAdminOrFileOwner
-from .serializers import CloudUserSerializer, FileSerializer, CloudUsersDetailSerializer
-from .utils import generate_external_link_key
+from .previews import PreviewUnavailable, get_preview_key, get_preview_path, preview_cache
+from .search import MODES, SUBSTRING, index_files, search_files
+from .serializers import CloudUserSerializer, FileSerializer, CloudUsersDetailSerializer, CloudUserListSerializer, \
+    CloudUserAdminSerializer, UploadSessionSerializer, FileBulkUploadSerializer, FileBulkDeleteSerializer, \
+    FileBulkUpdateSerializer, JobSerializer, ApiTokenSerializer, FileSearchResultSerializer, FileChangeSerializer
+from .stats import download_stats
+from .throttling import download_throttle
+from .tiers import get_download_storage
+from .utils import generate_external_link_key, remove_files
 
 logger = logging.getLogger('main')
 
+
+def job_response(job):
+    """
+    Формирует ответ 202 с данными поставленной в очередь задачи и адресом для проверки её состояния
+    """
+    return Response(JobSerializer(job).data, status=status.HTTP_202_ACCEPTED,
+                    headers={'Location': f'/api/jobs/{job.pk}/'})
+
+
 class CloudUserAPICreate(generics.CreateAPIView):
     queryset = CloudUser.objects.all()
     serializer_class = CloudUserSerializer
@@ -48,7 +100,7 @@ class CloudUserAPICreate(generics.CreateAPIView):
         username = serializer.validated_data['username']
         password = make_password(serializer.validated_data['password'])
         serializer.save(storage_directory=username, password=password, is_staff=True, is_active=True)
-        logger.info(f'Зарегистрирован новый пользователь {username}')
+        logger.info('Зарегистрирован новый пользователь %s', username)
 
 
 class UserLoginAPIView(APIView):
@@ -64,11 +116,12 @@ class UserLoginAPIView(APIView):
         user = authenticate(username=username, password=password)
 
         if user is None:
-            logger.warning(f'Неудачная попытка входа в систему')
+            logger.warning('Неудачная попытка входа в систему', extra={'event': 'login_failed'})
             return Response({'detail': 'Неверные данные.'}, status=status.HTTP_400_BAD_REQUEST)
         else:
             login(request, user)
-            logger.info(f'Пользователь {username} успешно вошёл в систему')
+            logger.info('Пользователь %s успешно вошёл в систему', username,
+                        extra={'event': 'login', 'user_id': user.pk})
             return Response(
                 {
                     'detail': 'Успешный вход в систему.',
@@ -83,8 +136,12 @@ class UserLoginAPIView(APIView):
 class UserLogoutAPIView(APIView):
     @staticmethod
     def get(request, format=None):
+        user_id = request.user.pk
+        # Сессия удаляется из базы и из кеша при её сбросе, пользователь — явно
         logout(request)
-        logger.info(f'Пользователь {request.user} вышел из системы')
+        if user_id is not None:
+            forget_user(user_id)
+        logger.info('Пользователь %s вышел из системы', request.user)
 
         return Response({'detail': 'Успешный выход из системы.'}, status=status.HTTP_200_OK)
 
@@ -115,18 +172,28 @@ class CSRFTokenView(APIView):
 
 class CloudUserAPIRetrieveUpdateDestroy(generics.RetrieveUpdateDestroyAPIView):
     queryset = CloudUser.objects.all()
-    serializer_class = CloudUserSerializer
+    serializer_class = CloudUserAdminSerializer
     permission_classes = [IsAdmin]
 
-    def perform_destroy(self, instance):
-        instance.delete()
-        instance.delete_storage()
-        logger.info(f'Пользователь {instance} удален')
+    def destroy(self, request, *args, **kwargs):
+        instance = self.get_object()
+        # Удаление хранилища выполняет фоновая задача, а пользователь сразу теряет доступ к нему
+        job = Job.objects.filter(kind='delete_user', params__user_id=instance.pk,
+                                 status__in=[Job.QUEUED, Job.RUNNING]).first()
+        if job is None:
+            with transaction.atomic():
+                instance.is_active = False
+                instance.save(update_fields=['is_active'])
+                job = enqueue('delete_user', cloud_user=request.user, user_id=instance.pk)
+            link_keys = instance.files.exclude(external_link_key='').values_list('external_link_key', flat=True)
+            external_link_cache.discard(*link_keys)
+            logger.info('Пользователь %s поставлен в очередь на удаление', instance)
+        return job_response(job)
 
 
 class CloudUserAPIList(generics.ListAPIView):
     queryset = CloudUser.objects.all().order_by('-date_joined')
-    serializer_class = CloudUsersDetailSerializer
+    serializer_class = CloudUserListSerializer
     permission_classes = [IsAdmin]
 
 
@@ -134,15 +201,159 @@ class FileAPICreate(generics.CreateAPIView):
     queryset = File.objects.all()
     serializer_class = FileSerializer
     permission_classes = [IsAuthenticated]
+    multipart_overhead = 64 * 1024
+
+    def create(self, request, *args, **kwargs):
+        # Квоту проверяем по заголовку Content-Length до чтения тела запроса.
+        # Служебная часть multipart не учитывается, точная проверка выполняется при сохранении файла
+        content_length = int(request.META.get('CONTENT_LENGTH') or 0) - self.multipart_overhead
+        if not request.user.is_superuser and not request.user.has_space_for(content_length):
+            logger.warning('Пользователь %s превысил квоту хранилища', request.user)
+            raise QuotaExceeded()
+        return super().create(request, *args, **kwargs)
 
     def perform_create(self, serializer):
-        file_exist = self.queryset.filter(filename=serializer.validated_data['content'].name).filter(cloud_user=serializer.validated_data['cloud_user'])
-        if file_exist:
+        uploaded_file = serializer.validated_data['content']
+        cloud_user = serializer.validated_data['cloud_user']
+        if cloud_user != self.request.user and not self.request.user.is_superuser:
+            raise PermissionDenied()
+        try:
+            with transaction.atomic():
+                # Запись создаётся первой: при совпадении имени ограничение уникальности прервёт загрузку до записи на диск
+                file = serializer.save(filename=uploaded_file.name, size=uploaded_file.size, content='')
+                if not CloudUser.change_usage(cloud_user.pk, file.size, 1, quota=cloud_user.quota):
+                    raise QuotaExceeded()
+                blob = Blob.store_uploaded_file(uploaded_file)
+                file.content.name = blob.name
+                file.blob = blob
+                file.save(update_fields=['content', 'blob'])
+                index_files([file])
+                record_changes([(FileChange.CREATED, file)])
+        except IntegrityError:
             raise ValidationError({'content': ['Файл с таким именем уже существует']})
-        uploaded_file_name = serializer.validated_data['content'].name
-        uploaded_file_size = serializer.validated_data['content'].size
-        serializer.save(filename=uploaded_file_name, size=uploaded_file_size)
-        logger.info(f'Пользователь {serializer.validated_data["cloud_user"]} загрузил файл {serializer.validated_data["content"].name}')
+        logger.info('Пользователь %s загрузил файл %s', file.cloud_user, file.filename,
+                    extra={'event': 'upload', 'user_id': file.cloud_user_id, 'file_id': file.pk, 'size': file.size})
+
+
+class UploadSessionAPICreate(generics.CreateAPIView):
+    queryset = UploadSession.objects.all()
+    serializer_class = UploadSessionSerializer
+    permission_classes = [IsAuthenticated]
+
+    def create(self, request, *args, **kwargs):
+        response = super().create(request, *args, **kwargs)
+        response['Location'] = f'/api/files/uploads/{response.data["id"]}/'
+        response['Upload-Offset'] = 0
+        response['Access-Control-Expose-Headers'] = 'Location, Upload-Offset'
+        return response
+
+    def perform_create(self, serializer):
+        filename = serializer.validated_data['filename']
+        if File.objects.filter(filename=filename, cloud_user=self.request.user).exists():
+            raise ValidationError({'filename': ['Файл с таким именем уже существует']})
+        if not self.request.user.has_space_for(serializer.validated_data['size']):
+            raise QuotaExceeded()
+        session = serializer.save(cloud_user=self.request.user)
+        session.create_part()
+        logger.info('Пользователь %s начал загрузку файла %s размером %s', self.request.user, filename, session.size)
+
+
+class UploadSessionAPIDetail(generics.GenericAPIView):
+    queryset = UploadSession.objects.all()
+    serializer_class = UploadSessionSerializer
+    permission_classes = [IsAdminOrFileOwner]
+
+    @staticmethod
+    def offset_headers(response, session):
+        response['Upload-Offset'] = session.offset
+        response['Upload-Length'] = session.size
+        response['Cache-Control'] = 'no-store'
+        response['Access-Control-Expose-Headers'] = 'Upload-Offset, Upload-Length'
+        return response
+
+    def get(self, request, *args, **kwargs):
+        session = self.get_object()
+        return self.offset_headers(Response(self.get_serializer(session).data, status=status.HTTP_200_OK), session)
+
+    def head(self, request, *args, **kwargs):
+        session = self.get_object()
+        return self.offset_headers(Response(status=status.HTTP_200_OK), session)
+
+    def check_offset(self, session, offset, length):
+        """
+        Проверяет, что фрагмент начинается с принятого смещения и не выходит за пределы файла.
+        Возвращает ответ с ошибкой или None
+        """
+        if offset != session.offset:
+            return self.offset_headers(Response({'detail': 'Смещение фрагмента не совпадает с принятым'},
+                                                status=status.HTTP_409_CONFLICT), session)
+        if length > session.size - session.offset:
+            return self.offset_headers(Response({'detail': 'Фрагмент выходит за пределы файла'},
+                                                status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE), session)
+        return None
+
+    def patch(self, request, *args, **kwargs):
+        if request.content_type.split(';')[0].strip() != 'application/offset+octet-stream':
+            return Response({'detail': 'Фрагмент должен передаваться с типом application/offset+octet-stream'},
+                            status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+        try:
+            offset = int(request.headers['Upload-Offset'])
+            length = int(request.headers.get('Content-Length') or 0)
+        except (KeyError, ValueError):
+            return Response({'detail': 'Не указано смещение фрагмента'}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Смещение проверяется в короткой транзакции, а фрагмент принимается вне её:
+        # медленный клиент не держит соединение с базой и блокировку строки сессии
+        session = self.get_object()
+        response = self.check_offset(session, offset, length)
+        if response is not None:
+            return response
+        chunk_path, written = None, 0
+        if length and request.stream is not None:
+            chunk_path, written = session.write_chunk(request.stream, length)
+
+        with transaction.atomic():
+            # Блокируем сессию, чтобы фрагменты параллельных запросов не дописывались в файл одновременно
+            self.queryset = UploadSession.objects.select_for_update()
+            session = self.get_object()
+            response = self.check_offset(session, offset, written)
+            if response is not None:
+                if chunk_path:
+                    remove_files([chunk_path])
+                return response
+            if chunk_path:
+                session.offset += session.append_chunk(chunk_path)
+                session.save(update_fields=['offset', 'date_updated'])
+            if session.offset < session.size:
+                return self.offset_headers(Response(status=status.HTTP_204_NO_CONTENT), session)
+
+        # Файл собран: хеш и сжатая копия вычисляются после снятия блокировки сессии,
+        # а finalize заново блокирует сессию и проверяет, что её не завершил параллельный запрос
+        sha256, compressed = session.prepare_content()
+        # Принятые байты сохраняем даже при конфликте имён, поэтому ответ возвращается без исключения
+        try:
+            with transaction.atomic():
+                file = session.finalize(sha256, compressed)
+                record_changes([(FileChange.CREATED, file)])
+        except UploadSession.DoesNotExist:
+            return Response({'detail': 'Загрузка уже завершена'}, status=status.HTTP_404_NOT_FOUND)
+        except IntegrityError:
+            return self.offset_headers(Response({'filename': ['Файл с таким именем уже существует']},
+                                                status=status.HTTP_400_BAD_REQUEST), session)
+        except QuotaExceeded as error:
+            return self.offset_headers(Response({'detail': error.detail}, status=error.status_code), session)
+
+        index_files([file])
+        logger.info('Пользователь %s загрузил файл %s', session.cloud_user, file.filename,
+                    extra={'event': 'upload', 'user_id': file.cloud_user_id, 'file_id': file.pk, 'size': file.size})
+        return self.offset_headers(Response(FileSerializer(file).data, status=status.HTTP_201_CREATED), session)
+
+    def delete(self, request, *args, **kwargs):
+        session = self.get_object()
+        session.delete_part()
+        session.delete()
+        logger.info('Пользователь %s отменил загрузку файла %s', request.user, session.filename)
+        return Response(status=status.HTTP_204_NO_CONTENT)
 
 
 class FileAPIRetrieveUpdateDestroy(generics.RetrieveUpdateDestroyAPIView):
@@ -151,27 +362,177 @@ class FileAPIRetrieveUpdateDestroy(generics.RetrieveUpdateDestroyAPIView):
     permission_classes = [IsAdminOrFileOwner]
 
     def perform_destroy(self, instance):
-        storage = instance.content.storage
-        path = instance.content.path
-        instance.delete()
-        storage.delete(path)
-        logger.info(f'Файл {instance} пользователя {instance.cloud_user} удалён')
+        storage = instance.storage
+        preview_key = get_preview_key(instance)
+        with transaction.atomic():
+            record_changes([(FileChange.DELETED, instance)])
+            instance.delete()
+            CloudUser.change_usage(instance.cloud_user_id, -instance.size, -1)
+        external_link_cache.discard(instance.external_link_key)
+        preview_cache.discard(preview_key)
+        if instance.blob:
+            instance.blob.release()
+        else:
+            storage.delete([instance.content.name])
+        logger.info('Файл %s пользователя %s удалён', instance, instance.cloud_user)
 
     def perform_update(self, serializer):
+        # Кешированная ссылка хранит имя файла и перестаёт действовать при смене или удалении ключа
+        external_link_cache.discard(serializer.instance.external_link_key)
         if 'filename' in serializer.validated_data:
-            file_exist = self.queryset.filter(filename=serializer.validated_data['filename']).filter(cloud_user=self.request.user)
-            if file_exist:
-                raise ValidationError({'content': ['Файл с таким именем уже существует']})
             old_name = serializer.instance.filename
-            old_path = serializer.instance.content.path
             new_filename = serializer.validated_data['filename']
-            content = serializer.instance.cloud_user.username + '/' + new_filename
-            os.rename(old_path, os.path.join(serializer.instance.content.storage.location, serializer.instance.cloud_user.username, new_filename))
-            serializer.save(content=content)
-            logger.info(f'Пользователь {self.request.user} изменил имя файла {old_name} на {new_filename}')
+            # Ключ миниатюры зависит от имени файла: старая миниатюра больше не понадобится
+            preview_key = get_preview_key(serializer.instance)
+            # Путь к содержимому не зависит от имени файла, поэтому переименование меняет только запись в базе
+            try:
+                with transaction.atomic():
+                    serializer.save()
+                    index_files([serializer.instance])
+                    record_changes([(FileChange.RENAMED if new_filename != old_name else FileChange.UPDATED,
+                                     serializer.instance)])
+            except IntegrityError:
+                raise ValidationError({'content': ['Файл с таким именем уже существует']})
+            if new_filename != old_name:
+                preview_cache.discard(preview_key)
+            logger.info('Пользователь %s изменил имя файла %s на %s', self.request.user, old_name, new_filename)
         else:
-            serializer.save()
-            logger.info(f'Пользователь {self.request.user} изменил данные файла {serializer.instance.filename}')
+            try:
+                with transaction.atomic():
+                    serializer.save()
+                    if 'comment' in serializer.validated_data:
+                        index_files([serializer.instance])
+                    record_changes([(FileChange.UPDATED, serializer.instance)])
+            except IntegrityError:
+                raise ValidationError({'external_link_key': ['Такой ключ внешней ссылки уже используется']})
+            logger.info('Пользователь %s изменил данные файла %s', self.request.user, serializer.instance.filename)
+
+
+class FileAPIBulkUpload(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, format=None):
+        serializer = FileBulkUploadSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        cloud_user = serializer.validated_data.get('cloud_user', request.user)
+        if cloud_user != request.user and not request.user.is_superuser:
+            raise PermissionDenied()
+        uploaded_files = serializer.validated_data['files']
+
+        # Совпадения имён с уже загруженными файлами проверяются одним запросом
+        taken = set(File.objects.filter(cloud_user=cloud_user, filename__in=[file.name for file in uploaded_files])
+                    .values_list('filename', flat=True))
+        results = []
+        accepted = []
+        for uploaded_file in uploaded_files:
+            if uploaded_file.name in taken:
+                results.append({'filename': uploaded_file.name, 'status': status.HTTP_400_BAD_REQUEST,
+                                'detail': 'Файл с таким именем уже существует'})
+                continue
+            taken.add(uploaded_file.name)
+            accepted.append(uploaded_file)
+            results.append({'filename': uploaded_file.name, 'status': status.HTTP_201_CREATED})
+
+        if accepted:
+            try:
+                with transaction.atomic():
+                    # Записи создаются первыми: при совпадении имени ограничение уникальности прервёт загрузку
+                    # до записи содержимого на диск
+                    files = File.objects.bulk_create([
+                        File(cloud_user=cloud_user, filename=uploaded_file.name, size=uploaded_file.size,
+                             comment=serializer.validated_data['comment'], content='')
+                        for uploaded_file in accepted
+                    ])
+                    if not CloudUser.change_usage(cloud_user.pk, sum(file.size for file in accepted), len(accepted),
+                                                  quota=cloud_user.quota):
+                        raise QuotaExceeded()
+                    for file, uploaded_file in zip(files, accepted):
+                        file.blob = Blob.store_uploaded_file(uploaded_file)
+                        file.content.name = file.blob.name
+                    File.objects.bulk_update(files, ['content', 'blob'])
+                    index_files(files)
+                    record_changes((FileChange.CREATED, file) for file in files)
+            except IntegrityError:
+                return Response({'detail': 'Файлы с такими именами уже существуют'}, status=status.HTTP_409_CONFLICT)
+            created = {file.filename: file.pk for file in files}
+            for result in results:
+                if result['status'] == status.HTTP_201_CREATED:
+                    result['id'] = created[result['filename']]
+        logger.info('Пользователь %s загрузил файлов: %s из %s', request.user, len(accepted), len(uploaded_files))
+        return Response({'results': results}, status=status.HTTP_200_OK)
+
+
+class FileAPIBulkDelete(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, format=None):
+        serializer = FileBulkDeleteSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = list(dict.fromkeys(serializer.validated_data['ids']))
+        # Файлы удаляет фоновая задача, результат по каждому файлу сохраняется в её результате
+        job = enqueue('delete_files', cloud_user=request.user, ids=ids, user_id=request.user.pk,
+                      is_superuser=request.user.is_superuser)
+        files = File.objects.filter(pk__in=ids).exclude(external_link_key='')
+        if not request.user.is_superuser:
+            files = files.filter(cloud_user=request.user)
+        external_link_cache.discard(*files.values_list('external_link_key', flat=True))
+        logger.info('Пользователь %s поставил в очередь удаление файлов: %s', request.user, len(ids))
+        return job_response(job)
+
+
+class FileAPIBulkUpdate(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, format=None):
+        serializer = FileBulkUpdateSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        items = serializer.validated_data['items']
+        files = File.objects.only('id', 'cloud_user', 'filename', 'comment', 'external_link_key', 'content') \
+            .in_bulk([item['id'] for item in items])
+
+        # Занятые имена у затронутых пользователей, кроме имён самих переименовываемых файлов
+        renamed_ids = [item['id'] for item in items if 'filename' in item]
+        taken = set(File.objects.filter(cloud_user__in={file.cloud_user_id for file in files.values()},
+                                        filename__in=[item['filename'] for item in items if 'filename' in item])
+                    .exclude(pk__in=renamed_ids).values_list('cloud_user', 'filename'))
+        results = []
+        changed = {}
+        renamed = set()
+        renamed_previews = []
+        for item in items:
+            file = files.get(item['id'])
+            if file is None:
+                results.append({'id': item['id'], 'status': status.HTTP_404_NOT_FOUND, 'detail': 'Файл не найден'})
+                continue
+            if file.cloud_user_id != request.user.pk and not request.user.is_superuser:
+                results.append({'id': item['id'], 'status': status.HTTP_403_FORBIDDEN, 'detail': 'Нет доступа к файлу'})
+                continue
+            if 'filename' in item and item['filename'] != file.filename:
+                if (file.cloud_user_id, item['filename']) in taken:
+                    results.append({'id': item['id'], 'status': status.HTTP_400_BAD_REQUEST,
+                                    'detail': 'Файл с таким именем уже существует'})
+                    continue
+                taken.add((file.cloud_user_id, item['filename']))
+                renamed_previews.append(get_preview_key(file))
+                renamed.add(file.pk)
+                file.filename = item['filename']
+            if 'comment' in item:
+                file.comment = item['comment']
+            changed[file.pk] = file
+            results.append({'id': item['id'], 'status': status.HTTP_200_OK})
+
+        try:
+            with transaction.atomic():
+                File.objects.bulk_update(changed.values(), ['filename', 'comment'])
+                index_files(changed.values())
+                record_changes((FileChange.RENAMED if file.pk in renamed else FileChange.UPDATED, file)
+                               for file in changed.values())
+        except IntegrityError:
+            return Response({'detail': 'Файлы с такими именами уже существуют'}, status=status.HTTP_409_CONFLICT)
+        external_link_cache.discard(*[file.external_link_key for file in changed.values() if file.external_link_key])
+        preview_cache.discard(*renamed_previews)
+        logger.info('Пользователь %s изменил данные файлов: %s из %s', request.user, len(changed), len(items))
+        return Response({'results': results}, status=status.HTTP_200_OK)
 
 
 class UserFilesAPIRetrieve(generics.RetrieveAPIView):
@@ -180,6 +541,168 @@ class UserFilesAPIRetrieve(generics.RetrieveAPIView):
     permission_classes = [IsAdminOrUser]
 
 
+class FileAPIList(generics.ListAPIView):
+    serializer_class = FileSerializer
+    permission_classes = [IsAuthenticated]
+    pagination_class = FileCursorPagination
+    filter_backends = [filters.OrderingFilter]
+    ordering_fields = ['filename', 'size', 'date_uploaded']
+    ordering = ['-date_uploaded']
+
+    def get_queryset(self):
+        params = self.request.query_params
+        cloud_user = self.request.user
+        # Администратор может просматривать файлы любого пользователя
+        if 'user' in params and self.request.user.is_superuser:
+            try:
+                cloud_user = int(params['user'])
+            except ValueError:
+                raise ValidationError({'user': ['Некорректный идентификатор пользователя']})
+        queryset = File.objects.filter(cloud_user=cloud_user)
+
+        if params.get('name'):
+            queryset = queryset.filter(filename__startswith=params['name'])
+        for param, lookup in (('size_min', 'size__gte'), ('size_max', 'size__lte')):
+            if param in params:
+                try:
+                    queryset = queryset.filter(**{lookup: int(params[param])})
+                except ValueError:
+                    raise ValidationError({param: ['Размер должен быть целым числом']})
+        for param, lookup in (('uploaded_after', 'date_uploaded__gte'), ('uploaded_before', 'date_uploaded__lte')):
+            if param in params:
+                value = parse_datetime(params[param])
+                if value is None:
+                    raise ValidationError({param: ['Дата должна быть в формате ISO 8601']})
+                queryset = queryset.filter(**{lookup: value})
+        return queryset
+
+
+class FileSearchAPIList(generics.ListAPIView):
+    serializer_class = FileSearchResultSerializer
+    permission_classes = [IsAuthenticated]
+    pagination_class = FileSearchPagination
+
+    def get_queryset(self):
+        params = self.request.query_params
+        cloud_user = self.request.user
+        # Администратор может искать среди файлов любого пользователя
+        if 'user' in params and self.request.user.is_superuser:
+            try:
+                cloud_user = int(params['user'])
+            except ValueError:
+                raise ValidationError({'user': ['Некорректный идентификатор пользователя']})
+        query = params.get('q', '').strip()
+        if not query:
+            raise ValidationError({'q': ['Укажите строку поиска']})
+        if len(query) > File._meta.get_field('comment').max_length:
+            raise ValidationError({'q': ['Строка поиска слишком длинная']})
+        mode = params.get('mode', SUBSTRING)
+        if mode not in MODES:
+            raise ValidationError({'mode': [f'Допустимые режимы поиска: {", ".join(MODES)}']})
+        return search_files(cloud_user, query, mode)
+
+
+def get_archive_entries(files, prefix_username=False):
+    """
+    Формирует элементы архива, пропуская файлы, отсутствующие в хранилище
+    """
+    for file in files:
+        # Архив читает файлы с холодного уровня на месте, не возвращая их в основное хранилище
+        storage = file.storage
+        try:
+            stored_size, _ = storage.stat(file.content.name)
+        except FileNotFoundError:
+            logger.error('Файл отсутствует по пути %s', file.content)
+            continue
+        # Имена файлов из базы не должны задавать каталоги внутри архива
+        filename = safe_basename(file.filename)
+        arcname = f'{file.cloud_user.username}/{filename}' if prefix_username else filename
+        encoding = file.content_encoding
+        yield (arcname, storage, file.content.name, file.date_uploaded, file.size if encoding else stored_size,
+               encoding)
+
+
+def archive_response(entries, archive_name):
+    response = StreamingHttpResponse(stream_zip(entries), content_type='application/zip')
+    response['Access-Control-Expose-Headers'] = 'Filename'
+    response['Content-Disposition'] = f'attachment; filename="{archive_name}"'
+    response['Filename'] = archive_name
+    return response
+
+
+class FileAPIArchive(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, format=None):
+        try:
+            ids = [int(pk) for pk in request.query_params.get('ids', '').split(',') if pk]
+        except ValueError:
+            raise ValidationError({'ids': ['Укажите идентификаторы файлов через запятую']})
+        if not ids:
+            raise ValidationError({'ids': ['Укажите идентификаторы файлов через запятую']})
+        files = File.objects.filter(pk__in=ids).select_related('cloud_user').order_by('cloud_user', 'filename')
+        if not request.user.is_superuser:
+            files = files.filter(cloud_user=request.user)
+        owners = set(files.values_list('cloud_user', flat=True).distinct())
+        if not owners:
+            raise NotFound(detail='Файлы не найдены')
+        with download_throttle.limit(request, user=request.user) as limit:
+            logger.info('Пользователь %s скачивает архив из %s файлов', request.user, len(ids))
+            entries = get_archive_entries(files.iterator(), prefix_username=len(owners) > 1)
+            return limit.attach(archive_response(entries, 'files.zip'))
+
+
+class UserFilesAPIArchive(generics.RetrieveAPIView):
+    queryset = CloudUser.objects.all()
+    permission_classes = [IsAdminOrUser]
+
+    def get(self, request, *args, **kwargs):
+        cloud_user = self.get_object()
+        files = cloud_user.files.select_related('cloud_user').order_by('filename')
+        with download_throttle.limit(request, user=request.user) as limit:
+            logger.info('Пользователь %s скачивает архив хранилища пользователя %s', request.user, cloud_user)
+            return limit.attach(archive_response(get_archive_entries(files.iterator()), f'{cloud_user.username}.zip'))
+
+
+# Ответы на скачивание, которые учитываются в статистике.
+# Перенаправление на скачивание прямо из хранилища считается скачиванием файла целиком
+DOWNLOAD_STATUSES = (status.HTTP_200_OK, status.HTTP_206_PARTIAL_CONTENT, status.HTTP_302_FOUND)
+
+
+def throttled_response(error):
+    """
+    Ответ 429 для асинхронных представлений, исключения которых не обрабатывает DRF
+    """
+    response = JsonResponse({'detail': error.detail}, status=error.status_code)
+    response['Retry-After'] = error.wait
+    return response
+
+
+async def aauthenticate(request, required=True):
+    """
+    Аутентифицирует запрос к асинхронному представлению классами DEFAULT_AUTHENTICATION_CLASSES, как это делает DRF.
+    Возвращает (пользователь, None) или (None, ответ с ошибкой): 401 с заголовком WWW-Authenticate
+    при отсутствующих или неверных учетных данных и код исключения при других ошибках (например, 403 для токена
+    без нужной области). Без required анонимный запрос проходит, отклоняются только неверные учетные данные
+    """
+    authenticators = [authenticator() for authenticator in api_settings.DEFAULT_AUTHENTICATION_CLASSES]
+    drf_request = Request(request, authenticators=authenticators)
+    try:
+        user = await sync_to_async(lambda: drf_request.user)()
+        if required and not user.is_authenticated:
+            raise NotAuthenticated()
+    except (AuthenticationFailed, NotAuthenticated) as error:
+        header = authenticators[0].authenticate_header(drf_request) if authenticators else None
+        response = JsonResponse({'detail': error.detail},
+                                status=status.HTTP_401_UNAUTHORIZED if header else status.HTTP_403_FORBIDDEN)
+        if header:
+            response['WWW-Authenticate'] = header
+        return None, response
+    except APIException as error:
+        return None, JsonResponse({'detail': error.detail}, status=error.status_code)
+    return user, None
+
+
 class FileAPIDownload(generics.RetrieveAPIView):
     queryset = File.objects.all()
     serializer_class = FileSerializer
@@ -190,22 +713,28 @@ class FileAPIDownload(generics.RetrieveAPIView):
         try:
             file = self.queryset.get(pk=pk)
         except ObjectDoesNotExist:
-            logger.error(f'Файл с ключом {pk} не найден в базе данных')
+            logger.error('Файл с ключом %s не найден в базе данных', pk)
             raise NotFound(detail=f'Запись о файле c id {pk} не найдена в базе данных')
         self.check_object_permissions(request, file)
-        file_path = f'{MEDIA_ROOT}/{file.content}'
-        if os.path.exists(file_path):
-            response = FileResponse(open(file_path, 'rb'), as_attachment=True)
-            response['Access-Control-Expose-Headers'] = 'Filename'
-            response['Content-Disposition'] = f'attachment; filename="{file}"'
-            response['Filename'] = file
-            file.last_download = timezone.now()
-            file.save()
-            logger.info(f'Успешно скачан файл {file.content}')
-            return response
-        else:
-            logger.error(f'Файл отсутствует по пути {file.content}')
-            return Response({'detail': 'Файл не найден'}, status=status.HTTP_404_NOT_FOUND)
+        with download_throttle.limit(request, user=request.user) as limit:
+            storage = get_download_storage(file)
+            if storage:
+                response = build_file_response(request, storage, file.content.name, file.filename, file.etag,
+                                               encoding=file.content_encoding, size=file.size)
+                limit.attach(response)
+                response['Access-Control-Expose-Headers'] = 'Filename, Content-Range, Accept-Ranges, ETag'
+                response['Content-Disposition'] = f'attachment; filename="{file}"'
+                response['Filename'] = file
+                if response.status_code in DOWNLOAD_STATUSES:
+                    size = int(response.get('Content-Length', file.size))
+                    download_stats.record(file.pk, size)
+                    logger.info('Успешно скачан файл %s', file.content,
+                                extra={'event': 'download', 'file_id': file.pk, 'size': size,
+                                       'status': response.status_code})
+                return response
+            else:
+                logger.error('Файл отсутствует по пути %s', file.content)
+                return Response({'detail': 'Файл не найден'}, status=status.HTTP_404_NOT_FOUND)
 
 
 class FileAPIExternalDownload(generics.RetrieveAPIView):
@@ -214,24 +743,136 @@ class FileAPIExternalDownload(generics.RetrieveAPIView):
 
     def get(self, request, *args, **kwargs):
         link_key = kwargs.get('link_key')
+        # Ограничения ссылки проверяются до поиска файла, чтобы перебор ключей не нагружал базу
+        with download_throttle.limit(request, link_key=link_key) as limit:
+            link = resolve_external_link(link_key)
+            if link is None:
+                logger.error('Попытка скачать файл с внешним ключом %s, который не найден в базе данных', link_key)
+                return redirect('/download')
+            link, storage = get_external_link_storage(link_key, link)
+            if storage:
+                response = build_file_response(request, storage, link.content, link.filename, link.etag,
+                                               encoding=link.encoding, size=link.size)
+                limit.attach(response)
+                response['Access-Control-Expose-Headers'] = 'Filename, Content-Range, Accept-Ranges, ETag'
+                response['Content-Disposition'] = f'attachment; filename="{link.filename}"'
+                response['Filename'] = link.filename
+                if response.status_code in DOWNLOAD_STATUSES:
+                    size = int(response.get('Content-Length', link.size))
+                    download_stats.record(link.file_id, size)
+                    logger.info('Успешно скачан файл %s', link.content,
+                                extra={'event': 'download', 'file_id': link.file_id, 'size': size,
+                                       'status': response.status_code, 'external': True})
+                return response
+            else:
+                logger.error('Попытка скачать файл с внешним ключом %s, отсутствуещий на диске', link_key)
+                return redirect('/download')
+
+
+class FileAsyncDownload(View):
+    async def get(self, request, *args, **kwargs):
+        pk = kwargs.get('pk')
+        user, response = await aauthenticate(request)
+        if response is not None:
+            return response
         try:
-            file = self.queryset.get(external_link_key=link_key)
+            file = await File.objects.aget(pk=pk)
         except ObjectDoesNotExist:
-            logger.error(f'Попытка скачать файл с внешним ключом {link_key}, который не найден в базе данных')
-            return redirect('/download')
-        file_path = f'{MEDIA_ROOT}/{file.content}'
-        if os.path.exists(file_path):
-            response = FileResponse(open(file_path, 'rb'), as_attachment=True)
-            response['Access-Control-Expose-Headers'] = 'Filename'
-            response['Content-Disposition'] = f'attachment; filename="{file}"'
-            response['Filename'] = file
-            file.last_download = timezone.now()
-            file.save()
-            logger.info(f'Успешно скачан файл {file.content}')
+            logger.error('Файл с ключом %s не найден в базе данных', pk)
+            return JsonResponse({'detail': f'Запись о файле c id {pk} не найдена в базе данных'},
+                                status=status.HTTP_404_NOT_FOUND)
+        if not (user.pk == file.cloud_user_id or user.is_superuser):
+            return JsonResponse({'detail': 'У вас недостаточно прав для выполнения данного действия.'},
+                                status=status.HTTP_403_FORBIDDEN)
+        try:
+            async with download_throttle.limit(request, user=user) as limit:
+                storage = await sync_to_async(get_download_storage)(file)
+                if storage:
+                    response = await abuild_file_response(request, storage, file.content.name, file.filename,
+                                                          file.etag, encoding=file.content_encoding, size=file.size)
+                    limit.attach(response)
+                    response['Access-Control-Expose-Headers'] = 'Filename, Content-Range, Accept-Ranges, ETag'
+                    response['Content-Disposition'] = f'attachment; filename="{file}"'
+                    response['Filename'] = file
+                    if response.status_code in DOWNLOAD_STATUSES:
+                        size = int(response.get('Content-Length', file.size))
+                        download_stats.record(file.pk, size)
+                        logger.info('Начато скачивание файла %s', file.content,
+                                    extra={'event': 'download', 'file_id': file.pk, 'size': size,
+                                           'status': response.status_code})
+                    return response
+                else:
+                    logger.error('Файл отсутствует по пути %s', file.content)
+                    return JsonResponse({'detail': 'Файл не найден'}, status=status.HTTP_404_NOT_FOUND)
+        except DownloadThrottled as error:
+            return throttled_response(error)
+
+
+class FileAsyncExternalDownload(View):
+    async def get(self, request, *args, **kwargs):
+        link_key = kwargs.get('link_key')
+        # Ссылка открыта всем, но неверные учетные данные отклоняются, как в синхронном представлении
+        _, response = await aauthenticate(request, required=False)
+        if response is not None:
             return response
-        else:
-            logger.error(f'Попытка скачать файл, отсутствуещий по пути {file.content}')
-            return redirect('/download')
+        try:
+            async with download_throttle.limit(request, link_key=link_key) as limit:
+                link = await aresolve_external_link(link_key)
+                if link is None:
+                    logger.error('Попытка скачать файл с внешним ключом %s, который не найден в базе данных', link_key)
+                    return redirect('/download')
+                link, storage = await sync_to_async(get_external_link_storage)(link_key, link)
+                if storage:
+                    response = await abuild_file_response(request, storage, link.content, link.filename,
+                                                          link.etag, encoding=link.encoding, size=link.size)
+                    limit.attach(response)
+                    response['Access-Control-Expose-Headers'] = 'Filename, Content-Range, Accept-Ranges, ETag'
+                    response['Content-Disposition'] = f'attachment; filename="{link.filename}"'
+                    response['Filename'] = link.filename
+                    if response.status_code in DOWNLOAD_STATUSES:
+                        size = int(response.get('Content-Length', link.size))
+                        download_stats.record(link.file_id, size)
+                        logger.info('Начато скачивание файла %s', link.content,
+                                    extra={'event': 'download', 'file_id': link.file_id, 'size': size,
+                                           'status': response.status_code, 'external': True})
+                    return response
+                else:
+                    logger.error('Попытка скачать файл с внешним ключом %s, отсутствуещий на диске', link_key)
+                    return redirect('/download')
+        except DownloadThrottled as error:
+            return throttled_response(error)
+
+
+class FilePreviewAPIView(generics.RetrieveAPIView):
+    queryset = File.objects.all()
+    serializer_class = FileSerializer
+    permission_classes = [IsAdminOrFileOwner]
+
+    def get(self, request, *args, **kwargs):
+        file = self.get_object()
+        etag = f'"{get_preview_key(file)}"'
+        conditional = get_conditional_response(request, etag=etag)
+        if conditional is not None:
+            conditional['ETag'] = etag
+            return conditional
+        # Миниатюра читается с того уровня, где лежит файл: просмотр списка не поднимает файлы с холодного уровня
+        try:
+            preview = open(get_preview_path(file, timeout=PREVIEW_TIMEOUT), 'rb')
+        except PreviewUnavailable as error:
+            return Response({'detail': str(error)}, status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+        except TimeoutError:
+            # Миниатюра продолжает строиться в пуле и будет отдана при повторном запросе
+            response = Response({'detail': 'Миниатюра ещё не готова'}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+            response['Retry-After'] = 1
+            return response
+        except FileNotFoundError:
+            logger.error('Файл отсутствует по пути %s', file.content)
+            return Response({'detail': 'Файл не найден'}, status=status.HTTP_404_NOT_FOUND)
+        response = FileResponse(preview, content_type='image/jpeg')
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, max-age=86400'
+        response['Access-Control-Expose-Headers'] = 'ETag'
+        return response
 
 
 class FileAPICreateExternalLink(generics.RetrieveAPIView):
@@ -244,20 +885,173 @@ class FileAPICreateExternalLink(generics.RetrieveAPIView):
         try:
             file = self.queryset.get(pk=pk)
         except ObjectDoesNotExist:
-            logger.error(f'Файл с ключом {pk} не найден в базе данных')
+            logger.error('Файл с ключом %s не найден в базе данных', pk)
             raise NotFound(detail=f'Запись о файле c id {pk} не найдена в базе данных')
         self.check_object_permissions(request, file)
-        for i in range(25):
-            external_link_key = generate_external_link_key()
-            if File.objects.filter(external_link_key=external_link_key).exists():
-                continue
-            else:
-                file.external_link_key = external_link_key
-                file.save()
-                logger.info(f'Успешная генерация внешнего ключа для файла {file.content}')
-                return self.retrieve(request, *args, **kwargs)
-        else:
-            logger.error(f'Ошибка генерации внешнего ключа для файла {file.content}')
-            return Response({'detail': 'Не удалось создать ключ внешней ссылки, обратитесь к администратору'},
-                            status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        old_link_key = file.external_link_key
+        file.external_link_key = generate_external_link_key(file.pk)
+        with transaction.atomic():
+            file.save(update_fields=['external_link_key'])
+            record_changes([(FileChange.UPDATED, file)])
+        external_link_cache.discard(old_link_key)
+        logger.info('Успешная генерация внешнего ключа для файла %s', file.content)
+        return Response(self.get_serializer(file).data, status=status.HTTP_200_OK)
+
+
+class JobAPIRetrieve(generics.RetrieveAPIView):
+    queryset = Job.objects.all()
+    serializer_class = JobSerializer
+    permission_classes = [IsAuthenticated, IsAdminOrFileOwner]
+
+
+class StorageCleanupAPIView(APIView):
+    permission_classes = [IsAdmin]
+
+    def post(self, request, format=None):
+        job = enqueue('cleanup_storage', cloud_user=request.user)
+        return job_response(job)
+
+
+class ApiTokenAPIListCreate(generics.ListCreateAPIView):
+    serializer_class = ApiTokenSerializer
+    # Токеном нельзя выпустить другой токен: при утечке он не даёт закрепиться в системе
+    authentication_classes = [BasicAuthentication, SessionAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        cloud_user = self.request.user
+        # Администратор может просмотреть токены любого пользователя
+        params = self.request.query_params
+        if 'user' in params and self.request.user.is_superuser:
+            try:
+                cloud_user = int(params['user'])
+            except ValueError:
+                raise ValidationError({'user': ['Некорректный идентификатор пользователя']})
+        return ApiToken.objects.filter(cloud_user=cloud_user).order_by('-date_created')
 
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        key, prefix, key_hash = generate_api_token()
+        serializer.save(cloud_user=request.user, prefix=prefix, key_hash=key_hash)
+        logger.info('Пользователь %s выпустил API-токен %s', request.user, serializer.instance)
+        # Сам токен не хранится на сервере и показывается только один раз
+        return Response({**serializer.data, 'key': key}, status=status.HTTP_201_CREATED)
+
+
+class ApiTokenAPIRetrieveDestroy(generics.RetrieveDestroyAPIView):
+    queryset = ApiToken.objects.all()
+    serializer_class = ApiTokenSerializer
+    authentication_classes = [BasicAuthentication, SessionAuthentication]
+    permission_classes = [IsAuthenticated, IsAdminOrFileOwner]
+
+    def perform_destroy(self, instance):
+        instance.delete()
+        logger.info('Пользователь %s отозвал API-токен %s пользователя %s',
+                    self.request.user, instance, instance.cloud_user)
+
+
+class MetricsAPIView(APIView):
+    permission_classes = [IsAdmin]
+
+    def get(self, request, format=None):
+        return HttpResponse(metrics_registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+# Клиент синхронизации передаёт произвольный идентификатор, под которым сохраняется его курсор
+SYNC_CLIENT_ID_PATTERN = re.compile(r'[A-Za-z0-9._-]{1,64}')
+
+
+def parse_changes_params(params, user, max_wait=CHANGES_MAX_WAIT):
+    """
+    Разбирает параметры запроса изменений: чей журнал, курсор, время ожидания (не больше max_wait),
+    размер ответа и идентификатор клиента
+    """
+    cloud_user_id = user.pk
+    # Администратор может читать журнал любого пользователя
+    if 'user' in params and user.is_superuser:
+        try:
+            cloud_user_id = int(params['user'])
+        except ValueError:
+            raise ValidationError({'user': ['Некорректный идентификатор пользователя']})
+    values = {}
+    for param in ('cursor', 'wait', 'limit'):
+        if param in params:
+            try:
+                values[param] = int(params[param])
+            except ValueError:
+                raise ValidationError({param: ['Значение должно быть целым числом']})
+            if values[param] < 0:
+                raise ValidationError({param: ['Значение не может быть отрицательным']})
+    client_id = params.get('client')
+    if client_id is not None and not SYNC_CLIENT_ID_PATTERN.fullmatch(client_id):
+        raise ValidationError({'client': ['Некорректный идентификатор клиента']})
+    wait = min(values.get('wait', 0), max_wait)
+    limit = min(values.get('limit', CHANGES_PAGE_SIZE), CHANGES_PAGE_SIZE) or CHANGES_PAGE_SIZE
+    return cloud_user_id, values.get('cursor'), wait, limit, client_id
+
+
+def build_changes_response(cloud_user_id, cursor, sequence, limit):
+    """
+    Возвращает данные ответа и код статуса. Вместе с изменениями отдаётся текущее состояние
+    затронутых файлов, которые ещё существуют
+    """
+    try:
+        changes, has_more = get_changes(cloud_user_id, cursor, sequence, limit)
+    except ChangesCompacted:
+        return {'detail': 'Журнал изменений уже сжат, выполните полную синхронизацию', 'cursor': sequence}, \
+            status.HTTP_410_GONE
+    files = File.objects.in_bulk({change.file_id for change in changes if change.action != FileChange.DELETED})
+    return {
+        'cursor': changes[-1].sequence if changes else cursor,
+        'has_more': has_more,
+        'changes': FileChangeSerializer(changes, many=True, context={'files': files}).data,
+    }, status.HTTP_200_OK
+
+
+class ChangesAPIView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, format=None):
+        # Ожидание занимает поток сервера, поэтому длинный опрос здесь ограничен сильнее, чем в ChangesAsyncView
+        cloud_user_id, cursor, wait, limit, client_id = parse_changes_params(request.query_params, request.user,
+                                                                             max_wait=CHANGES_SYNC_MAX_WAIT)
+        sequence = get_sequence(cloud_user_id)
+        if sequence is None:
+            raise NotFound(detail='Пользователь не найден')
+        # Без курсора возвращается текущий номер: с него клиент начинает после полной синхронизации
+        if cursor is None:
+            cursor = sequence
+        elif cursor > sequence:
+            raise ValidationError({'cursor': ['Курсор больше номера последнего изменения']})
+        if client_id:
+            remember_client(cloud_user_id, client_id, cursor)
+        if cursor == sequence and wait:
+            sequence = wait_for_changes(cloud_user_id, cursor, wait)
+        data, code = build_changes_response(cloud_user_id, cursor, sequence, limit)
+        return Response(data, status=code)
+
+
+class ChangesAsyncView(View):
+    async def get(self, request, *args, **kwargs):
+        user, response = await aauthenticate(request)
+        if response is not None:
+            return response
+        try:
+            cloud_user_id, cursor, wait, limit, client_id = parse_changes_params(request.GET, user)
+        except ValidationError as error:
+            return JsonResponse(error.detail, status=status.HTTP_400_BAD_REQUEST)
+        sequence = await sync_to_async(get_sequence)(cloud_user_id)
+        if sequence is None:
+            return JsonResponse({'detail': 'Пользователь не найден'}, status=status.HTTP_404_NOT_FOUND)
+        if cursor is None:
+            cursor = sequence
+        elif cursor > sequence:
+            return JsonResponse({'cursor': ['Курсор больше номера последнего изменения']},
+                                status=status.HTTP_400_BAD_REQUEST)
+        if client_id:
+            await sync_to_async(remember_client)(cloud_user_id, client_id, cursor)
+        if cursor == sequence and wait:
+            sequence = await await_changes(cloud_user_id, cursor, wait)
+        data, code = await sync_to_async(build_changes_response)(cloud_user_id, cursor, sequence, limit)
+        return JsonResponse(data, status=code)
@@ -13,7 +13,6 @@
 import { useContext, useEffect } from 'react'
 import { useNavigate } from 'react-router-dom'
 import useRequest from '../../hooks/useRequest.jsx' // Подключение пользовательского хука для выполнения HTTP-запросов
-import getStorageSize from '../../utils/getStorageSize.js' // Вспомогательная функция для вычисления общего размера файлов
 import getConvertedFileSize from '../../utils/getConvertedFileSize.js' // Вспомогательная функция для конвертации размера файла
 import getTime from '../../utils/getTime.js' // Вспомогательная функция для форматирования времени
 
@@ -78,7 +77,7 @@ const User = (props) => {
   
 
   useEffect(() => {
-    (dataDelete.status === 204 || dataAdminRights.status === 200) && setUpdateDataFlag(true)
+    ([202, 204].includes(dataDelete.status) || dataAdminRights.status === 200) && setUpdateDataFlag(true)
   }, [dataDelete, dataAdminRights])
 
   return (
@@ -99,9 +98,9 @@ const User = (props) => {
                              checked={props.user.is_superuser} onChange={toggleAdminRights} />
                   }
                 </div>
-                <div className="user-container__files user-info">{props.user.files.length}</div>
+                <div className="user-container__files user-info">{props.user.files_count}</div>
                 <div className="user-container__storage-size user-info">
-                  {props.user.files.length > 0 ? getConvertedFileSize(getStorageSize(props.user.files)) : '-'}
+                  {props.user.files_count > 0 ? getConvertedFileSize(props.user.storage_size) : '-'}
                 </div>
                 {userID === props.user.id
                   ?